@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+ Runs the command line interface, see midv_tolkn_cli.py
+"""
+import sys
+
+from .midv_tolkn_cli import main
+
+sys.exit(main())
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+ Benchmarks for the midv_tolkn plugin, run without QGIS gui (see run_benchmarks.py)
+
+ Usage (from the folder containing the plugin folder, with the python environment of QGIS):
+    python -m midv_tolkn.benchmarks --scales 1000,10000,100000
+    python -m midv_tolkn.benchmarks --scales 1000 --compare midv_tolkn/benchmarks/results/<earlier result>.json
+
+ The benchmarks are not part of the plugin, exclude the folder when the plugin is zipped for upload.
+"""
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+ Runs the benchmarks, see run_benchmarks.py
+"""
+import sys
+
+from .run_benchmarks import main
+
+sys.exit(main())
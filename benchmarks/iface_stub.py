@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+ A stand-in for qgis.utils.iface, so LoadLayers and MessagebarAndLog can run without the QGIS gui.
+ The messages and the canvas calls are recorded instead of shown.
+"""
+import qgis.utils
+from qgis.PyQt.QtWidgets import QHBoxLayout, QWidget
+from qgis.core import QgsRectangle
+
+
+class MessageBarStub(object):
+    def __init__(self):
+        self.messages = []
+
+    def pushMessage(self, *args, **kwargs):
+        self.messages.append(args)
+
+    def createMessage(self, text):
+        self.messages.append((text, ))
+        widget = QWidget()
+        widget.setLayout(QHBoxLayout())
+        return widget
+
+    def pushWidget(self, widget, level=0, duration=0):
+        pass
+
+
+class MapCanvasStub(object):
+    def __init__(self):
+        self._extent = QgsRectangle()
+        self.refreshes = 0
+
+    def setExtent(self, extent):
+        self._extent = QgsRectangle(extent)
+
+    def extent(self):
+        return self._extent
+
+    def refresh(self):
+        self.refreshes += 1
+
+
+class IfaceStub(object):
+    def __init__(self):
+        self._message_bar = MessageBarStub()
+        self._map_canvas = MapCanvasStub()
+
+    def messageBar(self):
+        return self._message_bar
+
+    def mapCanvas(self):
+        return self._map_canvas
+
+    def mainWindow(self):
+        return None
+
+
+def install():
+    """ Sets qgis.utils.iface to a new IfaceStub and returns it """
+    iface = IfaceStub()
+    qgis.utils.iface = iface
+    return iface
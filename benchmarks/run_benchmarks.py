@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+ Times the heavy operations of the plugin on synthetic databases and writes the results as json
+
+ For each scale, a database is generated (see synthetic_db.py) and these are timed:
+    create, insert <table>:    Creating the database and inserting the features (with the insert triggers)
+    update <table>:            Updating all features (with the update triggers)
+    recalculate tillromr:      utils.recalculate_tillromr, full and incremental
+    upgrade:                   utils.UpgradeDatabase into a new database
+    load layers:               LoadLayers.add_layers with a stub iface
+
+ The query plans of the plugin sql and triggers are also checked for each scale (see midv_tolkn_planaudit.py)
+ and stored as plan_audit in the results. With --plan-baseline, the exit code is 1 if there are plan issues that
+ are not in the baseline file (written by --write-plan-baseline).
+
+ With --compare, the results are compared with an earlier result file and the exit code is 1 if any benchmark
+ is more than --tolerance times slower.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from qgis.core import Qgis, QgsProject
+from qgis.utils import spatialite_connect
+
+# plugin modules
+from .. import midv_tolkn_cli as cli
+from .. import midv_tolkn_planaudit as planaudit
+from .. import midv_tolkn_utils as utils
+from . import iface_stub
+from . import synthetic_db
+
+# Differences below this number of seconds are not counted as regressions
+NOISE_SECONDS = 0.05
+
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def best_of(repeat, function, *args, **kwargs):
+    """ Returns the shortest time of repeat runs """
+    return min([timed(function, *args, **kwargs) for _ in range(max(1, repeat))])
+
+
+def execute_and_commit(dbpath, sql):
+    conn = utils.ConnectionManager.get(dbpath)
+    conn.execute(sql)
+    conn.commit()
+
+
+def load_layers(iface, dbpath):
+    from ..load_tolkn_layers import LoadLayers
+
+    class HeadlessLoadLayers(LoadLayers):
+        """ LoadLayers without the dialogs in __init__ """
+        def __init__(self, iface, db, group_name='Midvatten_TolkningsDB'):
+            self.dbpath = db
+            self.group_name = group_name
+            self.iface = iface
+            self.root = QgsProject.instance().layerTreeRoot()
+
+    HeadlessLoadLayers(iface, dbpath).add_layers()
+
+
+def load_layers_and_clear(iface, dbpath):
+    seconds = timed(load_layers, iface, dbpath)
+    QgsProject.instance().clear()
+    return seconds
+
+
+def run_scale(scale, folder, epsg=3006, workers=1, repeat=1):
+    """
+    Generates the database for scale and runs the benchmarks
+
+    :return: OrderedDict {benchmark: seconds} and the plan audit {statement id: issues}
+    """
+    iface = iface_stub.install()
+    results = OrderedDict()
+    dbpath = synthetic_db.benchmark_db_path(folder, scale, epsg)
+    results.update(synthetic_db.generate_db(dbpath, scale, epsg))
+    plan_audit = planaudit.audit_database(dbpath)
+
+    results['update tillromr'] = timed(execute_and_commit, dbpath, """UPDATE tillromr SET gvbildn_mm = gvbildn_mm + 1""")
+    results['update gvmag'] = timed(execute_and_commit, dbpath, """UPDATE gvmag SET kommentar = 'benchmark'""")
+
+    results['recalculate tillromr'] = best_of(repeat, utils.recalculate_tillromr, dbpath)
+    if workers > 1:
+        results[f'recalculate tillromr ({workers} workers)'] = best_of(repeat, utils.recalculate_tillromr, dbpath, workers=workers)
+    execute_and_commit(dbpath, """UPDATE dagvyta SET bortledning_proc = bortledning_proc + 1 WHERE pkuid % 100 = 0""")
+    results['recalculate tillromr incremental (1 % of dagvyta changed)'] = timed(utils.recalculate_tillromr, dbpath, incremental=True)
+
+    upgraded_path = os.path.splitext(dbpath)[0] + '_upgraded.sqlite'
+    results['upgrade'] = cli.upgrade_db(dbpath, upgraded_path, epsg=epsg, overwrite=True)['timings']['upgrade']
+    if workers > 1:
+        results[f'upgrade ({workers} workers)'] = cli.upgrade_db(dbpath, upgraded_path, epsg=epsg, workers=workers, overwrite=True)['timings']['upgrade']
+
+    results['load layers'] = min([load_layers_and_clear(iface, dbpath) for _ in range(max(1, repeat))])
+    utils.ConnectionManager.close_all()
+    return results, plan_audit
+
+
+def environment():
+    conn = spatialite_connect(':memory:')
+    try:
+        spatialite_version = conn.execute('select spatialite_version()').fetchone()[0]
+    finally:
+        conn.close()
+    return OrderedDict([('plugin_version', cli.plugin_version()),
+                        ('qgis_version', Qgis.QGIS_VERSION),
+                        ('sqlite_version', sqlite3.sqlite_version),
+                        ('spatialite_version', spatialite_version),
+                        ('python_version', platform.python_version()),
+                        ('platform', platform.platform()),
+                        ('cpu_count', os.cpu_count())])
+
+
+def compare(baseline, current, tolerance):
+    """
+    Compares two result dicts
+
+    :return: list of (scale, benchmark, baseline seconds, current seconds, ratio) for the benchmarks that are
+             more than tolerance times (and NOISE_SECONDS) slower in current
+    """
+    regressions = []
+    for scale, results in current['results'].items():
+        baseline_results = baseline['results'].get(scale, {})
+        for benchmark, seconds in results.items():
+            if benchmark.startswith('features') or benchmark not in baseline_results:
+                continue
+            baseline_seconds = baseline_results[benchmark]
+            if seconds > baseline_seconds * tolerance and seconds - baseline_seconds > NOISE_SECONDS:
+                regressions.append((scale, benchmark, baseline_seconds, seconds, seconds / max(baseline_seconds, 1e-9)))
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m midv_tolkn.benchmarks', description="Benchmarks for the midv_tolkn plugin.")
+    parser.add_argument('--scales', default='1000', help="Comma separated numbers of features in the main layers, e.g. 1000,10000,100000")
+    parser.add_argument('--epsg', type=int, default=3006)
+    parser.add_argument('--workers', type=int, default=1, help="Also time recalculate and upgrade with this number of worker processes")
+    parser.add_argument('--repeat', type=int, default=1, help="Repeat the recalculation and the layer loading, the best time is used")
+    parser.add_argument('--folder', default=None, help="Folder for the databases, default is a temporary folder that is removed")
+    parser.add_argument('--output', default=None, help="The result file, default is results/<plugin version>_<time>.json in the benchmarks folder")
+    parser.add_argument('--compare', default=None, help="An earlier result file to compare with")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="A benchmark is a regression if it's this many times slower")
+    parser.add_argument('--plan-baseline', dest='plan_baseline', default=None, help="A plan audit baseline, new query plan issues are regressions")
+    parser.add_argument('--write-plan-baseline', dest='write_plan_baseline', default=None, help="Write the query plan issues of the last scale to this file")
+    parser.add_argument('--verbose', action='store_true', help="Write the log messages to stderr")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    cli.start_qgis(args.verbose, gui=True)
+
+    folder = args.folder or tempfile.mkdtemp(prefix='midv_tolkn_benchmarks_')
+    os.makedirs(folder, exist_ok=True)
+    result = OrderedDict([('started', datetime.datetime.now().isoformat(timespec='seconds')),
+                          ('environment', environment()),
+                          ('results', OrderedDict()),
+                          ('plan_audit', OrderedDict())])
+    plan_audits = []
+    try:
+        for scale in [int(s) for s in args.scales.split(',') if s.strip()]:
+            sys.stderr.write("Scale %s\n" % scale)
+            result['results'][str(scale)], plan_audit = run_scale(scale, folder, args.epsg, args.workers, args.repeat)
+            plan_audits.append(plan_audit)
+            result['plan_audit'][str(scale)] = planaudit.issues_by_statement(plan_audit)
+            for benchmark, seconds in result['results'][str(scale)].items():
+                sys.stderr.write("    %-60s %s\n" % (benchmark, seconds if benchmark.startswith('features') else '%.3f s' % seconds))
+    finally:
+        utils.ConnectionManager.close_all()
+        if args.folder is None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    output = args.output or os.path.join(os.path.dirname(__file__), 'results', '{}_{}.json'.format(
+        result['environment']['plugin_version'], datetime.datetime.now().strftime('%Y%m%dT%H%M%S')))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, result, args.tolerance)
+        result['compared_with'] = args.compare
+        result['regressions'] = [OrderedDict(zip(('scale', 'benchmark', 'baseline_seconds', 'seconds', 'ratio'), r)) for r in regressions]
+        for scale, benchmark, baseline_seconds, seconds, ratio in regressions:
+            sys.stderr.write("REGRESSION scale %s %s: %.3f s -> %.3f s (%.2f times)\n" % (scale, benchmark, baseline_seconds, seconds, ratio))
+        if regressions:
+            exit_code = 1
+
+    if args.write_plan_baseline and plan_audits:
+        with open(args.write_plan_baseline, 'w', encoding='utf-8') as f:
+            json.dump(planaudit.issues_by_statement(plan_audits[-1]), f, indent=2)
+    if args.plan_baseline:
+        with open(args.plan_baseline, encoding='utf-8') as f:
+            plan_baseline = json.load(f)
+        result['plan_regressions'] = OrderedDict()
+        for scale, plan_audit in zip(result['results'].keys(), plan_audits):
+            plan_regressions = planaudit.compare(plan_baseline, plan_audit)
+            if plan_regressions:
+                result['plan_regressions'][scale] = plan_regressions
+            for statement_id, issues in plan_regressions.items():
+                sys.stderr.write("PLAN REGRESSION scale %s %s: %s\n" % (scale, statement_id, ', '.join(issues)))
+        if result['plan_regressions']:
+            exit_code = 1
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    sys.stderr.write("Results written to %s\n" % output)
+    return exit_code
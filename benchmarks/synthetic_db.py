@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+ Generates tolknings-databases with synthetic features for the benchmarks
+
+ The database is created from the sql files of the plugin (create_tolkn_db.sql, the data domains and
+ insert_triggers.sql), then every layer gets features on a regular grid. The features are inserted with the
+ triggers active, so the insert timings include the triggers.
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+
+# plugin modules
+from .. import midv_tolkn_cli as cli
+from .. import midv_tolkn_defs as defs
+from .. import midv_tolkn_utils as utils
+
+# Number of features in each table relative to the scale
+TABLE_SCALES = OrderedDict([('gvmag', 1.0),
+                            ('tillromr', 1.0),
+                            ('dagvyta', 1.0),
+                            ('gvflode', 1.0),
+                            ('gvdel', 0.1),
+                            ('sprickzon', 0.1),
+                            ('strukturlinje', 0.1),
+                            ('trptid', 0.1),
+                            ('omattad_zon', 0.1),
+                            ('profillinje', 0.01),
+                            ('kommentarer_punkt', 0.01),
+                            ('kommentarer_linje', 0.01),
+                            ('kommentarer_yta', 0.01)])
+
+# Grid step and feature size (meters). tillromr is larger than dagvyta, so each tillromr intersects a few dagvyta.
+GRID = {'tillromr': (200, 200), 'dagvyta': (100, 60)}
+DEFAULT_GRID = (100, 90)
+ORIGIN = (400000, 6400000)
+
+X = f'({ORIGIN[0]} + (i % :side) * :step)'
+Y = f'({ORIGIN[1]} + (i / :side) * :step)'
+GEOMETRIES = {1: f'MakePoint({X}, {Y}, :srid)',
+              4: f'CastToMultiPoint(MakePoint({X}, {Y}, :srid))',
+              2: f'MakeLine(MakePoint({X}, {Y}, :srid), MakePoint({X} + :size, {Y} + :size, :srid))',
+              5: f'CastToMultiLinestring(MakeLine(MakePoint({X}, {Y}, :srid), MakePoint({X} + :size, {Y} + :size, :srid)))',
+              3: f'BuildMbr({X}, {Y}, {X} + :size, {Y} + :size, :srid)',
+              6: f'CastToMultiPolygon(BuildMbr({X}, {Y}, {X} + :size, {Y} + :size, :srid))'}
+
+COLUMN_VALUES = {'namn': """'{table} ' || i""",
+                 'gvbildn_mm': """150.0 + i % 100""",
+                 'andel_t_mag_proc': """50.0""",
+                 'bortledning_proc': """50.0 + i % 50""",
+                 'markanv': """'markanv ' || (i % 3)""",
+                 'projekt': """'projekt ' || (i % 10)""",
+                 'ursprung': """'benchmark'"""}
+
+
+def domain_value(domain_table):
+    """ Cycles through the values of the data domain, so the foreign keys are valid """
+    # (LIMIT and OFFSET can't use the outer i, so the pkuids are counted from the first one)
+    return f'''(SELECT typ FROM "{domain_table}"
+                WHERE pkuid >= (SELECT min(pkuid) FROM "{domain_table}") + i % (SELECT count(*) FROM "{domain_table}")
+                ORDER BY pkuid LIMIT 1)'''
+
+
+def insert_sql(schema, table):
+    """ Returns the insert statement for table, with the parameters n, side, step, size and srid """
+    layers = defs.default_layers()
+    domain_table = layers[table][0] if table in layers else None
+    columns = []
+    values = []
+    for column in schema.columns[table]:
+        if column == 'typ' and domain_table is not None:
+            value = domain_value(domain_table)
+        elif column == 'intermag':
+            value = domain_value('zz_gvflode')
+        elif column == 'typ':
+            value = """'typ ' || (i % 5)"""
+        elif column == 'geometry':
+            value = GEOMETRIES[schema.geometry(table)[1] % 1000]
+        else:
+            value = COLUMN_VALUES.get(column, '').format(table=table)
+        if value:
+            columns.append(f'"{column}"')
+            values.append(value)
+    return f'''INSERT INTO "{table}" ({', '.join(columns)})
+               WITH RECURSIVE s(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM s WHERE i < :n - 1)
+               SELECT {', '.join(values)} FROM s'''
+
+
+def generate_db(dbpath, scale, epsg=3006):
+    """
+    Creates dbpath (an existing file is replaced) and fills it with about scale features in the main layers
+
+    :return: OrderedDict with the seconds for 'create' and 'insert <table>' (including the triggers)
+             and the number of features as 'features <table>'.
+    """
+    timings = OrderedDict()
+    timings.update(cli.create_db(dbpath, epsg, overwrite=True)['timings'])
+    schema = utils.SchemaSnapshot.get(dbpath)
+    conn = utils.ConnectionManager.get(dbpath)
+    try:
+        for table, relative_scale in TABLE_SCALES.items():
+            if table not in schema.tables or schema.geometry(table) is None:
+                continue
+            n = max(1, int(scale * relative_scale))
+            step, size = GRID.get(table, DEFAULT_GRID)
+            start = time.time()
+            conn.execute(insert_sql(schema, table), {'n': n, 'side': int(math.ceil(math.sqrt(n))), 'step': step,
+                                                     'size': size, 'srid': int(epsg)})
+            conn.commit()
+            timings['insert ' + table] = time.time() - start
+            timings['features ' + table] = n
+        utils.update_layer_statistics(conn)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    return timings
+
+
+def benchmark_db_path(folder, scale, epsg=3006):
+    return os.path.join(folder, 'benchmark_{}_epsg_{}.sqlite'.format(scale, epsg))
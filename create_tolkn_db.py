@@ -20,126 +20,153 @@
 
 
 import datetime
+import hashlib
 import os
+import re
+import shutil
+import tempfile
 
 from qgis.PyQt.QtCore import QSettings, Qt
 from qgis.PyQt.QtWidgets import QApplication, QFileDialog, QInputDialog
-from qgis.core import Qgis
+from qgis.core import Qgis, QgsApplication
 from qgis.utils import spatialite_connect
 
 # plugin modules
+from . import midv_tolkn_sqltrace
 from . import midv_tolkn_utils as utils
+from .load_tolkn_layers import get_db_version, get_styles_folder
 
 
 class NewDb():
-    def __init__(self, iface, verno, user_select_CRS=True, EPSG_code=None, set_locale=False,db_path=''):
+    """
+    Creates a new tolknings-database
+
+    The dialogs (CRS and filename) are shown by ask_for_settings, the database is created by create_new_db.
+    With create=False only the dialogs are shown, so create_new_db can be run as a background task.
+    The new database is added to the SpatiaLite connections of QGIS unless register_connection is False.
+    """
+    def __init__(self, iface, verno, user_select_CRS=True, EPSG_code=None, set_locale=False,db_path='', create=True):
         self.dbpath = db_path
         self.iface = iface
-        self.create_new_db(verno,user_select_CRS,EPSG_code, set_locale)
-        
-    def create_new_db(self, verno, user_select_CRS=True, EPSG_code=None, set_locale=False, ):
-        """Open a new DataBase (create an empty one if file doesn't exists) and set as default DB"""
+        self.epsg_ids_to_keep = None
+        self.register_connection = True
+        if self.ask_for_settings(user_select_CRS, EPSG_code, set_locale) and create:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                if not self.create_new_db(verno):
+                    self.dbpath = ''
+            finally:
+                QApplication.restoreOverrideCursor()
+
+    @classmethod
+    def without_dialogs(cls, dbpath, EPSG_code):
+        """
+        Returns a NewDb for dbpath using EPSG_code, without showing any dialogs. create_new_db creates the database.
+        The database is not added to the SpatiaLite connections in the QGIS settings.
+        """
+        # With user_select_CRS=False and a db_path, ask_for_settings shows no dialogs
+        newdb = cls(None, None, user_select_CRS=False, db_path=dbpath, create=False)
+        newdb.register_connection = False
+        newdb.epsg_ids_to_keep = [str(EPSG_code)]
+        if str(EPSG_code) != '4326':
+            newdb.epsg_ids_to_keep.append('4326')
+        return newdb
+
+    def ask_for_settings(self, user_select_CRS=True, EPSG_code=None, set_locale=False):
+        """
+        Asks for CRS and (if not given) the filename of the new database
+        :return: True if the database should be created, else False (self.dbpath is then '')
+        """
         if user_select_CRS:
             epsgid = self.ask_for_CRS(set_locale, EPSG_code)
             if not epsgid:
                 self.iface.messageBar().pushMessage("Information","User aborted", 1,duration=5)
-                return
+                self.dbpath = ''
+                return False
         else:
             epsgid = '4326'
 
         epsgid = str(epsgid)
 
-        QApplication.setOverrideCursor(Qt.WaitCursor)
         if epsgid=='0' or not epsgid:
             utils.pop_up_info("Cancelling...")
-        else: # If a CRS is selectd, go on and create the database
-            #path and name of new db
-            if self.dbpath == '':
-                QApplication.restoreOverrideCursor()
-                self.dbpath = QFileDialog.getSaveFileName(None, "Ny tolknings-DB","midv_tolkndb.sqlite","Spatialite (*.sqlite)")[0]
-                QApplication.setOverrideCursor(Qt.WaitCursor)
-            if not self.dbpath:
-                QApplication.restoreOverrideCursor()
-                return
-            #create Spatialite database
-            else:
-                #delete the file if exists
-                if os.path.exists(self.dbpath):
-                    try:
-                        os.remove(self.dbpath)
-                    except OSError as e:
-                        utils.pop_up_info("Error: %s - %s." % (e.filename,e.strerror))
-                        QApplication.restoreOverrideCursor()
-                        return ''
-                try:
-                    # creating/connecting the test_db
-                    self.conn = spatialite_connect(self.dbpath)
-                    # creating a Cursor
-                    self.cur = self.conn.cursor()
-                    self.cur.execute("PRAGMA foreign_keys = ON")    #Foreign key constraints are disabled by default (for backwards compatibility), so must be enabled separately for each database connection separately.
-                except:
-                    utils.pop_up_info("Impossible to connect to selected DataBase")
-                    QApplication.restoreOverrideCursor()
-                    return ''
-                #First, find spatialite version
-                versionstext = self.cur.execute('select spatialite_version()').fetchall()
-                # load sql syntax to initialise spatial metadata, automatically create GEOMETRY_COLUMNS and SPATIAL_REF_SYS
-                # then the syntax defines a Midvatten TOLKNINGS-db according to the loaded .sql-file
-                if not int(versionstext[0][0][0]) > 3: # which file to use depends on spatialite version installed
-                    utils.pop_up_info("midv_tolkn plugin needs spatialite4.\nDatabase can not be created")
-                    return ''
-
-                filenamestring = "create_tolkn_db.sql"
-
-                SQLFile = os.path.join(os.sep,os.path.dirname(__file__),"sql_strings",filenamestring)
-                qgisverno = Qgis.QGIS_VERSION#We want to store info about which qgis-version that created the db
-                with open(SQLFile, 'r') as f:
-                    f.readline()  # first line is encoding info....
-                    try:
-                        for line in f:
-                            if not line:
-                                continue
-                            if line.startswith("#"):
-                                continue
-                            for replace_word, replace_with in [('CHANGETORELEVANTEPSGID', str(epsgid)),
-                                                               ('CHANGETOPLUGINVERSION', str(verno)),
-                                                               ('CHANGETOQGISVERSION',str(qgisverno)),
-                                                               ('CHANGETOSPLITEVERSION', str(versionstext[0][0]))]:
-                                line = line.replace(replace_word, replace_with)
-                            #replaced_line = line.replace('CHANGETOQGISVERSION',str(qgisverno)).replace('CHANGETOSPLITEVERSION',str(versionstext[0][0]))
-                            self.cur.execute(line)  # use tags to find and replace SRID and versioning info
-                    except Exception as e:
-                        utils.pop_up_info('Failed to create DB! sql failed:\n' + line + '\n\nerror msg:\n' + str(e))
-                    except:
-                        utils.pop_up_info('Failed to create DB!')
-                try:#spatial_ref_sys_aux not implemented until spatialite 4.3
-                    self.cur.execute(r"""delete from spatial_ref_sys_aux where srid NOT IN ('%s', '4326')""" % epsgid)
-                except:
-                    pass
-                epsg_ids_to_keep = [str(epsgid), '4326']
-                if EPSG_code is not None and EPSG_code not in epsg_ids_to_keep:
-                    epsg_ids_to_keep.append(str(EPSG_code))
-                self.cur.execute("""delete from spatial_ref_sys where srid NOT IN ({})""".format(', '.join(epsg_ids_to_keep)))
-
-                self.insert_datadomains()
-
-                self.add_triggers()
-
-                #self.cur.execute('vacuum')
-
-                #FINISHED WORKING WITH THE DATABASE, CLOSE CONNECTIONS
-                self.conn.commit()
-                self.conn.close()
-                #create SpatiaLite Connection in QGIS QSettings
-                settings=QSettings()
-                settings.beginGroup('/SpatiaLite/connections')
-                settings.setValue('%s/sqlitepath'%os.path.basename(self.dbpath),'%s'%self.dbpath)
-                settings.endGroup()
-
-                #Finally add the layer styles info into the data base
-                #AddLayerStyles(self.dbpath)
-
-        QApplication.restoreOverrideCursor()
+            self.dbpath = ''
+            return False
+        #path and name of new db
+        if self.dbpath == '':
+            self.dbpath = QFileDialog.getSaveFileName(None, "Ny tolknings-DB","midv_tolkndb.sqlite","Spatialite (*.sqlite)")[0]
+        if not self.dbpath:
+            return False
+        self.epsg_ids_to_keep = [str(epsgid), '4326']
+        if EPSG_code is not None and str(EPSG_code) not in self.epsg_ids_to_keep:
+            self.epsg_ids_to_keep.append(str(EPSG_code))
+        return True
+
+    def create_new_db(self, verno, feedback=None):
+        """
+        Creates the database self.dbpath (an existing file is replaced) using the settings from ask_for_settings
+        Shows no dialogs while running as a task, the errors are then written to the log.
+        :return: True if the database was created, else False
+        """
+        epsg_ids_to_keep = self.epsg_ids_to_keep
+        #delete the file if exists
+        if os.path.exists(self.dbpath):
+            utils.ConnectionManager.close(self.dbpath)
+            try:
+                os.remove(self.dbpath)
+            except OSError as e:
+                utils.pop_up_info("Error: %s - %s." % (e.filename,e.strerror))
+                return False
+
+        try:
+            # creating/connecting the test_db
+            self.conn = spatialite_connect(self.dbpath)
+            # creating a Cursor
+            self.cur = self.conn.cursor()
+            self.cur.execute("PRAGMA foreign_keys = ON")    #Foreign key constraints are disabled by default (for backwards compatibility), so must be enabled separately for each database connection separately.
+        except:
+            utils.pop_up_info("Impossible to connect to selected DataBase")
+            return False
+        #First, find spatialite version
+        versionstext = self.cur.execute('select spatialite_version()').fetchall()
+        if not int(versionstext[0][0][0]) > 3: # which file to use depends on spatialite version installed
+            utils.pop_up_info("midv_tolkn plugin needs spatialite4.\nDatabase can not be created")
+            return False
+        self.conn.close()
+        utils.check_cancelled(feedback)
+
+        # The database is copied from a cached template when possible, otherwise it's built and then cached
+        template_cache = TemplateDbCache()
+        template = template_cache.template_path(verno, epsg_ids_to_keep, str(versionstext[0][0]))
+        try:
+            if os.path.isfile(template):
+                shutil.copyfile(template, self.dbpath)
+            elif self.build_db(self.dbpath, epsg_ids_to_keep, feedback):
+                template_cache.store(self.dbpath, template)
+            utils.check_cancelled(feedback)
+        except utils.UserInterruptError:
+            # A half built database is removed
+            self.conn.close()
+            os.remove(self.dbpath)
+            raise
+
+        self.conn = spatialite_connect(self.dbpath, factory=midv_tolkn_sqltrace.connection_factory())
+        self.cur = self.conn.cursor()
+        self.stamp_versions(verno, str(versionstext[0][0]))
+
+        #FINISHED WORKING WITH THE DATABASE, CLOSE CONNECTIONS
+        self.conn.commit()
+        self.conn.close()
+        #create SpatiaLite Connection in QGIS QSettings
+        if self.register_connection:
+            settings=QSettings()
+            settings.beginGroup('/SpatiaLite/connections')
+            settings.setValue('%s/sqlitepath'%os.path.basename(self.dbpath),'%s'%self.dbpath)
+            settings.endGroup()
+
+        #Finally add the layer styles info into the data base
+        AddLayerStyles(self.dbpath)
+        return True
 
     def ask_for_CRS(self, set_locale, default_crs=None):
         # USER MUST SELECT CRS FIRST!!
@@ -154,14 +181,76 @@ class NewDb():
         else:
             return EPSGID
 
+    def build_db(self, dbpath, epsg_ids_to_keep, feedback=None):
+        """
+        Builds the database structure, data domains and triggers from the sql files into dbpath
+
+        The version strings in about_db are left as CHANGETO-tags, they are set by stamp_versions.
+        :param dbpath: The database file to build
+        :param epsg_ids_to_keep: List of EPSG-ids to keep in spatial_ref_sys. The first one is used for all geometry columns.
+        :return: True if all sql succeeded, else False
+        """
+        epsgid = epsg_ids_to_keep[0]
+        # The sql files are run on this connection, it's traced when the sql trace is enabled
+        self.conn = spatialite_connect(dbpath, factory=midv_tolkn_sqltrace.connection_factory())
+        self.cur = self.conn.cursor()
+        self.cur.execute("PRAGMA foreign_keys = ON")
+        # load sql syntax to initialise spatial metadata, automatically create GEOMETRY_COLUMNS and SPATIAL_REF_SYS
+        # then the syntax defines a Midvatten TOLKNINGS-db according to the loaded .sql-file
+        SQLFile = os.path.join(os.sep,os.path.dirname(__file__),"sql_strings","create_tolkn_db.sql")
+        all_ok = True
+        with open(SQLFile, 'r') as f:
+            f.readline()  # first line is encoding info....
+            try:
+                for line in f:
+                    if not line:
+                        continue
+                    if line.startswith("#"):
+                        continue
+                    line = line.replace('CHANGETORELEVANTEPSGID', str(epsgid))
+                    self.cur.execute(line)  # use tags to find and replace SRID
+            except Exception as e:
+                utils.pop_up_info('Failed to create DB! sql failed:\n' + line + '\n\nerror msg:\n' + str(e))
+                all_ok = False
+            except:
+                utils.pop_up_info('Failed to create DB!')
+                all_ok = False
+        try:#spatial_ref_sys_aux not implemented until spatialite 4.3
+            self.cur.execute(r"""delete from spatial_ref_sys_aux where srid NOT IN ('%s', '4326')""" % epsgid)
+        except:
+            pass
+        self.cur.execute("""delete from spatial_ref_sys where srid NOT IN ({})""".format(', '.join(epsg_ids_to_keep)))
+
+        if feedback is not None:
+            feedback.setProgress(60)
+        utils.check_cancelled(feedback)
+
+        all_ok = self.insert_datadomains() and all_ok
+
+        all_ok = self.add_triggers() and all_ok
+
+        # The (empty) statistics make the extent of the layers available without reading them, see utils.layer_statistics
+        utils.update_layer_statistics(self.conn)
+
+        self.conn.commit()
+        self.conn.close()
+        return all_ok
+
+    def stamp_versions(self, verno, splite_version):
+        """ Writes plugin, qgis and spatialite version into about_db (We want to store info about which qgis-version that created the db) """
+        qgisverno = Qgis.QGIS_VERSION
+        self.cur.execute("""UPDATE about_db SET description = replace(replace(replace(description, 'CHANGETOPLUGINVERSION', ?), 'CHANGETOQGISVERSION', ?), 'CHANGETOSPLITEVERSION', ?) WHERE description LIKE '%CHANGETO%'""",
+                         (str(verno), str(qgisverno), str(splite_version)))
+
     def insert_datadomains(self):
         filenamestring = 'insert_datadomain_sv.sql'
-        self.excecute_sqlfile(os.path.join(os.sep,os.path.dirname(__file__),"sql_strings",filenamestring))
+        return self.excecute_sqlfile(os.path.join(os.sep,os.path.dirname(__file__),"sql_strings",filenamestring))
 
     def add_triggers(self):
-        self.excecute_sqlfile(os.path.join(os.sep,os.path.dirname(__file__), "sql_strings", "insert_triggers.sql"))
+        return self.excecute_sqlfile(os.path.join(os.sep,os.path.dirname(__file__), "sql_strings", "insert_triggers.sql"))
 
     def excecute_sqlfile(self, sqlfilename):
+        all_ok = True
         with open(sqlfilename, 'r') as f:
             f.readline()  # first line is encoding info....
             for line in f:
@@ -173,59 +262,115 @@ class NewDb():
                     self.cur.execute(line)  # use tags to find and replace SRID and versioning info
                 except Exception as e:
                     utils.pop_up_info('Failed to create DB! sql failed:\n' + line + '\n\nerror msg:\n' + str(e))
+                    all_ok = False
+        return all_ok
+
+
+class TemplateDbCache():
+    """
+    Cache of pre-built, empty tolknings-databases
+
+    Building a database from the sql files takes seconds, so each combination of plugin version and
+    kept EPSG-ids is built once into the user profile folder and then copied for every new database.
+    The template filename contains a hash of the sql files and the spatialite version, so a template is
+    rebuilt automatically when any of them change.
+    """
+    sqlfiles = ['create_tolkn_db.sql', 'insert_datadomain_sv.sql', 'insert_triggers.sql']
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(QgsApplication.qgisSettingsDirPath(), 'midv_tolkn', 'db_templates')
+        self.cache_dir = cache_dir
+
+    def sql_hash(self, splite_version):
+        sha = hashlib.sha1(str(splite_version).encode('utf-8'))
+        for filename in self.sqlfiles:
+            with open(os.path.join(os.path.dirname(__file__), "sql_strings", filename), 'rb') as f:
+                sha.update(f.read())
+        return sha.hexdigest()[:12]
+
+    def template_path(self, verno, epsg_ids_to_keep, splite_version):
+        version = re.sub(r'[^0-9A-Za-z.]+', '_', str(verno)).strip('_')
+        filename = 'template_{}_epsg_{}_{}.sqlite'.format(version, '_'.join(epsg_ids_to_keep), self.sql_hash(splite_version))
+        return os.path.join(self.cache_dir, filename)
+
+    def store(self, dbpath, template):
+        """
+        Copies a newly built database (with the CHANGETO-version tags still in about_db) into the cache
+
+        Templates with the same version and EPSG-ids but built from older sql files are removed.
+        Failing to write the cache is not an error, the next database will just be built from scratch.
+        """
+        cache_dir = os.path.dirname(template)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_path = tempfile.mkstemp(suffix='.sqlite.tmp', dir=cache_dir)
+            os.close(fd)
+            try:
+                shutil.copyfile(dbpath, tmp_path)
+                old_template = re.compile(re.escape(os.path.basename(template).rsplit('_', 1)[0]) + r'_[0-9a-f]+\.sqlite$')
+                for filename in os.listdir(cache_dir):
+                    if old_template.match(filename):
+                        os.remove(os.path.join(cache_dir, filename))
+                os.replace(tmp_path, template)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except OSError as e:
+            utils.MessagebarAndLog.warning(log_msg="Could not store database template %s: %s" % (template, str(e)))
 
 
 class AddLayerStyles():
-    """ currently this class is not used although it should be, when storing layer styles in the database works better """
-    def __init__(self, dbpath):
+    """
+    Stores the qml files of the plugin (layer_styles/<version>/*.qml) as default styles in the table layer_styles
+
+    The database then carries its own styles, LoadLayers reads all of them using one query if the setting
+    midv_tolkn/styles_from_db is set (otherwise the qml files of the plugin are used).
+    A style is only written if it differs from the stored default style of the table (compared by sha1),
+    so running it again only updates the changed styles.
+    """
+    def __init__(self, dbpath, db_version=None):
         self.dbpath = dbpath
-        # creating/connecting the test_db
-        self.conn = spatialite_connect(self.dbpath)
-        # creating a Cursor
-        self.cur = self.conn.cursor()
-        self.cur.execute("PRAGMA foreign_keys = ON")    #Foreign key constraints are disabled by default (for backwards compatibility), so must be enabled separately for each database connection separately.
-        
-        #add layer styles
-        self.add_layer_styles_2_db()
-
-        #load style from file and set it as value into the layer styles table
-        self.style_from_file_into_db('gvmag', 'gvmag.qml','gvmag.sld')
-        self.style_from_file_into_db('gvdel', 'gvdel.qml','gvdel.sld')
-        self.style_from_file_into_db('gvflode', 'gvflode.qml','gvflode.sld')
-        try:
-            self.style_from_file_into_db('tillromr', 'tillromr.qml','tillromr.sld')
-        except:
-            pass
+        if db_version is None:
+            db_version = get_db_version(dbpath)
+        styles_folder = get_styles_folder(db_version)
+        conn = utils.ConnectionManager.get(dbpath)
         try:
-            self.style_from_file_into_db('sprickzon', 'sprickzon.qml','sprickzon.sld')
+            if not conn.execute("""SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'layer_styles'""").fetchone()[0]:
+                self.add_layer_styles_2_db(conn)
+            self.stored = self.styles_from_files_into_db(conn, styles_folder)
+            conn.commit()
         except:
-            pass
-        try:
-            self.style_from_file_into_db('strukturlinje', 'strukturlinje.qml','strukturlinje.sld')
-        except:
-            pass
-        self.cur.execute("PRAGMA foreign_keys = OFF")
-        #FINISHED WORKING WITH THE DATABASE, CLOSE CONNECTIONS
-        self.rs.close()
-        self.conn.close()
-    
-    def add_layer_styles_2_db(self):
-        SQLFile = os.path.join(os.sep,os.path.dirname(__file__),"sql_strings","add_layer_styles_2_db.sql")
+            conn.rollback()
+            raise
+
+    def add_layer_styles_2_db(self, conn):
         datetimestring = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        f = open(SQLFile, 'r')
-        linecounter = 1
-        for line in f:
-            if linecounter > 1:    # first line is encoding info....
-                self.rs = self.cur.execute(line.replace('CHANGETOCURRENTDATETIME',datetimestring).replace('CHANGETODBPATH',self.dbpath)) # use tags to find and replace SRID and versioning info
-            linecounter += 1
-
-    def style_from_file_into_db(self,layer,qml_file, sld_file):
-        with open(os.path.join(os.sep,os.path.dirname(__file__),"sql_strings",qml_file), 'r') as content_file:
-            content = content_file.read()
-        self.cur.execute("update layer_styles set styleQML=? where f_table_name=?",(content,layer))#Use parameterized arguments to allow sqlite3 to escape the quotes for you. (It also helps prevent SQL injection.
-        #"UPDATE posts SET html = ? WHERE id = ?", (html ,temp[i][1])
-        """
-        with open(os.path.join(os.sep,os.path.dirname(__file__),"sql_strings",sld_file), 'r') as content_file:
-            content = content_file.read()
-        self.cur.execute("update layer_styles set styleSLD=? where f_table_name=?",(content,layer))#Use parameterized arguments to allow sqlite3 to escape the quotes for you. (It also helps prevent SQL injection.
-        """
+        for statement in utils.sqlfile_statements("add_layer_styles_2_db.sql"):
+            conn.execute(statement.replace('CHANGETOCURRENTDATETIME', datetimestring))
+
+    def styles_from_files_into_db(self, conn, styles_folder):
+        """ :return: list of the tables that got a new or changed style """
+        geometry_columns = {row[0].lower(): row[1] for row in conn.execute("""SELECT f_table_name, f_geometry_column FROM geometry_columns""")}
+        stored_styles = {row[0]: (row[1], hashlib.sha1(row[2].encode('utf-8')).hexdigest() if row[2] is not None else None)
+                         for row in conn.execute("""SELECT f_table_name, id, styleQML FROM layer_styles WHERE useAsDefault ORDER BY update_time, id""")}
+        stored = []
+        for filename in sorted(os.listdir(styles_folder)):
+            if not filename.endswith('.qml'):
+                continue
+            tablename = filename[:-len('.qml')]
+            with open(os.path.join(styles_folder, filename), 'r', encoding='utf-8') as f:
+                qml = f.read()
+            qml_hash = hashlib.sha1(qml.encode('utf-8')).hexdigest()
+            if tablename in stored_styles:
+                style_id, stored_hash = stored_styles[tablename]
+                if stored_hash == qml_hash:
+                    continue
+                conn.execute("""UPDATE layer_styles SET styleQML = ?, update_time = CURRENT_TIMESTAMP WHERE id = ?""", (qml, style_id))
+            else:
+                conn.execute("""INSERT INTO layer_styles (f_table_catalog, f_table_schema, f_table_name, f_geometry_column, styleName, styleQML, useAsDefault, description, update_time)
+                                VALUES ('', '', ?, ?, ?, ?, 1, ?, CURRENT_TIMESTAMP)""",
+                             (tablename, geometry_columns.get(tablename.lower(), ''), tablename, qml, 'midv_tolkn plugin style from ' + os.path.basename(styles_folder)))
+            stored.append(tablename)
+        return stored
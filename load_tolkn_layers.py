@@ -19,15 +19,18 @@
 """
 
 
+import hashlib
 import os
 import sqlite3
-import re
+import time
+from collections import OrderedDict
 
 import qgis.utils
-from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtCore import QSettings, Qt
 from qgis.PyQt.QtWidgets import QApplication, QFileDialog
-from qgis.core import QgsLogger, QgsProject, QgsDataSourceUri, QgsVectorLayer, QgsRelation, QgsEditorWidgetSetup
-from qgis.utils import spatialite_connect
+from qgis.PyQt.QtXml import QDomDocument
+from qgis.core import QgsLogger, QgsProject, QgsDataSourceUri, QgsVectorLayer, QgsRelation, QgsEditorWidgetSetup, QgsWkbTypes, \
+    QgsValueMapFieldFormatter, QgsRectangle
 
 from . import midv_tolkn_defs as defs
 from . import midv_tolkn_utils as utils
@@ -65,15 +68,19 @@ class LoadLayers():
             QApplication.restoreOverrideCursor()
             
     def add_layers(self):
+        """
+        Loads the layers in phases: all layers are created, styled and get their editor widgets before they are
+        registered in the project with one addMapLayers call. The layer tree group is built detached and inserted
+        into the project tree once, and the canvas is refreshed once. The time of each phase is written to the log.
+        """
+        timings = OrderedDict()
+        start = time.time()
         obs_db_existing = self.root.findGroup('Midvatten_OBS_DB')
         if obs_db_existing:
             position_index = 1
         else:
             position_index = 0
 
-        main_group = qgis.core.QgsLayerTreeGroup(name=self.group_name, checked=True)
-        self.root.insertChildNode(position_index, main_group)
-
         uri = QgsDataSourceUri()
         uri.setDatabase(self.dbpath)
         canvas = self.iface.mapCanvas()
@@ -81,18 +88,28 @@ class LoadLayers():
         layer_name_list = [] 
         layer_dict = dict() # name as key and layer as value
 
-        # first add all data domains (beginning with zz_ in the database)
-        conn_ok, dd_tables = utils.sql_load_fr_db("select name from sqlite_master where name like 'zz_%'", self.dbpath)
-        if not conn_ok:
+        # The tables, geometry columns, spatial index status and version are read once and cached until the file changes
+        try:
+            schema = utils.SchemaSnapshot.get(self.dbpath)
+        except Exception as e:
+            utils.MessagebarAndLog.critical(bar_msg="Could not read the database schema, see log message panel",
+                                            log_msg="Reading the schema of %s failed: %s" % (self.dbpath, str(e)))
             return
-        #tstring = """DB error!!"""%(sql)
-        existing_tables = utils.sql_load_fr_db("""SELECT tbl_name FROM sqlite_master WHERE (type = 'table' OR type = 'view')""", self.dbpath)[1]
-        existing_tables = [x[0] for x in existing_tables]
-
-        d_domain_tables = [str(dd_table[0]) for dd_table in dd_tables]
+        # A quick check only, CheckSpatialIndex reads the whole table and is only used when upgrading.
+        if schema.missing_spatial_indexes(list(default_layers().keys()) + defs.comment_layers()):
+            utils.audit_spatial_indexes(self.dbpath, thorough=False)
+        existing_tables = schema.tables + schema.views
+        timings['read schema'] = time.time() - start
+
+        # The styles are set below, so QGIS doesn't have to look for a default style for each layer
+        layer_options = QgsVectorLayer.LayerOptions(loadDefaultStyle=False)
+
+        # The data domains are either loaded as zz_ layers (for ValueRelation widgets) or read into ValueMap widgets
+        use_value_maps = QSettings().value('midv_tolkn/domains_as_value_maps', False, type=bool)
+        d_domain_tables = [] if use_value_maps else schema.domain_tables()
         for tablename in d_domain_tables:
             uristring= 'dbname="' + self.dbpath + '" table="' + tablename + '"'
-            layer = QgsVectorLayer(uristring,tablename, 'spatialite')
+            layer = QgsVectorLayer(uristring,tablename, 'spatialite', layer_options)
             layer_list.append(layer)
             layer_name_list.append(layer.name())
 
@@ -100,7 +117,7 @@ class LoadLayers():
         for tablename in ['tillromr_summaflode']: #, 'profil' # Implementera vid behov
             try:
                 uristring= 'dbname="' + self.dbpath + '" ' + r"""table='{}'""".format(tablename)
-                layer = QgsVectorLayer(uristring, tablename, 'spatialite')
+                layer = QgsVectorLayer(uristring, tablename, 'spatialite', layer_options)
                 layer_list.append(layer)
             except:
                 pass
@@ -111,8 +128,7 @@ class LoadLayers():
                 continue
             #uristring= 'dbname="' + self.dbpath + '" table="' + tablename + '"'
             #layer = QgsVectorLayer(uristring,tablename, 'spatialite')
-            uri.setDataSource('', tablename, 'geometry')
-            layer = QgsVectorLayer(uri.uri(), tablename, 'spatialite')
+            layer = QgsVectorLayer(self.layer_uri(uri, schema, tablename), tablename, 'spatialite', layer_options)
 
             if layer.isValid():
                 layer_list.append(layer)
@@ -120,12 +136,6 @@ class LoadLayers():
             else:
                 qgis.utils.iface.messageBar().pushMessage("Warning","Table %s was not valid. DB probably created w old plugin version."%str(tablename), 1,duration=5)
 
-        if comment_created:
-            comment_group = main_group.addGroup('kommentarer')
-        else:
-            comment_group = None
-        zz_group = main_group.addGroup('värdeförråd')
-
         #then load all spatial layers
         layers = default_layers()  # ordered dict with layer-name:(zz_layer-name,layer_name_for_map_legend)
         for tablename, tup in list(layers.items()):
@@ -134,73 +144,76 @@ class LoadLayers():
                                                           "Table %s not found in db. DB probably created w old plugin version. And upgrade is suggested." % str(
                                                               tablename), 1, duration=5)
             else:
-                uri.setDataSource('',tablename,'geometry')
-                layer = QgsVectorLayer(uri.uri(), tablename, 'spatialite') # Adding the layer as 'spatialite' instead of ogr vector layer is preferred
+                layer = QgsVectorLayer(self.layer_uri(uri, schema, tablename), tablename, 'spatialite', layer_options) # Adding the layer as 'spatialite' instead of ogr vector layer is preferred
                 if layer.isValid():
                     layer_list.append(layer)
                     layer_name_list.append(layer.name())
                 else:
                     qgis.utils.iface.messageBar().pushMessage("Warning","Table %s was not valid. DB probably created w old plugin version."%str(tablename), 1,duration=5)
 
-        #now loop over all the layers and set styles etc
+        for layer in layer_list:
+            layer_dict[layer.name()] = layer
+        timings['create layers'] = time.time() - start - sum(timings.values())
 
-        db_version = self.get_db_version()
+        #now loop over all the layers and set styles
+        db_version = self.get_db_version(schema)
         styles_folder = self.get_styles_folder(db_version)
+        # The default styles stored in the database (if any) are read using one query. They are only used if
+        # midv_tolkn/styles_from_db is set, they are copies of the qml files from when the database was created
+        # (or last upgraded) and would otherwise hide later changes of the plugin's qml files.
+        db_styles = get_db_styles(self.dbpath) if QSettings().value('midv_tolkn/styles_from_db', False, type=bool) else {}
 
         for layer in layer_list:
-            QgsProject.instance().addMapLayers([layer],False)
-            if layer.name() in d_domain_tables:
-                zz_group.insertLayer(0,layer)
-            elif layer.name() in defs.comment_layers():
-                comment_group.insertLayer(0,layer)
-            else:
-                main_group.insertLayer(0,layer)
-
-            layer_dict[layer.name()] = layer
-
-            #now try to load the style file
+            if layer.name() in db_styles:
+                try:
+                    if StyleCache.apply_qml(layer, db_styles[layer.name()]):
+                        continue
+                except:
+                    pass
+            #now try to load the style file (parsed once and then kept in StyleCache)
             stylefile = os.path.join(styles_folder, layer.name() + ".qml")
             try:
-                layer.loadNamedStyle(stylefile)
+                StyleCache.apply(layer, stylefile)
             except:
                 pass
-            if layer.name() == 'gvmag':#zoom to gvmag extent
-                canvas.setExtent(layer.extent())
-            else:
-                pass
+        timings['styles'] = time.time() - start - sum(timings.values())
+
+        # fix value relations (or value maps)
+        links = [link for link in domain_links(db_version, layer_name_list, layers) if link[0] in layer_dict]
+        if use_value_maps:
+            domains = get_domains(self.dbpath, schema, links)
+            for lyr, field, domain_table, key_field, value_field in links:
+                self.create_layer_value_map(layer_dict[lyr], layer_dict[lyr].dataProvider().fieldNameIndex(field),
+                                            domains.get((domain_table, key_field, value_field), []))
+        else:
+            for lyr, field, domain_table, key_field, value_field in links:
+                self.create_layer_value_relations(layer_dict[lyr], layer_dict[domain_table], layer_dict[lyr].dataProvider().fieldNameIndex(field), key_field, value_field)
+        timings['editor widgets'] = time.time() - start - sum(timings.values())
 
+        # The layers are registered at once and the group is filled before it's inserted into the project tree,
+        # so the project and the layer tree only signal once.
+        QgsProject.instance().addMapLayers(layer_list, False)
+        main_group = qgis.core.QgsLayerTreeGroup(name=self.group_name, checked=True)
+        if comment_created:
+            comment_group = main_group.addGroup('kommentarer')
+        else:
+            comment_group = None
+        zz_group = main_group.addGroup('värdeförråd') if d_domain_tables else None
+
+        for layer in layer_list:
+            if layer.name() in d_domain_tables:
+                tree_layer = zz_group.insertLayer(0,layer)
+            elif layer.name() in defs.comment_layers():
+                tree_layer = comment_group.insertLayer(0,layer)
+            else:
+                tree_layer = main_group.insertLayer(0,layer)
             if layer.name() in defs.unchecked_layers():
-                #QgsProject.instance().layerTreeRoot().findLayer(layer.id()).setItemVisibilityChecked(False)
-                for _group in (main_group, comment_group):
-                    if not _group:
-                        continue
-                    _layer = _group.findLayer(layer.id())
-                    if _layer:
-                        _layer.setItemVisibilityChecked(False)
-                        break
+                tree_layer.setItemVisibilityChecked(False)
 
-        zz_group.setExpanded(False)
+        if zz_group:
+            zz_group.setExpanded(False)
         if comment_group:
             comment_group.setExpanded(False)
-        
-        # fix value relations
-        for lyr in list(layers.keys()):
-            if lyr in layer_name_list:
-                if not layers[lyr][0]==None:
-                    #self.create_layer_value_relations(layer_dict[lyr], layer_dict[layers[lyr]], layer_dict[lyr].dataProvider().fieldNameIndex('typ'), 'typ','beskrivning')
-                    self.create_layer_value_relations(layer_dict[lyr], layer_dict[layers[lyr][0]], layer_dict[lyr].dataProvider().fieldNameIndex('typ'), 'typ','beskrivning')
-
-        #special fix for gvflode
-        print(f"db_version {db_version}")
-        if db_version < '1.0.0':
-            self.create_layer_value_relations(layer_dict['gvflode'], layer_dict['zz_gvmag'], layer_dict['gvflode'].dataProvider().fieldNameIndex('intermag'), 'typ','beskrivning')
-            for projektdependent_layer in ['profillinje']:  # , 'profil' # Implementera vid behov
-                if projektdependent_layer in layer_dict:
-                    self.create_layer_value_relations(layer_dict[projektdependent_layer], layer_dict['zz_projekt'],
-                                                      layer_dict[projektdependent_layer].dataProvider().fieldNameIndex(
-                                                          'projekt'), 'pkuid', 'namn')
-        else:
-            self.create_layer_value_relations(layer_dict['gvflode'], layer_dict['zz_gvflode'], layer_dict['gvflode'].dataProvider().fieldNameIndex('intermag'), 'typ','beskrivning')
 
         #last, rename to readable names in map legend
         for layer in layer_list:
@@ -211,8 +224,31 @@ class LoadLayers():
                 except:
                     pass
 
-        #finally refresh canvas
+        self.root.insertChildNode(position_index, main_group)
+        timings['register layers'] = time.time() - start - sum(timings.values())
+
+        #zoom to gvmag extent and finally refresh canvas
+        if 'gvmag' in layer_dict:
+            # Reading the extent from up to date statistics avoids reading all geometries of gvmag
+            statistics = utils.layer_statistics(self.dbpath, 'gvmag')
+            if statistics is not None and statistics[0]:
+                canvas.setExtent(QgsRectangle(*statistics[1]))
+            else:
+                canvas.setExtent(layer_dict['gvmag'].extent())
+                # The statistics are missing or stale after edits of gvmag. They are updated, so the next load
+                # can use them again.
+                conn = utils.ConnectionManager.get(self.dbpath)
+                try:
+                    utils.update_layer_statistics(conn, ['gvmag'])
+                    conn.commit()
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    utils.MessagebarAndLog.info(log_msg="Could not update the layer statistics of gvmag in %s: %s" % (self.dbpath, str(e)))
         canvas.refresh()
+        timings['extent and refresh'] = time.time() - start - sum(timings.values())
+
+        utils.MessagebarAndLog.info(log_msg="Loaded %s layers from %s in %.2f s (%s)" % (
+            len(layer_list), self.dbpath, time.time() - start, ', '.join(["%s %.2f s" % (phase, seconds) for phase, seconds in timings.items()])))
 
     def create_relations(self):#CURRENTLY NOT IN USE (NOT WORKING AS EXPECTED, ONLY RANDOMLY CREATING BOTH RELATIONS!!!  ALSO, SOMETIMES QGIS CRASH WHEN OPENING FORMS)
         """
@@ -289,6 +325,16 @@ class LoadLayers():
 
         #u'UseCompleter': False, u'AllowMulti': False, u'AllowNull': True, u'OrderByValue': True, u'Value': u'beskrivning', u'Key': u'typ'
 
+    @staticmethod
+    def create_layer_value_map(the_layer, index, domain):
+        """
+        Sets a ValueMap widget with the (key, value) pairs of domain, an alternative to a ValueRelation widget that
+        doesn't need the domain table as a layer
+        """
+        value_map = [{'<NULL>': QgsValueMapFieldFormatter.NULL_VALUE}]
+        value_map.extend([{str(value): key} for key, value in domain])
+        the_layer.setEditorWidgetSetup(index, QgsEditorWidgetSetup("ValueMap", {'map': value_map}))
+
     def remove_layers(self): 
         try:
             remove_group = self.root.findGroup(self.group_name)
@@ -304,39 +350,231 @@ class LoadLayers():
                 del QgsProject.instance().relationManager().relations()[key]
                 print(('removed relation %s'%str(key)))
 
-    def get_db_version(self):
-        con = sqlite3.connect(self.dbpath)
-        try:
-            cur = con.cursor()
-            cur.execute('select description FROM about_db LIMIT 1')
-            desc = cur.fetchone()[0]
-        except:
-            con.close()
-            raise
+    def layer_uri(self, uri, schema, tablename):
+        """
+        Returns the uri for the geometry column of tablename, with the key column, srid and geometry type
+        from the schema snapshot so the provider doesn't have to look them up
+        """
+        uri.setDataSource('', tablename, 'geometry', '', schema.primary_keys.get(tablename) or '')
+        geometry = schema.geometry(tablename)
+        # Databases with legacy (spatialite < 4) metadata have the geometry type as text
+        if geometry is not None and isinstance(geometry[1], int):
+            uri.setSrid(str(geometry[0]))
+            uri.setWkbType(QgsWkbTypes.Type(geometry[1]))
         else:
-            con.close()
+            uri.setSrid('')
+            uri.setWkbType(QgsWkbTypes.Unknown)
+        return uri.uri()
 
-        m = re.search('midv_tolkn plugin[Version\ ]*([0-9\.]+),', desc, flags=re.IGNORECASE)
-        if m:
-            db_version = m.groups()[0]
-        else:
+    def get_db_version(self, schema=None):
+        db_version = schema.db_version if schema is not None else get_db_version(self.dbpath)
+        if db_version is None:
             qgis.utils.iface.messageBar().pushMessage("Information",
                                                       """Version number of database could not be parsed. Using oldest layer styles.""",
                                                       1, duration=10)
-            db_version = None
         return db_version
 
     def get_styles_folder(self, db_version):
-        basefolder = os.path.join(os.path.dirname(__file__), 'layer_styles')
+        return get_styles_folder(db_version)
+
+
+def domain_links(db_version, layer_names, layers=None):
+    """
+    Returns the fields that get their values from a data domain table
+
+    :param db_version: The version of the database, the links differs before 1.0.0
+    :param layer_names: The table names of the loaded layers
+    :param layers: defs.default_layers()
+    :return: list of (layer name, field, domain table, key field, value field)
+    """
+    if layers is None:
+        layers = default_layers()
+    links = []
+    for lyr in list(layers.keys()):
+        if lyr in layer_names:
+            if not layers[lyr][0]==None:
+                links.append((lyr, 'typ', layers[lyr][0], 'typ', 'beskrivning'))
+
+    #special fix for gvflode
+    if db_version < '1.0.0':
+        links.append(('gvflode', 'intermag', 'zz_gvmag', 'typ', 'beskrivning'))
+        for projektdependent_layer in ['profillinje']:  # , 'profil' # Implementera vid behov
+            if projektdependent_layer in layer_names:
+                links.append((projektdependent_layer, 'projekt', 'zz_projekt', 'pkuid', 'namn'))
+    else:
+        links.append(('gvflode', 'intermag', 'zz_gvflode', 'typ', 'beskrivning'))
+    return links
+
+
+def get_domains(dbpath, schema, links):
+    """
+    Reads the key and value columns of all data domains in links using one query
+
+    :param links: list of (layer name, field, domain table, key field, value field), see domain_links
+    :return: {(domain table, key field, value field): [(key, value), ...]} in the order of the domain table
+    """
+    domain_fields = []
+    for lyr, field, domain_table, key_field, value_field in links:
+        if (domain_table, key_field, value_field) not in domain_fields and domain_table in schema.tables:
+            domain_fields.append((domain_table, key_field, value_field))
+    domains = OrderedDict([(domain_field, []) for domain_field in domain_fields])
+    if not domain_fields:
+        return domains
+    sql = ' UNION ALL '.join([f'''SELECT {idx}, rowid, "{key_field}", "{value_field}" FROM "{domain_table}"'''
+                              for idx, (domain_table, key_field, value_field) in enumerate(domain_fields)])
+    for idx, rowid, key, value in utils.ConnectionManager.get(dbpath).execute(sql + ' ORDER BY 1, 2'):
+        domains[domain_fields[idx]].append((key, value))
+    return domains
+
+
+def load_domain_layers(iface, dbpath, group_name='Midvatten_TolkningsDB_värdeförråd'):
+    """
+    Loads the zz_ tables of dbpath as editable layers in their own group
+
+    When the domains are ValueMap widgets (midv_tolkn/domains_as_value_maps), the widgets of the loaded
+    layers are updated each time changes in a domain layer are saved.
+    """
+    root = QgsProject.instance().layerTreeRoot()
+    existing_group = root.findGroup(group_name)
+    if existing_group:
+        root.removeChildNode(existing_group)
+
+    schema = utils.SchemaSnapshot.get(dbpath)
+    layer_options = QgsVectorLayer.LayerOptions(loadDefaultStyle=False)
+    layer_list = []
+    for tablename in schema.domain_tables():
+        uristring = 'dbname="' + dbpath + '" table="' + tablename + '"'
+        layer = QgsVectorLayer(uristring, tablename, 'spatialite', layer_options)
+        if layer.isValid():
+            layer_list.append(layer)
+            if QSettings().value('midv_tolkn/domains_as_value_maps', False, type=bool):
+                layer.afterCommitChanges.connect(lambda: refresh_value_maps(dbpath))
+
+    QgsProject.instance().addMapLayers(layer_list, False)
+    group = qgis.core.QgsLayerTreeGroup(name=group_name, checked=True)
+    for layer in layer_list:
+        group.insertLayer(0, layer)
+    root.insertChildNode(0, group)
+    iface.messageBar().pushMessage("Information", "Loaded %s data domain tables from %s" % (len(layer_list), dbpath), 0, duration=5)
+    return layer_list
+
+
+def refresh_value_maps(dbpath):
+    """ Reads the data domains again and updates the ValueMap widgets of the loaded layers from dbpath """
+    layer_dict = {}
+    for layer in QgsProject.instance().mapLayers().values():
+        if not isinstance(layer, QgsVectorLayer) or layer.providerType() != 'spatialite':
+            continue
+        uri = QgsDataSourceUri(layer.source())
+        if os.path.normcase(os.path.realpath(uri.database())) == os.path.normcase(os.path.realpath(dbpath)):
+            layer_dict.setdefault(uri.table(), layer)
+
+    schema = utils.SchemaSnapshot.get(dbpath)
+    links = [link for link in domain_links(schema.db_version, list(layer_dict.keys())) if link[0] in layer_dict]
+    domains = get_domains(dbpath, schema, links)
+    for lyr, field, domain_table, key_field, value_field in links:
+        layer = layer_dict[lyr]
+        if layer.editorWidgetSetup(layer.fields().indexOf(field)).type() == 'ValueMap':
+            LoadLayers.create_layer_value_map(layer, layer.fields().indexOf(field), domains.get((domain_table, key_field, value_field), []))
+
+
+def get_db_version(dbpath):
+    """ Returns the plugin version that created the database, parsed from about_db, or None """
+    return utils.SchemaSnapshot.get(dbpath).db_version
+
+
+def get_styles_folder(db_version):
+    """ Returns the folder in layer_styles with the styles for db_version """
+    basefolder = os.path.join(os.path.dirname(__file__), 'layer_styles')
+    version_foldername = StyleCache.version_folders(basefolder)
+
+    # Using oldest styles folder as default
+    styles_folder = list(version_foldername.values())[-1]
+    if db_version is not None:
+        for folder_version, path in version_foldername.items():
+            if db_version >= folder_version:
+                styles_folder = path
+                break
+    return styles_folder
+
+
+def get_db_styles(dbpath):
+    """ Returns {table name: qml} for the default styles in the table layer_styles, or {} if the database has none """
+    conn = utils.ConnectionManager.get(dbpath)
+    if not conn.execute("""SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'layer_styles'""").fetchone()[0]:
+        return {}
+    # The newest style wins if there are several defaults for a table
+    return {row[0]: row[1] for row in conn.execute("""SELECT f_table_name, styleQML FROM layer_styles
+                                                      WHERE useAsDefault AND styleQML IS NOT NULL ORDER BY update_time, id""")}
+
+
+class StyleCache(object):
+    """
+    Parsed qml styles kept in memory between loads
+
+    Each qml file is parsed once into a QDomDocument and then applied from memory using importNamedStyle.
+    The documents are keyed by styles folder and filename and parsed again if the file modification time changes.
+    The listing of the version folders in layer_styles is cached the same way.
+    """
+    _documents = {}
+    _folders = {}
+
+    @classmethod
+    def document(cls, stylefile):
+        """ Returns the parsed QDomDocument for stylefile or None if it doesn't exist or can't be parsed """
+        try:
+            mtime = os.path.getmtime(stylefile)
+        except OSError:
+            return None
+        key = (os.path.dirname(stylefile), os.path.basename(stylefile))
+        cached = cls._documents.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        document = QDomDocument()
+        with open(stylefile, 'rb') as f:
+            result = document.setContent(f.read())
+        # PyQt returns (ok, error message, line, column)
+        ok = result[0] if isinstance(result, tuple) else result
+        if not ok:
+            utils.MessagebarAndLog.warning(log_msg="Could not parse style file %s: %s" % (stylefile, str(result)))
+            document = None
+        cls._documents[key] = (mtime, document)
+        return document
+
+    @classmethod
+    def apply_qml(cls, layer, qml):
+        """ Applies a qml string (i.e. from the database) to layer, the parsed document is kept by the hash of the qml """
+        key = ('', hashlib.sha1(qml.encode('utf-8')).hexdigest())
+        cached = cls._documents.get(key)
+        if cached is None:
+            document = QDomDocument()
+            result = document.setContent(qml)
+            ok = result[0] if isinstance(result, tuple) else result
+            cached = (None, document if ok else None)
+            cls._documents[key] = cached
+        if cached[1] is None:
+            return False
+        result = layer.importNamedStyle(cached[1])
+        return result[0] if isinstance(result, tuple) else result
+
+    @classmethod
+    def apply(cls, layer, stylefile):
+        """ Applies stylefile to layer, returns True if it succeeded """
+        document = cls.document(stylefile)
+        if document is None:
+            return False
+        result = layer.importNamedStyle(document)
+        return result[0] if isinstance(result, tuple) else result
+
+    @classmethod
+    def version_folders(cls, basefolder):
+        """ Returns {version: folder path} for the version folders in basefolder, newest version first """
+        mtime = os.path.getmtime(basefolder)
+        cached = cls._folders.get(basefolder)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
         version_foldername = {k.replace('_', '.'): os.path.join(basefolder, k)
                               for k in os.listdir(basefolder) if os.path.isdir(os.path.join(basefolder, k))}
         version_foldername = dict(sorted(version_foldername.items(), reverse=True))
-
-        # Using oldest styles folder as default
-        styles_folder = list(version_foldername.values())[-1]
-        if db_version is not None:
-            for folder_version, path in version_foldername.items():
-                if db_version >= folder_version:
-                    styles_folder = path
-                    break
-        return styles_folder
\ No newline at end of file
+        cls._folders[basefolder] = (mtime, version_foldername)
+        return version_foldername
@@ -18,32 +18,26 @@
  *                                                                         *
  ***************************************************************************/
 """
-import datetime
 # Import some general python modules
+import functools
 import os.path
 import sys
-import zipfile
 
 import qgis.utils
 # Import the PyQt and QGIS libraries
 from qgis.PyQt.QtCore import QCoreApplication, QSettings, Qt, QFile
 from qgis.PyQt.QtGui import QCursor, QIcon
-from qgis.PyQt.QtWidgets import QAction, QApplication, QFileDialog, QMenu
+from qgis.PyQt.QtWidgets import QAction, QApplication, QFileDialog, QInputDialog, QMenu
 
-try:
-    import zlib
-    compression = zipfile.ZIP_DEFLATED
-except:
-    compression = zipfile.ZIP_STORED
-
-from qgis.utils import spatialite_connect
 #add midv_tolkn plugin directory to pythonpath (needed here to allow importing modules from subfolders)
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/tools'))
 
 # Import midv_tolkn tools and modules
-from .load_tolkn_layers import LoadLayers
+from .load_tolkn_layers import LoadLayers, load_domain_layers
 from . import midv_tolkn_utils as utils 
+from . import midv_tolkn_backup
+from . import midv_tolkn_tasks
 
 class midv_tolkn:
     def __init__(self, iface):
@@ -72,6 +66,10 @@ class midv_tolkn:
         self.actionZipDB.setWhatsThis("En komprimerad zip-fil kommer att skapas i samma dir som tolknings-databasen.")
         self.actionZipDB.triggered.connect(lambda x: self.zip_db())
 
+        self.actionRestoreDB = QAction(QIcon(os.path.join(self.plugin_dir, 'icons', 'zip.png')), "Återställ inkrementell backup", self.iface.mainWindow())
+        self.actionRestoreDB.setWhatsThis("Återställer en tolknings-databas från en inkrementell backup.")
+        self.actionRestoreDB.triggered.connect(lambda x: self.restore_db())
+
         self.actionUpgradeDB = QAction(QIcon(os.path.join(self.plugin_dir, 'icons', 'create_new.png')), "Uppgradera tolknings-databas", self.iface.mainWindow())
         self.actionUpgradeDB.setWhatsThis("Uppgradera en befintlig tolknings-databas till ny databas-struktur.")
         self.actionUpgradeDB.triggered.connect(lambda x: self.upgrade_db())
@@ -80,6 +78,13 @@ class midv_tolkn:
         self.action_recalculate_tillromr.setWhatsThis("Beräknar kolumnen area_km2, flode_lPs och dagvatten_lPs i lagret tillromr.")
         self.action_recalculate_tillromr.triggered.connect(lambda x: self.recalculate_tillromr())
 
+        self.action_replace_triggers = QAction(QIcon(os.path.join(self.plugin_dir, 'icons', 'create_new.png')), "Uppdatera triggers i tolknings-db", self.iface.mainWindow())
+        self.action_replace_triggers.setWhatsThis("Ersätter triggers i en befintlig tolknings-databas med pluginets aktuella triggers.")
+        self.action_replace_triggers.triggered.connect(lambda x: self.replace_triggers())
+
+        self.action_edit_domains = QAction(QIcon(os.path.join(self.plugin_dir, 'icons', 'load_layers_domains.png')), "Redigera värdeförråd", self.iface.mainWindow())
+        self.action_edit_domains.setWhatsThis("Laddar värdeförrådens tabeller (zz_) från tolknings-databasen för redigering.")
+        self.action_edit_domains.triggered.connect(lambda x: self.edit_domains())
 
         #self.actionabout = QAction(QIcon(":/plugins/midv_tolkn/icons/about.png"), "Information", self.iface.mainWindow())
         #self.actionabout.triggered.connect(lambda x: self.about)
@@ -124,11 +129,17 @@ class midv_tolkn:
         self.menu.addAction(self.actionNewDB)   
         self.menu.addAction(self.actionVacuumDB)
         self.menu.addAction(self.actionZipDB)
+        self.menu.addAction(self.actionRestoreDB)
         self.menu.addAction(self.actionUpgradeDB)
         self.menu.addAction(self.action_recalculate_tillromr)
+        self.menu.addAction(self.action_replace_triggers)
+        self.menu.addAction(self.action_edit_domains)
         #self.menu.addAction(self.actionabout)
 
     def unload(self):    
+        midv_tolkn_tasks.DbTaskQueue.cancel_all()
+        utils.ConnectionManager.close_all()
+
         # remove tool bar button
         self.iface.removeToolBarIcon(self.actionloadthelayers)
 
@@ -174,9 +185,15 @@ class midv_tolkn:
         iniText = QSettings(filenamepath , QSettings.IniFormat)
         verno = str(iniText.value('version')) 
         from .create_tolkn_db import NewDb
-        newdbinstance = NewDb(self.iface, verno, set_locale=set_locale)
-        if not newdbinstance.dbpath=='':
-            self.db = newdbinstance.dbpath
+        newdbinstance = NewDb(self.iface, verno, set_locale=set_locale, create=False)
+        if not newdbinstance.dbpath:
+            return
+
+        def created(ok):
+            if ok:
+                self.db = newdbinstance.dbpath
+                utils.MessagebarAndLog.info(bar_msg="Database %s created" % newdbinstance.dbpath)
+        midv_tolkn_tasks.run_in_task("Skapa tolknings-db", newdbinstance.dbpath, newdbinstance.create_new_db, verno, on_finished=created)
 
     def upgrade_db(self, set_locale=False):
         from_db = None
@@ -195,6 +212,19 @@ class midv_tolkn:
             QApplication.restoreOverrideCursor()
             return None
 
+        # Rows per batch when copying tables, 0 copies each table with one statement (midv_tolkn/upgrade_batch_size)
+        settings = QSettings()
+        batch_size = settings.value('midv_tolkn/upgrade_batch_size', 10000, type=int) or None
+
+        # resume an interrupted upgrade from the same database
+        unfinished_source = settings.value('midv_tolkn/unfinished_upgrade_source', '')
+        unfinished_target = settings.value('midv_tolkn/unfinished_upgrade_target', '')
+        if batch_size and unfinished_source == from_db and utils.unfinished_upgrade(from_db, unfinished_target):
+            resume = utils.Askuser("YesNo", """En avbruten uppgradering av %s till %s hittades.\nVill du återuppta den?""" % (from_db, unfinished_target), 'Resume upgrade?')
+            if resume.result == 1:
+                self.run_upgrade(from_db, unfinished_target, batch_size, resume=True)
+                return
+
         #get EPSG in the original db
         EPSG = utils.sql_load_fr_db("""SELECT srid FROM geom_cols_ref_sys WHERE Lower(f_table_name) = Lower('gvmag') AND Lower(f_geometry_column) = Lower('geometry')""", from_db)
 
@@ -208,17 +238,43 @@ class midv_tolkn:
 
         #now create database of the updated design
         from .create_tolkn_db import NewDb
-        newdbinstance = NewDb(self.iface, verno, user_select_CRS=True, EPSG_code=EPSG[1][0][0], set_locale=set_locale)
+        newdbinstance = NewDb(self.iface, verno, user_select_CRS=True, EPSG_code=EPSG[1][0][0], set_locale=set_locale, create=False)
         if not newdbinstance.dbpath:
             QApplication.restoreOverrideCursor()
             return None
-        #transfer data to the new database
-        foo = utils.UpgradeDatabase(from_db, newdbinstance.dbpath)
 
-        #set new database as the current db and load these layers
-        if not newdbinstance.dbpath=='':
-            self.db = newdbinstance.dbpath
-        self.load_the_layers()
+        def created(ok):
+            if ok:
+                self.run_upgrade(from_db, newdbinstance.dbpath, batch_size)
+        midv_tolkn_tasks.run_in_task("Skapa tolknings-db", newdbinstance.dbpath, newdbinstance.create_new_db, verno, on_finished=created)
+
+    def run_upgrade(self, from_db, to_db, batch_size, resume=False):
+        plan = utils.UpgradePlan.for_databases(from_db, to_db)
+        answer = utils.Askuser("YesNo", """Uppgradering av %s till %s:\n\n%s\n\nVill du fortsätta?""" % (from_db, to_db, plan.summary()), 'Upgrade plan')
+        if answer.result != 1:
+            utils.MessagebarAndLog.info(bar_msg="Upgrade cancelled")
+            return
+
+        settings = QSettings()
+        if batch_size:
+            settings.setValue('midv_tolkn/unfinished_upgrade_source', from_db)
+            settings.setValue('midv_tolkn/unfinished_upgrade_target', to_db)
+
+        def upgraded(result):
+            settings.remove('midv_tolkn/unfinished_upgrade_source')
+            settings.remove('midv_tolkn/unfinished_upgrade_target')
+            utils.MessagebarAndLog.info(bar_msg="Export done! Layers from the new database will be loaded to your qgis project")
+            #set new database as the current db and load these layers
+            if not to_db=='':
+                self.db = to_db
+            self.load_the_layers()
+
+        #transfer data to the new database
+        # Number of worker processes converting tables into shard databases (midv_tolkn/upgrade_workers)
+        workers = settings.value('midv_tolkn/upgrade_workers', 1, type=int)
+        # An upgrade with checkpoints that is cancelled can be resumed later
+        midv_tolkn_tasks.run_in_task("Uppgradera tolknings-db", to_db, utils.UpgradeDatabase, from_db, to_db, batch_size=batch_size,
+                                     resume=resume, workers=workers, plan=plan, on_finished=upgraded)
 
     def recalculate_tillromr(self):
         if not self.db:
@@ -229,25 +285,56 @@ class midv_tolkn:
                 return
         else:
             db = self.db
+        only_changed = utils.Askuser("YesNo", """Beräkna bara om tillrinningsområden som påverkats av ändringar i tillromr eller dagvyta sedan förra beräkningen?\n\n(Nej = beräkna om alla tillrinningsområden)""", 'Incremental recalculation?')
+        # Number of worker processes for dagvatten_lPs, set in QGIS advanced settings (midv_tolkn/recalculate_workers)
+        workers = QSettings().value('midv_tolkn/recalculate_workers', 1, type=int)
+
+        def recalculated_msg(recalculated):
+            if recalculated is None:
+                self.iface.messageBar().pushSuccess("Information",
+                                                    "Columns area_km2, flode_lPs and dagvatten_lPs recalculated in table tillromr")
+            else:
+                self.iface.messageBar().pushSuccess("Information",
+                                                    "Columns area_km2, flode_lPs and dagvatten_lPs recalculated for %s changed features in table tillromr" % str(recalculated))
+        midv_tolkn_tasks.run_in_task("Beräkna tillromr", db, utils.recalculate_tillromr, db, incremental=only_changed.result == 1,
+                                     workers=workers, on_finished=recalculated_msg)
+        
+    def replace_triggers(self):
+        if not self.db:
+            db = QFileDialog.getOpenFileName(None, 'Ange tolknings-db', '', "Spatialite (*.sqlite)")[0]
+            if not db:
+                return
+        else:
+            db = self.db
         QApplication.setOverrideCursor(Qt.WaitCursor)
         try:
-            for sql in utils.recalculate_tillromr_queries:
-                utils.sql_alter_db(db, sql)
+            created = utils.replace_triggers(db)
         except:
             QApplication.restoreOverrideCursor()
             raise
         else:
             QApplication.restoreOverrideCursor()
-            self.iface.messageBar().pushSuccess("Information",
-                                                "Columns area_km2, flode_lPs and dagvatten_lPs recalculated in table tillromr")
-        
+            utils.MessagebarAndLog.info(bar_msg="Triggers updated in " + db, log_msg="Created triggers:\n" + '\n'.join(created))
+
+    def edit_domains(self):
+        if not self.db:
+            db = QFileDialog.getOpenFileName(None, 'Ange tolknings-db', '', "Spatialite (*.sqlite)")[0]
+            if not db:
+                return
+        else:
+            db = self.db
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            load_domain_layers(self.iface, db)
+        finally:
+            QApplication.restoreOverrideCursor()
+
     def vacuum_db(self):
         force_another_db = False
         if self.db:
             use_current_db = utils.Askuser("YesNo","""Vill du packa %s?"""%self.db,'Which database?')
             if use_current_db.result == 1:
                 dbpath = self.db
-                force_another_db = True
             elif use_current_db.result == 0:
                 force_another_db = True
             elif use_current_db.result == '':
@@ -255,9 +342,27 @@ class midv_tolkn:
         if not self.db or force_another_db:
             dbpath = QFileDialog.getOpenFileName(None, 'Ange db som ska packas','',"Spatialite (*.sqlite)")[0]
 
-        QApplication.setOverrideCursor(Qt.WaitCursor)
-        utils.sql_alter_db(dbpath,'vacuum')
-        QApplication.restoreOverrideCursor()
+        if not dbpath:
+            return
+        modes = ['Inkrementell (frigör tomma sidor i korta steg)', 'Full (skriver om hela filen)', 'Till ny fil (VACUUM INTO)']
+        mode, ok = QInputDialog.getItem(None, 'Vacuum', 'Välj typ av vacuum:', modes, 0, False)
+        if not ok:
+            return
+        target_path = None
+        if mode == modes[2]:
+            target_path = QFileDialog.getSaveFileName(None, 'Spara packad kopia som', os.path.splitext(dbpath)[0] + '_vacuum.sqlite', "Spatialite (*.sqlite)")[0]
+            if not target_path:
+                return
+            if os.path.exists(target_path):
+                utils.ConnectionManager.close(target_path)
+                os.remove(target_path)
+
+        def vacuumed(result):
+            utils.MessagebarAndLog.info(bar_msg="Database %s vacuumed, free pages %s -> %s" % (
+                target_path or dbpath, result['freelist_before'], result['freelist_after']))
+        midv_tolkn_tasks.run_in_task("Packa " + os.path.basename(dbpath), dbpath, utils.vacuum_db, dbpath,
+                                     mode={modes[0]: 'incremental', modes[1]: 'full', modes[2]: 'into'}[mode],
+                                     target_path=target_path, on_finished=vacuumed)
         
     def zip_db(self):
         force_another_db = False
@@ -275,20 +380,50 @@ class midv_tolkn:
             dbpath = QFileDialog.getOpenFileName(None, 'Ange db som du vill skapa backup utav','',"Spatialite (*.sqlite)")[0]
 
         if dbpath:
-            QApplication.setOverrideCursor(Qt.WaitCursor)
-            connection = utils.dbconnection(dbpath)
-            connection.connect2db()
-            connection.conn.cursor().execute("begin immediate")
-
-            file_path = os.path.realpath(dbpath)
-            dir_path = os.path.dirname(file_path)
-            current_dir = dir_path.split(os.sep)[-1]
-
-            bkupname = dbpath + datetime.datetime.now().strftime('%Y%m%dT%H%M') + '.zip'
-            zf = zipfile.ZipFile(bkupname, mode='w')
-            zf.write(dbpath,os.path.basename(dbpath), compress_type=compression) #compression will depend on if zlib is found or not
-            zf.close()
-            connection.conn.rollback()
-            connection.closedb()
-            self.iface.messageBar().pushSuccess("Information", "Database backup was written to " + bkupname)
-            QApplication.restoreOverrideCursor()
+            modes = ['Zip-fil', 'Inkrementell backup (bara ändringar sedan förra backupen sparas)', 'Komprimerad fil (flertrådad)']
+            mode, ok = QInputDialog.getItem(None, 'Backup', 'Välj typ av backup:', modes, 0, False)
+            if not ok:
+                return
+            if mode == modes[2]:
+                codec, ok = QInputDialog.getItem(None, 'Backup', 'Välj komprimering:', list(midv_tolkn_backup.CODECS.keys()), 0, False)
+                if not ok:
+                    return
+                default_level, min_level, max_level = midv_tolkn_backup.CODECS[codec][2:]
+                level, ok = QInputDialog.getInt(None, 'Backup', 'Komprimeringsnivå:', default_level, min_level, max_level)
+                if not ok:
+                    return
+            # The database is only locked while the snapshot is taken, not while it's compressed
+            if mode == modes[0]:
+                function_and_args = (midv_tolkn_backup.zip_backup, dbpath)
+            elif mode == modes[1]:
+                function_and_args = (midv_tolkn_backup.BackupStore(dbpath).backup, )
+            else:
+                function_and_args = (functools.partial(midv_tolkn_backup.compressed_backup, codec=codec, level=level), dbpath)
+            midv_tolkn_tasks.run_in_task("Backup av " + os.path.basename(dbpath), dbpath, *function_and_args,
+                                         on_finished=lambda result: self.backup_done(dbpath, *result))
+
+    def backup_done(self, dbpath, bkupname, timings):
+        log_msg = "Backup of %s: snapshot %.1f s (database locked %.2f s in total, at most %.2f s at a time)" % (
+            dbpath, timings['seconds'], timings['lock_seconds'], timings['max_lock_seconds'])
+        if timings.get('restarts'):
+            log_msg += ", restarted %s times because the database was written to" % timings['restarts']
+        if 'new_chunks' in timings:
+            log_msg += ", %s of %s chunks new, %s bytes stored in %.1f s" % (
+                timings['new_chunks'], timings['chunks'], timings['stored_bytes'], timings['store_seconds'])
+        elif 'codec' in timings:
+            log_msg += ", %s level %s in %s threads: %.1f s, %.1f MB/s, ratio %.1f" % (
+                timings['codec'], timings['level'], timings['workers'], timings['compress_seconds'], timings['mb_per_second'], timings['ratio'])
+        else:
+            log_msg += ", compression %.1f s" % timings['compress_seconds']
+        utils.MessagebarAndLog.info(bar_msg="Database backup was written to " + bkupname, log_msg=log_msg)
+
+    def restore_db(self):
+        manifest = QFileDialog.getOpenFileName(None, 'Ange backup som ska återställas', self.db + '_backups' if self.db else '', "Backup manifest (*.json)")[0]
+        if not manifest:
+            return
+        target = QFileDialog.getSaveFileName(None, 'Spara återställd tolknings-db som', 'midv_tolkndb.sqlite', "Spatialite (*.sqlite)")[0]
+        if not target:
+            return
+        utils.ConnectionManager.close(target)
+        midv_tolkn_tasks.run_in_task("Återställ backup", target, midv_tolkn_backup.BackupStore.restore, manifest, target,
+                                     on_finished=lambda result: utils.MessagebarAndLog.info(bar_msg="Backup %s was restored to %s" % (os.path.basename(manifest), target)))
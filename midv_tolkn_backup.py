@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ This is the part of the midv_tolkn plugin that makes backups of tolknings-databases.
+ NOTE - this module must not import qgis, it's also used outside QGIS.
+                              -------------------
+        begin                : 2026-10-18
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+compression = zipfile.ZIP_DEFLATED
+
+
+class BackupCancelled(Exception):
+    pass
+
+
+class BackupRestartLimit(Exception):
+    pass
+
+
+def check_cancelled(feedback):
+    """ feedback is a QgsFeedback (or anything with isCanceled and setProgress) or None """
+    if feedback is not None and feedback.isCanceled():
+        raise BackupCancelled()
+
+
+def snapshot(dbpath, snapshot_path, pages=256, feedback=None, max_restarts=10, busy_sleep=0.25):
+    """
+    Copies dbpath into snapshot_path using the sqlite online backup api
+
+    The copy is made in steps of pages database pages. The read lock on dbpath is only held during a step,
+    so other connections can write between the steps. The backup then restarts from the first page, and
+    BackupRestartLimit is raised after max_restarts restarts (a database that is written continuously would
+    otherwise keep the backup going forever).
+    The lock times are measured as the time of each step. The sleep while dbpath is busy is made in the progress
+    callback instead of by sqlite3, so neither the sleep nor the callback is counted.
+    The snapshot is reported as the first half of the progress of feedback.
+
+    :return: dict with the total time, the total lock time and the longest lock time in seconds and the number of restarts
+    """
+    source = sqlite3.connect(dbpath)
+    target = sqlite3.connect(snapshot_path)
+    step_times = []
+    restarts = [0]
+    copied = [None]
+    step_start = [None]
+
+    def progress(status, remaining, total):
+        step_times.append(time.perf_counter() - step_start[0])
+        busy = status in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+        # A step copies pages pages, unless dbpath was written to since the last step and the copy started over
+        if not busy and copied[0] is not None and total - remaining <= copied[0]:
+            restarts[0] += 1
+            if restarts[0] > max_restarts:
+                raise BackupRestartLimit("The backup of %s restarted %s times because the database was written to" % (dbpath, restarts[0]))
+        if not busy:
+            copied[0] = total - remaining
+        # An exception raised here stops the backup
+        check_cancelled(feedback)
+        if feedback is not None and total:
+            feedback.setProgress(50.0 * (total - remaining) / total)
+        if busy:
+            time.sleep(busy_sleep)
+        step_start[0] = time.perf_counter()
+
+    start = time.time()
+    try:
+        step_start[0] = time.perf_counter()
+        source.backup(target, pages=pages, progress=progress, sleep=0)
+    finally:
+        target.close()
+        source.close()
+    return {'seconds': time.time() - start,
+            'lock_seconds': sum(step_times),
+            'max_lock_seconds': max(step_times) if step_times else 0.0,
+            'restarts': restarts[0]}
+
+
+def temporary_files(bkupname):
+    """
+    Returns (snapshot path, temporary backup path) in the folder of bkupname
+
+    The backup is written to the temporary path and renamed to bkupname when it's complete, so a cancelled or
+    failed backup never leaves a truncated file (a truncated .gz, .xz or .zst still decompresses without error).
+    """
+    paths = []
+    for suffix in ('.sqlite', '.tmp'):
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=os.path.dirname(os.path.abspath(bkupname)))
+        os.close(fd)
+        paths.append(path)
+    return tuple(paths)
+
+
+def remove_files(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def zip_backup(dbpath, bkupname=None, feedback=None):
+    """
+    Writes a zip file with a snapshot of dbpath
+
+    The snapshot is compressed after the lock on dbpath has been released.
+    :param bkupname: The zip file to write. Default is dbpath + timestamp + .zip
+    :return: (bkupname, dict with timings from snapshot and the compression time)
+    """
+    if bkupname is None:
+        bkupname = dbpath + datetime.datetime.now().strftime('%Y%m%dT%H%M') + '.zip'
+    snapshot_path, tmp_path = temporary_files(bkupname)
+    try:
+        timings = snapshot(dbpath, snapshot_path, feedback=feedback)
+        check_cancelled(feedback)
+        start = time.time()
+        with zipfile.ZipFile(tmp_path, mode='w') as zf:
+            zf.write(snapshot_path, os.path.basename(dbpath), compress_type=compression)
+        os.replace(tmp_path, bkupname)
+        timings['compress_seconds'] = time.time() - start
+    finally:
+        remove_files(snapshot_path, tmp_path)
+    return bkupname, timings
+
+
+def deflate_chunk(data, level):
+    """ Returns data as a gzip member, gzip files can consist of several members """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def lzma_chunk(data, level):
+    """ Returns data as an xz stream, xz files can consist of several streams """
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+
+def zstd_chunk(data, level):
+    """ Returns data as a zstd frame, zstd files can consist of several frames """
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+# codec: (compress function, file suffix, default level, min level, max level)
+CODECS = OrderedDict([('deflate', (deflate_chunk, '.gz', 6, 1, 9)),
+                      ('lzma', (lzma_chunk, '.xz', 6, 0, 9))])
+if zstandard is not None:
+    CODECS['zstd'] = (zstd_chunk, '.zst', 3, 1, 22)
+
+
+def compressed_backup(dbpath, codec='deflate', level=None, workers=None, chunk_size=8 * 1024 * 1024, bkupname=None, feedback=None):
+    """
+    Writes a compressed snapshot of dbpath, compressing chunks of chunk_size in a thread pool
+
+    The chunks are written in order as separate gzip members, xz streams or zstd frames, so the file can be
+    decompressed by the usual tools (gunzip, unxz, unzstd) or decompress_backup. zlib, lzma and zstandard release
+    the GIL while compressing, so the threads use all cores.
+
+    :param codec: A key in CODECS
+    :param level: The compression level, default is the default level of the codec
+    :param workers: Number of threads, default is the number of cpus
+    :param bkupname: The file to write. Default is dbpath + timestamp + the suffix of the codec
+    :return: (bkupname, dict with timings, sizes, throughput in MB/s and compression ratio)
+    """
+    compress, suffix, default_level, min_level, max_level = CODECS[codec]
+    level = default_level if level is None else max(min_level, min(max_level, int(level)))
+    workers = workers or os.cpu_count() or 1
+    if bkupname is None:
+        bkupname = dbpath + datetime.datetime.now().strftime('%Y%m%dT%H%M') + '.sqlite' + suffix
+    snapshot_path, tmp_path = temporary_files(bkupname)
+    try:
+        stats = snapshot(dbpath, snapshot_path, feedback=feedback)
+        start = time.time()
+        size = 0
+        compressed_size = 0
+        total_size = os.path.getsize(snapshot_path)
+        with open(snapshot_path, 'rb') as source, open(tmp_path, 'wb') as target, ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = []
+            for data in iter(lambda: source.read(chunk_size), b''):
+                size += len(data)
+                pending.append(pool.submit(compress, data, level))
+                # Keep at most two chunks per thread in memory
+                while len(pending) >= workers * 2:
+                    compressed_size += target.write(pending.pop(0).result())
+                check_cancelled(feedback)
+                if feedback is not None and total_size:
+                    feedback.setProgress(50.0 + 50.0 * size / total_size)
+            for future in pending:
+                compressed_size += target.write(future.result())
+        os.replace(tmp_path, bkupname)
+        seconds = time.time() - start
+    finally:
+        remove_files(snapshot_path, tmp_path)
+    stats.update({'compress_seconds': seconds, 'codec': codec, 'level': level, 'workers': workers,
+                  'size': size, 'compressed_size': compressed_size,
+                  'mb_per_second': size / 1024 / 1024 / seconds if seconds else 0.0,
+                  'ratio': size / compressed_size if compressed_size else 0.0})
+    return bkupname, stats
+
+
+def decompress_backup(bkupname, target_path):
+    """ Decompresses a file written by compressed_backup into target_path """
+    if bkupname.endswith('.gz'):
+        source = gzip.open(bkupname, 'rb')
+    elif bkupname.endswith('.xz'):
+        source = lzma.open(bkupname, 'rb')
+    elif bkupname.endswith('.zst') and zstandard is not None:
+        source = zstandard.ZstdDecompressor().stream_reader(open(bkupname, 'rb'), read_across_frames=True, closefd=True)
+    else:
+        raise ValueError("Unknown backup format: " + bkupname)
+    with source, open(target_path, 'wb') as target:
+        for data in iter(lambda: source.read(1024 * 1024), b''):
+            target.write(data)
+
+
+class BackupStore(object):
+    """
+    Incremental, deduplicated backups of a database
+
+    The database snapshot is split into chunks of a fixed size (a multiple of the sqlite page size, so an edit
+    only changes the chunks of the changed pages). Each chunk is stored compressed under its sha256 in
+    <db>_backups/chunks and each backup is a json manifest in <db>_backups/manifests listing its chunks.
+    Only chunks that aren't already in the store are written.
+    """
+    def __init__(self, dbpath, store_dir=None, chunk_size=65536):
+        self.dbpath = dbpath
+        if store_dir is None:
+            store_dir = os.path.abspath(dbpath) + '_backups'
+        self.store_dir = store_dir
+        self.chunk_dir = os.path.join(store_dir, 'chunks')
+        self.manifest_dir = os.path.join(store_dir, 'manifests')
+        self.chunk_size = chunk_size
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def backup(self, feedback=None):
+        """
+        Takes a snapshot of the database and stores its new chunks and a manifest
+        :return: (manifest path, dict with timings and chunk statistics)
+        """
+        for directory in (self.chunk_dir, self.manifest_dir):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        fd, snapshot_path = tempfile.mkstemp(suffix='.sqlite', dir=self.store_dir)
+        os.close(fd)
+        try:
+            stats = snapshot(self.dbpath, snapshot_path, feedback=feedback)
+            total_size = os.path.getsize(snapshot_path)
+            start = time.time()
+            chunks = []
+            new_chunks = 0
+            stored_bytes = 0
+            file_hash = hashlib.sha256()
+            with open(snapshot_path, 'rb') as f:
+                for data in iter(lambda: f.read(self.chunk_size), b''):
+                    file_hash.update(data)
+                    digest = hashlib.sha256(data).hexdigest()
+                    chunks.append(digest)
+                    check_cancelled(feedback)
+                    if feedback is not None and total_size:
+                        feedback.setProgress(50.0 + 50.0 * len(chunks) * self.chunk_size / total_size)
+                    path = self.chunk_path(digest)
+                    if os.path.exists(path):
+                        continue
+                    stored_bytes += self.write_file(path, zlib.compress(data))
+                    new_chunks += 1
+            size = os.path.getsize(snapshot_path)
+        finally:
+            os.remove(snapshot_path)
+
+        created = datetime.datetime.now()
+        manifest = {'database': os.path.basename(self.dbpath),
+                    'created': created.isoformat(),
+                    'size': size,
+                    'sha256': file_hash.hexdigest(),
+                    'chunk_size': self.chunk_size,
+                    'chunks': chunks}
+        manifest_path = self.new_manifest_path(created)
+        try:
+            self.write_file(manifest_path, json.dumps(manifest, indent=0).encode('utf-8'))
+        except:
+            os.remove(manifest_path)
+            raise
+        stats.update({'store_seconds': time.time() - start, 'chunks': len(chunks), 'new_chunks': new_chunks,
+                      'size': size, 'stored_bytes': stored_bytes})
+        return manifest_path, stats
+
+    def new_manifest_path(self, created):
+        """
+        Returns a manifest path named by created (with microseconds) that no other backup uses
+
+        The file is created empty to reserve the name, a counter is added if the name is taken.
+        """
+        name = created.strftime('%Y%m%dT%H%M%S%f')
+        manifest_path = os.path.join(self.manifest_dir, name + '.json')
+        counter = 0
+        while True:
+            try:
+                os.close(os.open(manifest_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return manifest_path
+            except FileExistsError:
+                counter += 1
+                manifest_path = os.path.join(self.manifest_dir, '%s_%d.json' % (name, counter))
+
+    def manifests(self):
+        """ Returns the manifest paths, oldest first """
+        if not os.path.isdir(self.manifest_dir):
+            return []
+        return [os.path.join(self.manifest_dir, filename) for filename in sorted(os.listdir(self.manifest_dir))
+                if filename.endswith('.json')]
+
+    @staticmethod
+    def restore(manifest_path, target_path, feedback=None):
+        """
+        Writes the database of a manifest to target_path
+        The chunk store is the chunks folder next to the manifests folder of manifest_path.
+        """
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        store = BackupStore('', store_dir=os.path.dirname(os.path.dirname(os.path.abspath(manifest_path))))
+        file_hash = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(suffix='.sqlite.tmp', dir=os.path.dirname(os.path.abspath(target_path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for number, digest in enumerate(manifest['chunks'], 1):
+                    check_cancelled(feedback)
+                    if feedback is not None:
+                        feedback.setProgress(100.0 * number / len(manifest['chunks']))
+                    with open(store.chunk_path(digest), 'rb') as chunk:
+                        data = zlib.decompress(chunk.read())
+                    file_hash.update(data)
+                    f.write(data)
+            if file_hash.hexdigest() != manifest['sha256']:
+                raise ValueError("Restored database %s doesn't match the checksum in %s" % (target_path, manifest_path))
+            os.replace(tmp_path, target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def write_file(path, data):
+        """ Writes data to path through a temporary file, so a failed write never leaves a broken chunk behind """
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return len(data)
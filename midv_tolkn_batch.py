@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ This is the part of the midv_tolkn plugin that runs a pipeline of database operations over many databases.
+                              -------------------
+        begin                : 2026-10-18
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Usage:
+    python -m midv_tolkn batch /data/tolkn --pipeline upgrade,recalc,vacuum,backup --jobs 6 --report report.json
+
+ Each database is processed in its own worker process (at most jobs at the same time). The steps of a database
+ run in order and the remaining steps are skipped if one fails. After upgrade, the following steps use the new
+ database.
+"""
+import datetime
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+# plugin modules
+from . import midv_tolkn_cli as cli
+from . import midv_tolkn_workers
+
+PIPELINE_STEPS = ['upgrade', 'recalc', 'vacuum', 'backup']
+
+
+def collect_databases(paths, recursive=False):
+    """
+    Returns the .sqlite files in paths (files and folders), each file once, in the order given and sorted within folders
+    """
+    databases = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                found = [os.path.join(folder, filename) for folder, dirnames, filenames in os.walk(path) for filename in filenames]
+            else:
+                found = [os.path.join(path, filename) for filename in os.listdir(path)]
+            databases.extend(sorted([f for f in found if f.lower().endswith('.sqlite') and os.path.isfile(f)]))
+        else:
+            databases.append(path)
+
+    unique = OrderedDict()
+    for database in databases:
+        unique.setdefault(os.path.normcase(os.path.realpath(database)), os.path.abspath(database))
+    return list(unique.values())
+
+
+def upgrade_target(database, suffix):
+    base, ext = os.path.splitext(database)
+    return base + suffix + ext
+
+
+def process_database(database, pipeline, options):
+    """
+    Worker function: runs the steps in pipeline for database
+
+    :param options: {step: keyword arguments for the command in midv_tolkn_cli}. The upgrade options have the
+                    target suffix as 'suffix'.
+    :return: {'database', 'ok', 'seconds', 'steps': list of results from midv_tolkn_cli.run_command}
+    """
+    cli.start_qgis()
+    start = time.time()
+    steps = []
+    current = database
+    for step in pipeline:
+        kwargs = dict(options.get(step, {}))
+        if step == 'upgrade':
+            target = upgrade_target(database, kwargs.pop('suffix'))
+            kwargs.update(source=current, target=target)
+        else:
+            kwargs['database'] = current
+        result = cli.run_command(step, **kwargs)
+        steps.append(result)
+        if not result['ok']:
+            break
+        if step == 'upgrade':
+            current = target
+    return OrderedDict([('database', database), ('ok', all([r['ok'] for r in steps])),
+                        ('seconds', time.time() - start), ('steps', steps)])
+
+
+def run_batch(paths, pipeline, jobs=None, recursive=False, report=None, options=None):
+    """
+    Runs pipeline for every database in paths in worker processes
+
+    :param paths: .sqlite files and folders with .sqlite files
+    :param pipeline: list of steps from PIPELINE_STEPS
+    :param jobs: The number of databases processed at the same time, default is the number of cpus
+    :param report: The json report file, default is midv_tolkn_batch_<time>.json in the current folder
+    :param options: {step: keyword arguments}, see process_database
+    :return: The report as a dict
+    """
+    unknown = [step for step in pipeline if step not in PIPELINE_STEPS]
+    if unknown:
+        raise ValueError("Unknown pipeline steps: %s, use %s" % (', '.join(unknown), ', '.join(PIPELINE_STEPS)))
+    options = options or {}
+    options.setdefault('upgrade', {}).setdefault('suffix', '_upgraded')
+    databases = collect_databases(paths, recursive)
+    if 'upgrade' in pipeline:
+        # The results of an earlier upgrade in the same folder are not upgraded again
+        suffix = options['upgrade']['suffix']
+        databases = [database for database in databases if not os.path.splitext(database)[0].endswith(suffix)]
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(databases) or 1))
+    if report is None:
+        report = os.path.abspath('midv_tolkn_batch_{}.json'.format(datetime.datetime.now().strftime('%Y%m%dT%H%M%S')))
+
+    start = time.time()
+    results = {}
+    error = None
+    try:
+        for number, result in enumerate(midv_tolkn_workers.run_in_processes(
+                process_database, [(database, pipeline, options) for database in databases], jobs), 1):
+            results[result['database']] = result
+            sys.stderr.write("%s/%s %s %s %.1f s\n" % (number, len(databases), result['database'],
+                                                       'ok' if result['ok'] else 'FAILED', result['seconds']))
+    except Exception as e:
+        # E.g. BrokenProcessPool if a worker process crashed. The finished databases are kept in the report.
+        error = '%s: %s' % (type(e).__name__, str(e))
+        sys.stderr.write("Batch stopped: %s\n" % error)
+        for database in databases:
+            if database not in results:
+                results[database] = OrderedDict([('database', database), ('ok', False), ('seconds', 0.0),
+                                                 ('error', error), ('steps', [])])
+
+    summary = OrderedDict([('report', report),
+                           ('pipeline', pipeline),
+                           ('jobs', jobs),
+                           ('succeeded', len([r for r in results.values() if r['ok']])),
+                           ('failed', len([r for r in results.values() if not r['ok']])),
+                           ('batch_seconds', time.time() - start),
+                           ('databases', [results[database] for database in databases if database in results])])
+    if error is not None:
+        summary['error'] = error
+    with open(report, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, default=str)
+    return summary
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ This is the part of the midv_tolkn plugin that runs the database operations from the command line, without QGIS gui.
+                              -------------------
+        begin                : 2026-10-18
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ Usage (from the folder containing the plugin folder, with the python environment of QGIS):
+    python -m midv_tolkn create tolkn.sqlite --epsg 3006
+    python -m midv_tolkn upgrade old.sqlite new.sqlite --workers 4
+    python -m midv_tolkn recalc tolkn.sqlite --incremental
+    python -m midv_tolkn vacuum tolkn.sqlite --mode incremental
+    python -m midv_tolkn backup tolkn.sqlite --method compressed --codec lzma
+    python -m midv_tolkn batch /data/tolkn --pipeline recalc,vacuum,backup --jobs 4
+    python -m midv_tolkn audit tolkn.sqlite --baseline plan_baseline.json
+
+ The result and timings of the command are written to stdout as json, the log messages to stderr (with --verbose).
+ The exit code is 0 if the command succeeded, else 1.
+ With MIDV_TOLKN_SQL_TRACE=1, the result also has the slowest sql statements (see midv_tolkn_sqltrace.py).
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import QgsApplication
+
+# plugin modules
+from . import midv_tolkn_backup
+from . import midv_tolkn_planaudit
+from . import midv_tolkn_utils as utils
+from .midv_tolkn_sqltrace import SqlTrace
+
+_app = None
+
+
+def start_qgis(verbose=False, gui=False):
+    """
+    Starts a QgsApplication (once per process). QGIS_PREFIX_PATH is used if it's set.
+
+    :param gui: If True, widgets can be created (set QT_QPA_PLATFORM=offscreen when there is no display)
+    """
+    global _app
+    if _app is not None or QgsApplication.instance() is not None:
+        return
+    if os.environ.get('QGIS_PREFIX_PATH'):
+        QgsApplication.setPrefixPath(os.environ['QGIS_PREFIX_PATH'], True)
+    _app = QgsApplication([], gui)
+    _app.initQgis()
+    if verbose:
+        QgsApplication.messageLog().messageReceived.connect(
+            lambda message, tag, level: sys.stderr.write('%s: %s\n' % (tag, message)))
+
+
+def plugin_version():
+    iniText = QSettings(os.path.join(os.path.dirname(__file__), "metadata.txt"), QSettings.IniFormat)
+    return str(iniText.value('version'))
+
+
+def create_db(database, epsg, overwrite=False):
+    """ Creates a new tolknings-db """
+    from .create_tolkn_db import NewDb
+    if os.path.exists(database) and not overwrite:
+        raise FileExistsError("%s exists, use --overwrite to replace it" % database)
+    timings = OrderedDict()
+    start = time.time()
+    newdb = NewDb.without_dialogs(os.path.abspath(database), epsg)
+    if not newdb.create_new_db(plugin_version()):
+        raise RuntimeError("Creating %s failed, see the log" % database)
+    timings['create'] = time.time() - start
+    return {'database': database, 'epsg': str(epsg), 'timings': timings}
+
+
+def upgrade_db(source, target, epsg=None, workers=1, batch_size=None, resume=False, overwrite=False):
+    """ Creates target (unless resuming) and upgrades source into it """
+    timings = OrderedDict()
+    source, target = os.path.abspath(source), os.path.abspath(target)
+    if epsg is None:
+        # The new database gets the crs of gvmag in the old database
+        geometry = utils.SchemaSnapshot.get(source).geometry('gvmag')
+        if geometry is None:
+            raise ValueError("The crs of %s could not be read, use --epsg" % source)
+        epsg = geometry[0]
+
+    if not (resume and os.path.exists(target)):
+        timings.update(create_db(target, epsg, overwrite=overwrite)['timings'])
+
+    plan = utils.UpgradePlan.for_databases(source, target)
+    start = time.time()
+    utils.UpgradeDatabase(source, target, batch_size=batch_size, resume=resume, workers=workers, plan=plan)
+    timings['upgrade'] = time.time() - start
+    return {'database': source, 'target': target, 'epsg': str(epsg), 'timings': timings,
+            'tables': {tname: {'strategy': table_plan.strategy, 'estimated_rows': table_plan.estimated_rows}
+                       for tname, table_plan in plan.tables.items()}}
+
+
+def recalc_db(database, incremental=False, workers=1):
+    """ Recalculates the calculated columns in tillromr """
+    start = time.time()
+    recalculated = utils.recalculate_tillromr(os.path.abspath(database), incremental=incremental, workers=workers)
+    return {'database': database, 'recalculated': recalculated, 'timings': {'recalc': time.time() - start}}
+
+
+def vacuum(database, mode='incremental', target=None):
+    """ Vacuums the database, see utils.vacuum_db """
+    stats = utils.vacuum_db(os.path.abspath(database), mode=mode, target_path=target)
+    return {'database': database, 'target': target, 'stats': stats, 'timings': {'vacuum': stats.get('seconds')}}
+
+
+def backup(database, method='zip', codec='deflate', level=None, workers=None):
+    """ Makes a zip, incremental or compressed backup of the database, see midv_tolkn_backup """
+    database = os.path.abspath(database)
+    start = time.time()
+    if method == 'zip':
+        bkupname, stats = midv_tolkn_backup.zip_backup(database)
+    elif method == 'incremental':
+        bkupname, stats = midv_tolkn_backup.BackupStore(database).backup()
+    else:
+        bkupname, stats = midv_tolkn_backup.compressed_backup(database, codec=codec, level=level, workers=workers)
+    return {'database': database, 'backup': bkupname, 'stats': stats, 'timings': {'backup': time.time() - start}}
+
+
+def batch(paths, pipeline='recalc', jobs=None, recursive=False, report=None, upgrade_suffix='_upgraded', epsg=None,
+          incremental=False, vacuum_mode='incremental', backup_method='zip', codec='deflate', level=None):
+    """
+    Runs the comma separated pipeline for many databases in worker processes, see midv_tolkn_batch
+
+    The concurrency is set by jobs only, each database is processed using one process.
+    """
+    from . import midv_tolkn_batch
+    options = {'upgrade': {'suffix': upgrade_suffix, 'epsg': epsg},
+               'recalc': {'incremental': incremental},
+               'vacuum': {'mode': vacuum_mode},
+               'backup': {'method': backup_method, 'codec': codec, 'level': level, 'workers': 1}}
+    return midv_tolkn_batch.run_batch(paths, [step.strip() for step in pipeline.split(',') if step.strip()], jobs=jobs,
+                                      recursive=recursive, report=report, options=options)
+
+
+def audit(database, large_rows=10000, per_row_rows=100, baseline=None, write_baseline=None):
+    """
+    Checks the query plans of the plugin sql and triggers against the database, see midv_tolkn_planaudit
+
+    With baseline (a json file written by write_baseline), only the issues that are not in the baseline
+    fail the command.
+    """
+    database = os.path.abspath(database)
+    start = time.time()
+    results = midv_tolkn_planaudit.audit_database(database, large_rows=large_rows, per_row_rows=per_row_rows)
+    issues = midv_tolkn_planaudit.issues_by_statement(results)
+    result = {'database': database, 'statements': len(results), 'issues': issues,
+              'errors': {r['id']: r['error'] for r in results if r.get('error')},
+              'timings': {'audit': time.time() - start}}
+    if write_baseline:
+        with open(write_baseline, 'w', encoding='utf-8') as f:
+            json.dump(issues, f, indent=2)
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            regressions = midv_tolkn_planaudit.compare(json.load(f), results)
+    else:
+        regressions = issues
+    result['regressions'] = regressions
+    result['failed'] = len(regressions)
+    return result
+
+
+COMMANDS = OrderedDict([('create', create_db),
+                        ('upgrade', upgrade_db),
+                        ('recalc', recalc_db),
+                        ('vacuum', vacuum),
+                        ('backup', backup),
+                        ('batch', batch),
+                        ('audit', audit)])
+
+
+def run_command(command, **kwargs):
+    """
+    Runs one of COMMANDS and returns its result as a dict with the keys command, ok, seconds, started and error
+    (and traceback) if it failed. The connections are closed afterwards.
+    """
+    result = OrderedDict([('command', command), ('started', datetime.datetime.now().isoformat(timespec='seconds'))])
+    start = time.time()
+    if SqlTrace.enabled():
+        SqlTrace.reset()
+    try:
+        with SqlTrace.operation(command):
+            result.update(COMMANDS[command](**kwargs))
+        # A batch succeeds if all databases succeeded, an audit if there are no new plan issues
+        result['ok'] = result.get('failed', 0) == 0
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = str(e)
+        result['traceback'] = traceback.format_exc()
+    finally:
+        utils.ConnectionManager.close_all()
+    result['seconds'] = time.time() - start
+    if SqlTrace.enabled():
+        result['sql_trace'] = SqlTrace.summary(10)
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m midv_tolkn', description="Runs midv_tolkn database operations without QGIS gui.")
+    parser.add_argument('--verbose', action='store_true', help="Write the log messages to stderr")
+    parser.add_argument('--indent', type=int, default=None, help="Indentation of the json output")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    create = subparsers.add_parser('create', help="Create a new tolknings-db")
+    create.add_argument('database')
+    create.add_argument('--epsg', required=True, help="EPSG-id of the geometry columns")
+    create.add_argument('--overwrite', action='store_true', help="Replace an existing file")
+
+    upgrade = subparsers.add_parser('upgrade', help="Upgrade a tolknings-db into a new database")
+    upgrade.add_argument('source')
+    upgrade.add_argument('target')
+    upgrade.add_argument('--epsg', default=None, help="EPSG-id of the new database, default is the crs of gvmag in source")
+    upgrade.add_argument('--workers', type=int, default=1)
+    upgrade.add_argument('--batch-size', dest='batch_size', type=int, default=None)
+    upgrade.add_argument('--resume', action='store_true', help="Continue an interrupted upgrade into target")
+    upgrade.add_argument('--overwrite', action='store_true', help="Replace an existing target")
+
+    recalc = subparsers.add_parser('recalc', help="Recalculate the columns in tillromr")
+    recalc.add_argument('database')
+    recalc.add_argument('--incremental', action='store_true', help="Only the features changed since the last recalculation")
+    recalc.add_argument('--workers', type=int, default=1)
+
+    vacuum_parser = subparsers.add_parser('vacuum', help="Vacuum the database")
+    vacuum_parser.add_argument('database')
+    vacuum_parser.add_argument('--mode', choices=['incremental', 'full', 'into'], default='incremental')
+    vacuum_parser.add_argument('--target', default=None, help="The new file when --mode into")
+
+    backup_parser = subparsers.add_parser('backup', help="Backup the database")
+    backup_parser.add_argument('database')
+    backup_parser.add_argument('--method', choices=['zip', 'incremental', 'compressed'], default='zip')
+    backup_parser.add_argument('--codec', choices=list(midv_tolkn_backup.CODECS.keys()), default='deflate')
+    backup_parser.add_argument('--level', type=int, default=None)
+    backup_parser.add_argument('--workers', type=int, default=None)
+
+    batch_parser = subparsers.add_parser('batch', help="Run a pipeline of commands for many databases in parallel")
+    batch_parser.add_argument('paths', nargs='+', help=".sqlite files and folders with .sqlite files")
+    batch_parser.add_argument('--pipeline', default='recalc', help="Comma separated steps: upgrade, recalc, vacuum, backup")
+    batch_parser.add_argument('--jobs', type=int, default=None, help="Number of databases processed at the same time, default is the number of cpus")
+    batch_parser.add_argument('--recursive', action='store_true', help="Also look for databases in sub folders")
+    batch_parser.add_argument('--report', default=None, help="The json report, default is midv_tolkn_batch_<time>.json")
+    batch_parser.add_argument('--upgrade-suffix', dest='upgrade_suffix', default='_upgraded', help="upgrade writes <name><suffix>.sqlite")
+    batch_parser.add_argument('--epsg', default=None, help="upgrade: EPSG-id of the new databases, default is the crs of gvmag")
+    batch_parser.add_argument('--incremental', action='store_true', help="recalc: only the changed features")
+    batch_parser.add_argument('--vacuum-mode', dest='vacuum_mode', choices=['incremental', 'full'], default='incremental')
+    batch_parser.add_argument('--backup-method', dest='backup_method', choices=['zip', 'incremental', 'compressed'], default='zip')
+    batch_parser.add_argument('--codec', choices=list(midv_tolkn_backup.CODECS.keys()), default='deflate')
+    batch_parser.add_argument('--level', type=int, default=None)
+
+    audit_parser = subparsers.add_parser('audit', help="Check the query plans of the plugin sql and triggers")
+    audit_parser.add_argument('database')
+    audit_parser.add_argument('--large-rows', dest='large_rows', type=int, default=10000, help="A full scan of a table with this many rows is an issue")
+    audit_parser.add_argument('--per-row-rows', dest='per_row_rows', type=int, default=100, help="A full scan per row (in a trigger or correlated subquery) of a table with this many rows is an issue")
+    audit_parser.add_argument('--baseline', default=None, help="Only fail on issues that are not in this file")
+    audit_parser.add_argument('--write-baseline', dest='write_baseline', default=None, help="Write the issues to this file")
+    return parser
+
+
+def main(argv=None):
+    args = vars(build_parser().parse_args(argv))
+    command = args.pop('command')
+    verbose = args.pop('verbose')
+    indent = args.pop('indent')
+    start_qgis(verbose)
+    result = run_command(command, **args)
+    if not verbose:
+        result.pop('traceback', None)
+    sys.stdout.write(json.dumps(result, indent=indent, default=str) + '\n')
+    return 0 if result['ok'] else 1
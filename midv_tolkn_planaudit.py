@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ This is the part of the midv_tolkn plugin that checks the query plans of the sql shipped with the plugin.
+                              -------------------
+        begin                : 2026-10-18
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ EXPLAIN QUERY PLAN is run (nothing is executed) against a database for:
+    * The recalculation of tillromr (full, incremental and the worker processes' range query)
+    * The WHEN clause and the statements of each trigger in insert_triggers.sql and the triggers in the database
+      that differs from them. NEW.x and OLD.x are replaced by parameters.
+    * The upgrade statements (UpgradeDatabase.insert_sql, with and without batches) with the database attached as a
+
+ Issues:
+    * A full scan of a table with at least large_rows rows, unless the statement is expected to read the whole table
+    * A full scan in a correlated subquery or a trigger (run once per row) of a table with at least per_row_rows rows
+    * An automatic index, i.e. sqlite builds an index for the statement because there is none
+
+ The issues can be saved as a baseline, and compare() returns the issues that are not in the baseline.
+"""
+import re
+import sqlite3
+from collections import OrderedDict
+
+# plugin modules
+from . import midv_tolkn_utils as utils
+
+
+def split_statements(sql):
+    """ Splits sql (e.g. a trigger body) into complete statements """
+    statements = []
+    current = ''
+    for part in sql.split(';'):
+        current += part + ';'
+        if sqlite3.complete_statement(current):
+            if current.strip(' ;\n\t'):
+                statements.append(current.strip().rstrip(';').strip())
+            current = ''
+    if current.strip(' ;\n\t'):
+        statements.append(current.strip().rstrip(';').strip())
+    return statements
+
+
+trigger_re = re.compile(r'''CREATE\s+TRIGGER\s+(?:IF\s+NOT\s+EXISTS\s+)?["']?(?P<name>[\w]+)["']?\s+(?:BEFORE|AFTER|INSTEAD\s+OF)\s+
+                            (?:INSERT|DELETE|UPDATE(?:\s+OF\s+.+?)?)\s+ON\s+["']?(?P<table>[\w]+)["']?(?:\s+FOR\s+EACH\s+ROW)?
+                            (?:\s+WHEN\s+(?P<when>.*?))?\s+BEGIN\s+(?P<body>.*?)\s*(?<!\w)END\s*;?\s*$''', re.IGNORECASE | re.DOTALL | re.VERBOSE)
+
+
+def trigger_statements(trigger_sql):
+    """
+    Returns (trigger name, table, [statements]) for a CREATE TRIGGER statement, with the WHEN clause as the first
+    statement (SELECT 1 WHERE ...) and NEW.x and OLD.x replaced by the parameters :new_x and :old_x.
+    Returns None if the trigger could not be parsed.
+    """
+    m = trigger_re.match(trigger_sql.strip())
+    if m is None:
+        return None
+    statements = []
+    if m.group('when'):
+        statements.append('SELECT 1 WHERE ' + m.group('when'))
+    statements.extend(split_statements(m.group('body')))
+    statements = [re.sub(r'''\b(NEW|OLD)\.(["']?)(\w+)\2''', lambda r: ':%s_%s' % (r.group(1).lower(), r.group(3)), statement, flags=re.IGNORECASE)
+                  for statement in statements]
+    return m.group('name'), m.group('table'), statements
+
+
+def parameters(sql):
+    """ Returns None for every parameter in sql, EXPLAIN QUERY PLAN doesn't use the values """
+    named = re.findall(r'''(?<![:\w]):([A-Za-z_]\w*)''', re.sub(r"'[^']*'", "''", sql))
+    if named:
+        return dict([(name, None) for name in named])
+    return tuple([None] * re.sub(r"'[^']*'", "''", sql).count('?'))
+
+
+def explain(conn, sql):
+    """ Returns the query plan as a list of (id, parent, detail) """
+    return [(row[0], row[1], row[-1]) for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, parameters(sql))]
+
+
+table_alias_re = re.compile(r'''(?:FROM|JOIN|,)\s+(?:\w+\.)?["']?(\w+)["']?\s+(?:AS\s+)?(?!FROM\b|WHERE\b|AND\b|OR\b|ON\b|JOIN\b|LEFT\b|INNER\b|CROSS\b|USING\b|GROUP\b|ORDER\b|LIMIT\b|UNION\b|SET\b)(\w+)''',
+                            re.IGNORECASE)
+
+
+def table_aliases(sql):
+    """ Returns {alias: table} for the tables with an alias in sql, the query plan uses the alias """
+    return dict([(alias, table) for table, alias in table_alias_re.findall(sql)])
+
+
+def plan_issues(plan, sql, row_counts, large_rows=10000, per_row_rows=100, per_row=False, expected_scans=()):
+    """
+    Returns the issues of a query plan as a list of strings (without row counts, so they can be compared between databases)
+
+    :param row_counts: {tablename: rows}, tables that are not in it (virtual tables, temp tables) are not counted
+    :param per_row: True if the statement runs once per row (a trigger)
+    :param expected_scans: Tables that the statement is meant to read completely
+    """
+    aliases = table_aliases(sql)
+    details = dict([(node_id, detail) for node_id, parent, detail in plan])
+    parents = dict([(node_id, parent) for node_id, parent, detail in plan])
+    issues = []
+    for node_id, parent, detail in plan:
+        if 'AUTOMATIC' in detail.upper():
+            issues.append('automatic index: ' + normalize(detail))
+            continue
+        m = re.match(r'SCAN (?:TABLE )?(?:\w+\.)?(\w+)', detail)
+        if m is None or 'VIRTUAL TABLE' in detail.upper() or re.match(r'SCAN (\d+ )?CONSTANT ROW', detail):
+            continue
+        table = aliases.get(m.group(1), m.group(1))
+        if table not in row_counts:
+            continue
+        rows = row_counts[table]
+        # Is the scan inside a correlated subquery?
+        correlated = False
+        ancestor = parent
+        while ancestor in details:
+            if 'CORRELATED' in details[ancestor].upper():
+                correlated = True
+                break
+            ancestor = parents[ancestor]
+        if correlated or per_row:
+            if rows >= per_row_rows:
+                issues.append('scan per row: ' + normalize(detail))
+        elif rows >= large_rows and table not in expected_scans:
+            issues.append('scan: ' + normalize(detail))
+    return issues
+
+
+def normalize(detail):
+    """ Plan details from older sqlite versions have SCAN TABLE and SEARCH TABLE """
+    return re.sub(r'^(SCAN|SEARCH) TABLE ', r'\1 ', detail)
+
+
+def shipped_statements(dbpath):
+    """
+    Returns the statements to audit as a list of (id, sql, per_row, expected_scans)
+
+    The database is attached as a for the upgrade statements.
+    """
+    schema = utils.SchemaSnapshot.get(dbpath)
+    statements = []
+    for number, sql in enumerate(utils.recalculate_tillromr_queries):
+        statements.append(('recalculate tillromr %s' % number, sql, False, ('tillromr', )))
+    for number, sql in enumerate(utils.recalculate_tillromr_sql(where="""pkuid IN (SELECT pkuid FROM temp.tillromr_recalc)""")):
+        statements.append(('recalculate tillromr incremental %s' % number, sql, False, ()))
+    statements.append(('tillromr changed', utils.tillromr_changed_sql, False, ('tillromr_recalc_log', )))
+    statements.append(('dagvatten_lPs range', utils.dagvatten_lPs_range_sql, False, ()))
+
+    shipped_triggers = OrderedDict()
+    for sql in utils.sqlfile_statements('insert_triggers.sql'):
+        parsed = trigger_statements(sql)
+        if parsed is not None and parsed[1] in schema.tables:
+            shipped_triggers[parsed[0]] = sql
+            for number, statement in enumerate(parsed[2]):
+                statements.append(('trigger %s %s' % (parsed[0], number), statement, True, ()))
+    # The triggers in the database that are not the shipped ones (e.g. in a database created by an older plugin version)
+    for name, sql in utils.ConnectionManager.get(dbpath).execute("""SELECT name, sql FROM sqlite_master WHERE type = 'trigger'"""):
+        if name in shipped_triggers and re.sub(r'\s+', ' ', shipped_triggers[name]).rstrip(';') == re.sub(r'\s+', ' ', sql).rstrip(';'):
+            continue
+        parsed = trigger_statements(sql)
+        if parsed is not None:
+            for number, statement in enumerate(parsed[2]):
+                statements.append(('database trigger %s %s' % (parsed[0], number), statement, True, ()))
+
+    plan = utils.UpgradePlan(schema, schema)
+    for tname, table_plan in plan.tables.items():
+        if table_plan.strategy == utils.UpgradePlan.SKIP:
+            continue
+        sql = utils.UpgradeDatabase.insert_sql(tname, table_plan)
+        # The data domains are copied first, so the foreign key checks of the layers (a scan if the column has no
+        # index) are made on empty tables.
+        expected_scans = tuple(schema.tables) if tname.startswith('zz_') else (tname, )
+        statements.append(('upgrade %s' % tname, sql, False, expected_scans))
+        statements.append(('upgrade %s batch' % tname, sql + utils.UpgradeDatabase.batch_where, False,
+                           tuple([t for t in expected_scans if t != tname])))
+    return statements
+
+
+def audit_database(dbpath, large_rows=10000, per_row_rows=100):
+    """
+    Runs EXPLAIN QUERY PLAN for the shipped statements against dbpath
+
+    :return: list of OrderedDict with id, sql, plan (list of details), issues and error (if the statement
+             could not be planned, e.g. a table missing in an old database)
+    """
+    schema = utils.SchemaSnapshot.get(dbpath)
+    conn = utils.ConnectionManager.get(dbpath)
+    conn.execute("""CREATE TEMP TABLE IF NOT EXISTS tillromr_recalc (pkuid integer primary key)""")
+    conn.execute("""ATTACH DATABASE ? AS a""", (dbpath, ))
+    results = []
+    try:
+        for statement_id, sql, per_row, expected_scans in shipped_statements(dbpath):
+            result = OrderedDict([('id', statement_id), ('sql', re.sub(r'\s+', ' ', sql).strip())])
+            try:
+                plan = explain(conn, sql)
+            except sqlite3.Error as e:
+                result['error'] = str(e)
+                result['issues'] = []
+            else:
+                result['plan'] = [normalize(detail) for node_id, parent, detail in plan]
+                result['issues'] = plan_issues(plan, sql, schema.row_counts, large_rows, per_row_rows, per_row, expected_scans)
+            results.append(result)
+    finally:
+        conn.execute("""DETACH DATABASE a""")
+        conn.execute("""DROP TABLE IF EXISTS temp.tillromr_recalc""")
+    return results
+
+
+def issues_by_statement(results):
+    """ Returns {id: issues} for the statements with issues, the format of a baseline """
+    return OrderedDict([(result['id'], result['issues']) for result in results if result['issues']])
+
+
+def compare(baseline, results):
+    """
+    Returns {id: new issues} for the issues in results that are not in baseline ({id: issues})
+    """
+    regressions = OrderedDict()
+    for statement_id, issues in issues_by_statement(results).items():
+        new_issues = [issue for issue in issues if issue not in baseline.get(statement_id, [])]
+        if new_issues:
+            regressions[statement_id] = new_issues
+    return regressions
+
+
+def audit_text(results):
+    lines = []
+    for result in results:
+        if result['issues'] or result.get('error'):
+            lines.append(result['id'] + ': ' + ', '.join(result['issues'] or ['error ' + result.get('error', '')]))
+            lines.append('    ' + result['sql'][:300])
+    return '\n'.join(lines) if lines else "No query plan issues"
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ This is the part of the midv_tolkn plugin that times the sql statements of the plugin connections.
+                              -------------------
+        begin                : 2026-10-18
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+ The trace is activated by the setting midv_tolkn/sql_trace or the environment variable MIDV_TOLKN_SQL_TRACE=1.
+ It applies to connections opened after that (utils.ConnectionManager and NewDb). Every statement is then timed
+ and statements slower than midv_tolkn/sql_trace_slow_ms (or MIDV_TOLKN_SQL_TRACE_SLOW_MS, default 500 ms)
+ are written to the message log, and to the file QGIS_LOG_FILE if it's set.
+
+ The time of a select is the time until the first row is returned, which for aggregates and sorted
+ results is most of the work.
+"""
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from qgis.PyQt.QtCore import QSettings
+from qgis.core import Qgis
+
+
+class SqlTrace(object):
+    """
+    Collects the time, number of rows and operation of each traced statement
+
+    The statements are grouped by operation and sql (whitespace normalized), summary() returns the groups with
+    the longest total time.
+    """
+    _lock = threading.Lock()
+    _stats = {}
+    _thread_state = threading.local()
+    _slow_seconds = None
+
+    @staticmethod
+    def enabled():
+        if os.environ.get('MIDV_TOLKN_SQL_TRACE'):
+            return os.environ['MIDV_TOLKN_SQL_TRACE'].lower() not in ('0', 'false', 'no')
+        return QSettings().value('midv_tolkn/sql_trace', False, type=bool)
+
+    @classmethod
+    def slow_seconds(cls):
+        """ The threshold is read once (not for every statement), reset() makes it read again """
+        if cls._slow_seconds is None:
+            slow_ms = os.environ.get('MIDV_TOLKN_SQL_TRACE_SLOW_MS') or QSettings().value('midv_tolkn/sql_trace_slow_ms', 500)
+            cls._slow_seconds = float(slow_ms) / 1000.0
+        return cls._slow_seconds
+
+    @classmethod
+    @contextmanager
+    def operation(cls, label):
+        """ Labels the statements of this thread, e.g. with SqlTrace.operation('Upgrade'): ... """
+        previous = getattr(cls._thread_state, 'operation', None)
+        cls._thread_state.operation = label if previous is None else previous + ' / ' + label
+        try:
+            yield
+        finally:
+            cls._thread_state.operation = previous
+
+    @classmethod
+    def current_operation(cls):
+        """ Returns the operation label and the plugin function that executed the statement """
+        caller = None
+        frame = sys._getframe(1)
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+            if module != __name__ and not module.startswith(('sqlite3', 'qgis.')):
+                caller = '%s.%s' % (module.split('.')[-1], frame.f_code.co_name)
+                break
+            frame = frame.f_back
+        label = getattr(cls._thread_state, 'operation', None)
+        if label is None:
+            return caller
+        return label if caller is None else label + ' / ' + caller
+
+    @classmethod
+    def record(cls, sql, seconds, rowcount, operation):
+        sql = re.sub(r'\s+', ' ', sql).strip()
+        key = (operation, sql)
+        with cls._lock:
+            stats = cls._stats.setdefault(key, {'operation': operation, 'sql': sql, 'count': 0, 'seconds': 0.0,
+                                                'max_seconds': 0.0, 'rows': 0})
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            if rowcount is not None and rowcount > 0:
+                stats['rows'] += rowcount
+        if seconds >= cls.slow_seconds():
+            # utils imports this module, so it's imported here
+            from . import midv_tolkn_utils as utils
+            msg = "Slow sql (%.3f s, %s rows) in %s: %s" % (
+                seconds, rowcount if rowcount is not None and rowcount >= 0 else '?', operation, sql[:1000])
+            utils.MessagebarAndLog.warning(log_msg=msg)
+            utils.write_qgs_log_to_file(msg, 'Midvatten', Qgis.Warning)
+
+    @classmethod
+    def summary(cls, top=20):
+        """ Returns the top statement groups (dicts) by total time """
+        with cls._lock:
+            stats = [dict(s) for s in cls._stats.values()]
+        return sorted(stats, key=lambda s: s['seconds'], reverse=True)[:top]
+
+    @classmethod
+    def summary_text(cls, top=20):
+        lines = ["%8.3f s %6d times %8.3f s max %9d rows  %s: %s" % (
+            s['seconds'], s['count'], s['max_seconds'], s['rows'], s['operation'], s['sql'][:300]) for s in cls.summary(top)]
+        return '\n'.join(lines) if lines else "No traced sql statements"
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._stats.clear()
+        cls._slow_seconds = None
+
+
+class TracedCursor(sqlite3.Cursor):
+    def _traced(self, function, sql, *args):
+        operation = SqlTrace.current_operation()
+        start = time.time()
+        try:
+            return function(sql, *args)
+        finally:
+            SqlTrace.record(sql, time.time() - start, self.rowcount, operation)
+
+    def execute(self, sql, parameters=()):
+        return self._traced(super(TracedCursor, self).execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._traced(super(TracedCursor, self).executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._traced(super(TracedCursor, self).executescript, sql_script)
+
+
+class TracedConnection(sqlite3.Connection):
+    """ A sqlite3 connection where all statements (also conn.execute) are run by a TracedCursor """
+    def cursor(self, factory=TracedCursor):
+        return super(TracedConnection, self).cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def connection_factory():
+    """ Returns the factory for sqlite3.connect (and spatialite_connect): TracedConnection if the trace is enabled """
+    return TracedConnection if SqlTrace.enabled() else sqlite3.Connection
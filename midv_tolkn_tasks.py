@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ This is the part of the midv_tolkn plugin that runs long database operations as background tasks.
+                              -------------------
+        begin                : 2026-10-18
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import traceback
+from collections import deque
+
+from qgis.core import QgsApplication, QgsFeedback, QgsTask
+
+# plugin modules
+from . import midv_tolkn_utils as utils
+from .midv_tolkn_sqltrace import SqlTrace
+
+
+class DbTask(QgsTask):
+    """
+    Runs function(*args, feedback=feedback, **kwargs) off the main thread
+
+    The function gets its own connections from utils.ConnectionManager (the connections are per thread),
+    reports progress using feedback.setProgress and checks feedback.isCanceled() between steps.
+    When the task is cancelled, a running sql statement is interrupted and the open transaction is rolled back.
+
+    The function must not show any dialogs. utils.MessagebarAndLog and utils.pop_up_info only write to the
+    log when they are used from a task.
+
+    :param on_finished: Called as on_finished(result of function) on the main thread if the function succeeded.
+    """
+    def __init__(self, description, dbpath, function, *args, on_finished=None, **kwargs):
+        super(DbTask, self).__init__(description, QgsTask.CanCancel)
+        self.dbpath = dbpath
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.on_finished = on_finished
+        self.result = None
+        self.error = None
+        self.feedback = QgsFeedback()
+        self.feedback.progressChanged.connect(self.setProgress)
+
+    def cancel(self):
+        self.feedback.cancel()
+        super(DbTask, self).cancel()
+
+    def run(self):
+        utils.ConnectionManager.set_cancel_check(self.feedback.isCanceled)
+        try:
+            with SqlTrace.operation(self.description()):
+                self.result = self.function(*self.args, feedback=self.feedback, **self.kwargs)
+        except Exception:
+            if not self.feedback.isCanceled():
+                self.error = traceback.format_exc()
+            return False
+        finally:
+            utils.ConnectionManager.set_cancel_check(None)
+            utils.ConnectionManager.release_thread()
+        return not self.feedback.isCanceled()
+
+    def finished(self, result):
+        if SqlTrace.enabled():
+            utils.MessagebarAndLog.info(log_msg="Slowest sql statements so far (total time, count, max time, rows, operation):\n" + SqlTrace.summary_text(10))
+        if result:
+            if self.on_finished is not None:
+                self.on_finished(self.result)
+        elif self.error is not None:
+            utils.MessagebarAndLog.critical(bar_msg=self.description() + " failed, see log message panel", log_msg=self.error)
+        else:
+            utils.MessagebarAndLog.info(bar_msg=self.description() + " was cancelled, all changes were rolled back")
+
+
+class DbTaskQueue(object):
+    """
+    Runs the tasks of each database one at a time, so two tasks never write to the same database
+
+    The queued tasks are kept here, QgsTaskManager only gets a task when it's time to start it.
+    """
+    _queues = {}
+    _running = {}
+
+    @classmethod
+    def add(cls, task):
+        key = os.path.normcase(os.path.realpath(task.dbpath))
+        cls._queues.setdefault(key, deque()).append(task)
+        task.taskCompleted.connect(lambda: cls._start_next(key))
+        task.taskTerminated.connect(lambda: cls._start_next(key))
+        if key not in cls._running:
+            cls._start_next(key)
+        else:
+            utils.MessagebarAndLog.info(bar_msg=task.description() + " will start when the running task for the database is finished")
+
+    @classmethod
+    def _start_next(cls, key):
+        cls._running.pop(key, None)
+        queue = cls._queues.get(key)
+        if not queue:
+            cls._queues.pop(key, None)
+            return
+        task = queue.popleft()
+        cls._running[key] = task
+        QgsApplication.taskManager().addTask(task)
+
+    @classmethod
+    def cancel_all(cls):
+        for queue in cls._queues.values():
+            queue.clear()
+        for task in list(cls._running.values()):
+            task.cancel()
+
+
+def run_in_task(description, dbpath, function, *args, on_finished=None, **kwargs):
+    """
+    Queues function as a DbTask for dbpath
+
+    :return: The DbTask
+    """
+    task = DbTask(description, dbpath, function, *args, on_finished=on_finished, **kwargs)
+    DbTaskQueue.add(task)
+    return task
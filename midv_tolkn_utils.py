@@ -19,17 +19,133 @@
  ***************************************************************************/
 """
 import datetime
+import math
 import os
+import re
+import shutil
 import sqlite3
-from collections import OrderedDict
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
 
 import qgis.utils
-from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtCore import QCoreApplication, QThread
 from qgis.PyQt.QtWidgets import QDialog, QMessageBox, QPushButton, QLineEdit, QInputDialog
 from qgis.core import QgsLogger, QgsProject, Qgis, QgsApplication
 from qgis.utils import spatialite_connect
 
 from . import midv_tolkn_defs as defs
+from . import midv_tolkn_sqltrace
+from . import midv_tolkn_workers
+
+
+class ConnectionManager(object):
+    """ Keeps one long-lived spatialite connection per database file and thread
+
+    Loading mod_spatialite is expensive, so dbconnection, sql_load_fr_db, sql_alter_db, LoadLayers,
+    UpgradeDatabase and the plugin actions all reuse the connection from here instead of reconnecting
+    for every statement.
+
+    * Foreign keys are enabled once, when the connection is created.
+    * sqlite3 keeps up to cached_statements prepared statements per connection.
+    * If the database file has been replaced (i.e. a new database written to the same path),
+      the old connection is closed and a new one is opened.
+
+    Usage: conn = ConnectionManager.get(dbpath)
+    The connection must not be closed by the caller, use ConnectionManager.close(dbpath) when
+    the file is going to be removed and ConnectionManager.close_all() when the plugin is unloaded.
+
+    A background task registers its cancel check with set_cancel_check. The connections of that thread
+    then interrupt running statements when the task is cancelled, and release_thread rolls back and
+    closes them when the task is done.
+    """
+    cached_statements = 256
+    progress_handler_steps = 10000
+    _connections = {}
+    _lock = threading.Lock()
+    _thread_state = threading.local()
+
+    @staticmethod
+    def _realpath(dbpath):
+        return os.path.normcase(os.path.realpath(dbpath))
+
+    @staticmethod
+    def _file_id(realpath):
+        try:
+            stat = os.stat(realpath)
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino)
+
+    @classmethod
+    def get(cls, dbpath):
+        realpath = cls._realpath(dbpath)
+        key = (realpath, threading.get_ident())
+        with cls._lock:
+            conn, file_id = cls._connections.pop(key, (None, None))
+        if conn is not None:
+            if file_id is not None and file_id == cls._file_id(realpath):
+                with cls._lock:
+                    cls._connections[key] = (conn, file_id)
+                cls._set_progress_handler(conn)
+                return conn
+            conn.close()
+
+        # check_same_thread=False only to allow close_all() from the main thread. Connections are never
+        # handed out to another thread than the one that created them.
+        conn = spatialite_connect(realpath, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
+                                  cached_statements=cls.cached_statements, check_same_thread=False,
+                                  factory=midv_tolkn_sqltrace.connection_factory())
+        conn.execute("PRAGMA foreign_keys = ON")  # Foreign key constraints are disabled by default, so must be enabled separately for each database connection.
+        with cls._lock:
+            cls._connections[key] = (conn, cls._file_id(realpath))
+        cls._set_progress_handler(conn)
+        return conn
+
+    @classmethod
+    def _set_progress_handler(cls, conn):
+        is_canceled = getattr(cls._thread_state, 'is_canceled', None)
+        if is_canceled is None:
+            conn.set_progress_handler(None, 0)
+        else:
+            # A non-zero return value interrupts the statement (sqlite3.OperationalError: interrupted)
+            conn.set_progress_handler(lambda: 1 if is_canceled() else 0, cls.progress_handler_steps)
+
+    @classmethod
+    def set_cancel_check(cls, is_canceled):
+        """ Makes the connections of the current thread interrupt statements when is_canceled() returns True """
+        cls._thread_state.is_canceled = is_canceled
+
+    @classmethod
+    def release_thread(cls):
+        """ Rolls back and closes the connections of the current thread """
+        thread_id = threading.get_ident()
+        with cls._lock:
+            keys = [key for key in cls._connections if key[1] == thread_id]
+            conns = [cls._connections.pop(key)[0] for key in keys]
+        for conn in conns:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.close()
+
+    @classmethod
+    def close(cls, dbpath):
+        """ Closes all connections to dbpath, for example before the file is removed or replaced """
+        realpath = cls._realpath(dbpath)
+        with cls._lock:
+            keys = [key for key in cls._connections if key[0] == realpath]
+            conns = [cls._connections.pop(key)[0] for key in keys]
+        for conn in conns:
+            conn.close()
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            conns = [conn for conn, file_id in cls._connections.values()]
+            cls._connections.clear()
+        for conn in conns:
+            conn.close()
 
 
 class dbconnection(): # in use
@@ -39,7 +155,7 @@ class dbconnection(): # in use
     def connect2db(self):
         if os.path.exists(self.dbpath):
             try:#verify this is an existing sqlite database
-                self.conn = spatialite_connect(self.dbpath,detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+                self.conn = ConnectionManager.get(self.dbpath)
                 self.conn.cursor().execute("select count(*) from sqlite_master") 
                 ConnectionOK = True
             except:
@@ -51,7 +167,10 @@ class dbconnection(): # in use
         return ConnectionOK
         
     def closedb(self):
-            self.conn.close()
+        # The connection is shared through ConnectionManager and stays open. Uncommitted changes are
+        # rolled back, just like they would have been when closing the connection.
+        if self.conn.in_transaction:
+            self.conn.rollback()
 
 class Askuser(QDialog):
     def __init__(self, question="YesNo", msg = '', dialogtitle='User input needed', parent=None):
@@ -129,9 +248,9 @@ class MessagebarAndLog(object):
 
     @staticmethod
     def log(bar_msg=None, log_msg=None, duration=10, messagebar_level=Qgis.Info, log_level=Qgis.Info, button=True):
-        if qgis.utils.iface is None:
-            return None
-        if bar_msg is not None:
+        # The messageBar must only be used from the main thread, background tasks (and the command line
+        # interface, without iface) only write to the log
+        if bar_msg is not None and qgis.utils.iface is not None and in_main_thread():
             widget = qgis.utils.iface.messageBar().createMessage(returnunicode(bar_msg))
             log_button = QPushButton(QCoreApplication.translate('MessagebarAndLog', "View message log"), pressed=show_message_log)
             if log_msg is not None and button:
@@ -160,17 +279,130 @@ class MessagebarAndLog(object):
         MessagebarAndLog.log(bar_msg, log_msg, duration, Qgis.Critical, Qgis.Critical, button)
 
 
-recalculate_tillromr_queries = ["""UPDATE tillromr SET area_km2 = round(ST_Area(geometry)/1000000.0,2)""",
-                                """UPDATE tillromr SET flode_lPs = round(ST_Area(geometry)*(gvbildn_mm/(365*86400))*andel_t_mag_proc/100.0,1)""",
-                                """UPDATE tillromr SET dagvatten_lPs = NULL;""",
-                                 '''UPDATE tillromr SET "dagvatten_lPs" = (SELECT SUM(ST_Area(foo.inters)*(foo.bortledning_proc/100)*(tillromr.gvbildn_mm/(365*86400))*(tillromr.andel_t_mag_proc/100)) 
+# Calculated columns in tillromr and the expressions used to calculate them
+tillromr_calculated_columns = OrderedDict([('area_km2', """round(ST_Area(geometry)/1000000.0,2)"""),
+                                           ('flode_lPs', """round(ST_Area(geometry)*(gvbildn_mm/(365*86400))*andel_t_mag_proc/100.0,1)"""),
+                                           ('dagvatten_lPs', '''(SELECT SUM(ST_Area(foo.inters)*(foo.bortledning_proc/100)*(tillromr.gvbildn_mm/(365*86400))*(tillromr.andel_t_mag_proc/100)) 
                                                                                      FROM (SELECT ST_Intersection(tillromr.geometry, d.geometry) as inters, bortledning_proc 
                                                                                            FROM dagvyta AS d 
                                                                                            WHERE CASE WHEN NOT EXISTS (SELECT 1 FROM SpatialIndex WHERE f_table_name = 'dagvyta' LIMIT 1) THEN ST_Intersects(tillromr.geometry, d.geometry)
                                                                                                      ELSE d.ROWID IN (SELECT rowid FROM SpatialIndex WHERE f_table_name = 'dagvyta' AND search_frame = tillromr.geometry) END
                                                                                      ) AS foo 
-                                                                                      WHERE st_dimension(foo.inters) = 2);'''
-                                ]
+                                                                                      WHERE st_dimension(foo.inters) = 2)''')])
+
+def recalculate_tillromr_sql(where=None, columns=None):
+    """
+    Returns the update queries for the calculated columns in tillromr
+    :param where: Optional sql condition limiting which rows in tillromr to recalculate
+    :param columns: Optional list of the columns to recalculate, default all in tillromr_calculated_columns
+    """
+    if columns is None:
+        columns = list(tillromr_calculated_columns.keys())
+    return [f'''UPDATE tillromr SET "{column}" = {tillromr_calculated_columns[column]}''' + (f''' WHERE {where}''' if where else '''''')
+            for column in columns]
+
+recalculate_tillromr_queries = recalculate_tillromr_sql()
+
+# The features in tillromr that are affected by changes logged in tillromr_recalc_log (by triggers in insert_triggers.sql):
+# Changed tillromr rows and tillromr rows that intersect the bounding box of a changed dagvyta row (before and after the change).
+tillromr_changed_sql = '''SELECT feature_pkuid FROM tillromr_recalc_log WHERE tablename = 'tillromr' AND pkuid <= :last_log_id
+                          UNION
+                          SELECT t.pkuid FROM tillromr AS t, tillromr_recalc_log AS l
+                          WHERE l.tablename = 'dagvyta' AND l.pkuid <= :last_log_id AND l.mbr IS NOT NULL
+                            AND CASE WHEN NOT EXISTS (SELECT 1 FROM SpatialIndex WHERE f_table_name = 'tillromr' LIMIT 1) THEN MbrIntersects(t.geometry, l.mbr)
+                                     ELSE t.ROWID IN (SELECT rowid FROM SpatialIndex WHERE f_table_name = 'tillromr' AND search_frame = l.mbr) END'''
+
+
+# dagvatten_lPs for a pkuid range of tillromr, calculated by the worker processes
+dagvatten_lPs_range_sql = f"""SELECT pkuid, {tillromr_calculated_columns['dagvatten_lPs']} FROM tillromr WHERE pkuid BETWEEN ? AND ?"""
+
+
+def calculate_dagvatten_lPs_in_processes(conn, dbpath, workers, feedback=None):
+    """
+    Calculates dagvatten_lPs for all rows in tillromr in worker processes
+
+    tillromr is split into pkuid ranges and each worker calculates its ranges using the same expression as the sql
+    (tillromr_calculated_columns['dagvatten_lPs']) on its own read-only connection. The workers read the committed
+    database, so this must be done before anything is written to tillromr.
+    :return: list of (dagvatten_lPs, pkuid)
+    """
+    pkuids = [row[0] for row in conn.execute("""SELECT pkuid FROM tillromr ORDER BY pkuid""")]
+    sql = dagvatten_lPs_range_sql
+    # More ranges than workers, so a worker that gets cheap ranges can continue with the next one.
+    ranges = midv_tolkn_workers.pkuid_ranges(pkuids, workers * 4)
+    result = []
+    for number, rows in enumerate(midv_tolkn_workers.run_in_processes(midv_tolkn_workers.select_pkuid_range,
+                                                [(dbpath, sql, first_pkuid, last_pkuid) for first_pkuid, last_pkuid in ranges],
+                                                workers), 1):
+        result.extend([(value, pkuid) for pkuid, value in rows])
+        check_cancelled(feedback)
+        if feedback is not None:
+            feedback.setProgress(80.0 * number / len(ranges))
+    return result
+
+
+def recalculate_tillromr(dbpath, incremental=False, workers=1, feedback=None):
+    """
+    Recalculates area_km2, flode_lPs and dagvatten_lPs in tillromr
+
+    :param dbpath: The database
+    :param incremental: If True, only the tillromr features that are affected by changes in tillromr or dagvyta
+                        since the last recalculation are recalculated. Databases without tillromr_recalc_log
+                        (created before the log existed) are always fully recalculated.
+    :param workers: If more than 1, a full recalculation calculates dagvatten_lPs in this number of worker processes.
+                    If the worker processes fail, the sql is used instead.
+    :param feedback: QgsFeedback for progress and cancellation (when run as a task), or None.
+    :return: The number of recalculated features when incremental, else None.
+    """
+    conn = ConnectionManager.get(dbpath)
+    has_log = conn.execute("""SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'tillromr_recalc_log'""").fetchone()[0] > 0
+    if not has_log and incremental:
+        MessagebarAndLog.info(log_msg="tillromr_recalc_log is missing in %s, all features in tillromr recalculated. Update the triggers to enable incremental recalculation." % dbpath)
+        incremental = False
+
+    try:
+        last_log_id = conn.execute("""SELECT max(pkuid) FROM tillromr_recalc_log""").fetchone()[0] if has_log else None
+        recalculated = None
+        if incremental:
+            conn.execute("""DROP TABLE IF EXISTS temp.tillromr_recalc""")
+            conn.execute("""CREATE TEMP TABLE tillromr_recalc (pkuid integer primary key)""")
+            conn.execute(f"""INSERT OR IGNORE INTO temp.tillromr_recalc (pkuid) {tillromr_changed_sql}""", {'last_log_id': last_log_id if last_log_id is not None else 0})
+            recalculated = conn.execute("""SELECT count(*) FROM temp.tillromr_recalc""").fetchone()[0]
+            queries = recalculate_tillromr_sql(where="""pkuid IN (SELECT pkuid FROM temp.tillromr_recalc)""") if recalculated else []
+        else:
+            queries = recalculate_tillromr_queries
+
+        dagvatten_lPs = None
+        if workers > 1 and not incremental:
+            try:
+                dagvatten_lPs = calculate_dagvatten_lPs_in_processes(conn, dbpath, workers, feedback)
+            except UserInterruptError:
+                raise
+            except Exception as e:
+                MessagebarAndLog.warning(log_msg="Calculating dagvatten_lPs in worker processes failed, using sql instead. msg: " + str(e))
+            else:
+                queries = recalculate_tillromr_sql(columns=[c for c in tillromr_calculated_columns if c != 'dagvatten_lPs'])
+
+        for number, sql in enumerate(queries, 1):
+            conn.execute(sql)
+            check_cancelled(feedback)
+            if feedback is not None:
+                feedback.setProgress((80.0 if dagvatten_lPs is not None else 0.0) + 20.0 * number / len(queries))
+        if dagvatten_lPs is not None:
+            conn.executemany("""UPDATE tillromr SET "dagvatten_lPs" = ? WHERE pkuid = ?""", dagvatten_lPs)
+        if last_log_id is not None:
+            # Only the log rows that existed when the recalculation started are removed.
+            conn.execute("""DELETE FROM tillromr_recalc_log WHERE pkuid <= ?""", (last_log_id, ))
+        if queries or dagvatten_lPs is not None:
+            update_layer_statistics(conn, ['tillromr'])
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        if incremental:
+            conn.execute("""DROP TABLE IF EXISTS temp.tillromr_recalc""")
+    return recalculated
 
 
 class UpgradeDatabase():#in use
@@ -181,7 +413,25 @@ class UpgradeDatabase():#in use
     ÖVRIGA_TABELLER:
         Den utgår från NYA databas-formatet och letar efter tabeller i gamla databasen som har samma namn och sedan försöker den kopiera innehållet i de kolumner som ska finnas i nya databasen
     """
-    def __init__(self, from_db, to_db):
+    def __init__(self, from_db, to_db, batch_size=None, resume=False, workers=1, plan=None, feedback=None):
+        """
+        :param feedback: QgsFeedback for progress and cancellation (when run as a task), or None.
+        :param plan: An UpgradePlan for from_db and to_db. If None, it's created when the upgrade starts.
+        :param workers: If more than 1, the tables in defs.default_layers() are converted (ST_Transform and column mapping)
+                        in this number of worker processes into temporary shard databases, which are then merged
+                        into to_db after the data domains.
+        :param batch_size: If given, each table is copied in batches of batch_size rows (ordered by pkuid) with a
+                           commit and a checkpoint in the table upgrade_checkpoint after each batch.
+                           If None, each table is copied using one statement.
+        :param resume: If True, tables and batches that are recorded as copied in upgrade_checkpoint are skipped,
+                       i.e. an interrupted upgrade into to_db continues where it stopped.
+        """
+        self.batch_size = batch_size
+        self.resume = resume
+        self.workers = workers
+        self.plan = plan
+        self.feedback = feedback
+        self.tables_done = 0
         self.export_2_splite(from_db, to_db)
         
     def export_2_splite(self,source_db,target_db):
@@ -192,80 +442,197 @@ class UpgradeDatabase():#in use
         :return:
 
         """
-        conn = spatialite_connect(target_db,detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+        conn = ConnectionManager.get(target_db)
+        self.conn = conn
+        self.source_db = source_db
+        self.target_db = target_db
         self.curs = conn.cursor()
-        self.curs.execute("PRAGMA foreign_keys = ON")
-        self.curs.execute(r"""ATTACH DATABASE '%s' AS a"""%source_db)
-        conn.commit()#commit sql statements so far
-
-        # first transfer data from data domains (beginning with zz_ in the database)
-        dd_tables = self.curs.execute("select name from sqlite_master where name like 'zz_%'")
-        d_domain_tables = [str(dd_table[0]) for dd_table in dd_tables]
-        for tablename in d_domain_tables:
-            self.to_sql(tablename)
-        conn.commit()
+        if self.batch_size:
+            self.curs.execute("""CREATE TABLE IF NOT EXISTS upgrade_checkpoint (tablename text primary key, source_db text, last_rowid integer, rows_copied integer, done integer)""")
+            if not self.resume:
+                self.curs.execute("""DELETE FROM upgrade_checkpoint""")
+            conn.commit()
+        self.curs.execute(r"""ATTACH DATABASE ? AS a""", (source_db,))
+        try:
+            if self.plan is None:
+                self.plan = UpgradePlan.for_databases(source_db, target_db)
+            MessagebarAndLog.info(log_msg=self.plan.summary())
 
-        #ordered dictionary of layers with (some) data domains
-        layers_dict = defs.default_layers()
-        for tablename in list(layers_dict.keys()):
-            self.to_sql(tablename)
-        conn.commit()
+            # first transfer data from data domains (beginning with zz_ in the database)
+            for tablename in self.plan.domain_tables():
+                self.to_sql(tablename)
+            conn.commit()
 
-        self.curs.execute(r"""DETACH DATABASE a""")
+            #ordered dictionary of layers with (some) data domains
+            layers = self.plan.layer_tables()
+            if self.workers > 1:
+                self.to_sql_in_processes(layers)
+            else:
+                for tablename in layers:
+                    self.to_sql(tablename)
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            self.curs.execute(r"""DETACH DATABASE a""")
+
+        # The dagvatten_lPs calculation is a lot faster with a valid spatial index on dagvyta
+        audit_spatial_indexes(target_db, thorough=True)
+        check_cancelled(self.feedback)
 
-        for sql in recalculate_tillromr_queries:
-            self.curs.execute(sql)
+        # All rows were inserted, so the incremental log is replaced by a full recalculation.
+        recalculate_tillromr(target_db)
+        check_cancelled(self.feedback)
+        if self.batch_size:
+            self.curs.execute("""DROP TABLE IF EXISTS upgrade_checkpoint""")
+        update_layer_statistics(conn)
         conn.commit()
-        self.curs.execute('vacuum')
+        # The new database has auto_vacuum = INCREMENTAL, so the pages freed during the upgrade are reclaimed
+        # without rewriting the whole file.
+        vacuum_db(target_db, mode='incremental')
 
-        MessagebarAndLog.info("Export done! Layers from the new database will be loaded to your qgis project")
+        MessagebarAndLog.info(log_msg="Export of %s to %s done" % (source_db, target_db))
 
         conn.commit()
-        conn.close()
 
     def to_sql(self, tname):
-        self.curs.execute(f"""SELECT * FROM "{tname}" LIMIT 1""")
-        columns_list = [col[0] for col in self.curs.description]
+        table_plan = self.plan.tables.get(tname)
+        if table_plan is None or table_plan.strategy == UpgradePlan.SKIP:
+            return
+        sql = self.insert_sql(tname, table_plan)
 
-        if tname.startswith('zz_'):
-            columns_list = [col for col in columns_list if col != 'pkuid']
+        if self.batch_size:
+            self.copy_in_batches(tname, sql)
+        else:
+            #print(f"old_columns_list {old_columns_list}, columns_list {columns_list}, got names {column_names} ")
+            try:
+                self.curs.execute(sql)
+            except Exception as e:
+                MessagebarAndLog.critical("Export warning: sql failed. See message log.", sql + "\nmsg: " + str(e))
+        self.table_done()
 
-        try:
-            self.curs.execute(f"""SELECT * FROM a."{tname}" LIMIT 1""")
-        except sqlite3.OperationalError as e:
-            if 'no such table' in str(e):
-                return
-            else:
-                raise
+    @staticmethod
+    def insert_sql(tname, table_plan):
+        """ Returns the statement that copies the table from the attached database a, using the UpgradeTable table_plan """
+        column_names = ', '.join([f'"{c}"' for c in table_plan.columns])
+        return f'''INSERT OR IGNORE INTO {tname} ({column_names}) SELECT {', '.join(table_plan.source_columns)} FROM a."{tname}"'''
 
-        old_columns_list = [col[0] for col in self.curs.description]
-        columns_to_use = [c for c in columns_list if c in old_columns_list]
+    def table_done(self):
+        """ Reports the progress after each table and stops the upgrade if it has been cancelled """
+        self.tables_done += 1
+        check_cancelled(self.feedback)
+        if self.feedback is not None:
+            tables = len([table_plan for table_plan in self.plan.tables.values() if table_plan.strategy != UpgradePlan.SKIP])
+            self.feedback.setProgress(90.0 * self.tables_done / max(tables, 1))
 
-        self.curs.execute("""SELECT f_geometry_column, srid FROM geometry_columns WHERE f_table_name = ?""", (tname,))
-        dest_geom_cols_epsg = {row[0]: row[1] for row in self.curs.fetchall()}
-        #source_geom_cols_epsg = {row[0]: row[1] for row in self.curs.execute(
-        #    """SELECT f_geometry_column, srid FROM a.geometry_columns WHERE f_table_name = ?""",
-        #    tname)}
+    def to_sql_in_processes(self, tablenames):
+        """
+        Converts the tables in worker processes into shard databases and merges the shards into the new database
 
-        geom_cols = [c for c in columns_to_use if c in dest_geom_cols_epsg]
-        other = [c for c in columns_to_use if c not in geom_cols]
+        The workers do the heavy part (ST_Transform and column mapping) on their own connections. Each shard is merged
+        as soon as it's finished. Tables that are copied without transformation are cheaper to copy directly.
+        If the worker processes can't be used, the remaining tables are copied using to_sql.
+        """
+        jobs = OrderedDict()
+        for tname in tablenames:
+            table_plan = self.plan.tables.get(tname)
+            if table_plan is None or table_plan.strategy == UpgradePlan.SKIP:
+                continue
+            if table_plan.strategy == UpgradePlan.COPY:
+                self.to_sql(tname)
+                continue
+            if self.batch_size and self.curs.execute("""SELECT count(*) FROM upgrade_checkpoint WHERE tablename = ? AND done = 1""", (tname, )).fetchone()[0]:
+                continue
+            jobs[tname] = table_plan
+        if not jobs:
+            return
+        srids = [row[0] for row in self.curs.execute("""SELECT srid FROM spatial_ref_sys UNION SELECT srid FROM a.geometry_columns""")]
 
-        all_cols = list(other)
-        all_cols.extend(geom_cols)
+        shard_dir = tempfile.mkdtemp(prefix='midv_tolkn_upgrade_', dir=os.path.dirname(os.path.abspath(self.target_db)))
+        arguments_list = [(self.source_db, os.path.join(shard_dir, tname + '.sqlite'), tname,
+                           ', '.join([f'{source_col} AS "{col}"' for col, source_col in zip(table_plan.columns, table_plan.source_columns)]), srids)
+                          for tname, table_plan in jobs.items()]
+        merged = []
+        try:
+            for tname, shard_path, rows, seconds in midv_tolkn_workers.run_in_processes(midv_tolkn_workers.create_shard,
+                                                                                     arguments_list, self.workers):
+                MessagebarAndLog.info(log_msg=f"Upgrade: {tname}, {rows} rows converted in worker process in {seconds:.1f} s")
+                self.merge_shard(tname, shard_path, jobs[tname].columns)
+                merged.append(tname)
+        except UserInterruptError:
+            raise
+        except Exception as e:
+            MessagebarAndLog.warning(log_msg="Upgrade in worker processes failed, copying remaining tables directly. msg: " + str(e))
+            for tname in jobs:
+                if tname not in merged:
+                    self.to_sql(tname)
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
 
+    def merge_shard(self, tname, shard_path, all_cols):
         column_names = ', '.join([f'"{c}"' for c in all_cols])
-        source_cols = [f'''"{c}"''' for c in other]
-        if geom_cols:
-            source_cols.extend([f'''ST_Transform("{c}", {dest_geom_cols_epsg[c]})''' for c in geom_cols])
+        sql = f'''INSERT OR IGNORE INTO {tname} ({column_names}) SELECT {column_names} FROM shard."{tname}"'''
+        self.conn.commit()
+        self.curs.execute("""ATTACH DATABASE ? AS shard""", (shard_path, ))
+        try:
+            if self.batch_size:
+                self.copy_in_batches(tname, sql, source_schema='shard')
+            else:
+                try:
+                    self.curs.execute(sql)
+                except Exception as e:
+                    MessagebarAndLog.critical("Export warning: sql failed. See message log.", sql + "\nmsg: " + str(e))
+                self.conn.commit()
+        finally:
+            self.curs.execute("""DETACH DATABASE shard""")
+        self.table_done()
+
+    batch_where = """ WHERE rowid > ? AND rowid <= ? ORDER BY rowid"""
 
+    def copy_in_batches(self, tname, sql, source_schema='a'):
+        """
+        Copies a table in batches of self.batch_size rows ordered by rowid (pkuid) and commits after each batch
 
-        sql = f'''INSERT OR IGNORE INTO {tname} ({column_names}) SELECT {', '.join(source_cols)} FROM a."{tname}"'''
+        The last copied rowid is stored in upgrade_checkpoint in the same transaction as the batch, so an
+        interrupted upgrade can be resumed from there. A failed batch is rolled back and the error is raised.
+        :param sql: The INSERT ... SELECT ... FROM a."tname" statement for the whole table.
+        :param source_schema: The attached database that sql reads from.
+        """
+        checkpoint = self.curs.execute("""SELECT last_rowid, rows_copied, done FROM upgrade_checkpoint WHERE tablename = ?""", (tname, )).fetchone()
+        if checkpoint is None:
+            last_rowid, rows_copied, done = -2**63, 0, 0
+        else:
+            last_rowid, rows_copied, done = checkpoint
+        if done:
+            return
 
-        #print(f"old_columns_list {old_columns_list}, columns_list {columns_list}, got names {column_names} ")
+        batch_sql = sql + self.batch_where
+        start = time.time()
+        rows_this_run = 0
         try:
-            self.curs.execute(sql)
+            while True:
+                upper_rowid = self.curs.execute(f"""SELECT max(rowid) FROM (SELECT rowid FROM {source_schema}."{tname}" WHERE rowid > ? ORDER BY rowid LIMIT ?)""",
+                                                (last_rowid, self.batch_size)).fetchone()[0]
+                if upper_rowid is None:
+                    break
+                self.curs.execute(batch_sql, (last_rowid, upper_rowid))
+                rows_this_run += max(self.curs.rowcount, 0)
+                last_rowid = upper_rowid
+                self.curs.execute("""INSERT OR REPLACE INTO upgrade_checkpoint (tablename, source_db, last_rowid, rows_copied, done) VALUES (?, ?, ?, ?, 0)""",
+                                  (tname, self.source_db, last_rowid, rows_copied + rows_this_run))
+                self.conn.commit()
+            self.curs.execute("""INSERT OR REPLACE INTO upgrade_checkpoint (tablename, source_db, last_rowid, rows_copied, done) VALUES (?, ?, ?, ?, 1)""",
+                              (tname, self.source_db, last_rowid, rows_copied + rows_this_run))
+            self.conn.commit()
         except Exception as e:
-            MessagebarAndLog.critical("Export warning: sql failed. See message log.", sql + "\nmsg: " + str(e))
+            # The failed batch is rolled back and the upgrade stops, so upgrade_checkpoint is kept for resume=True.
+            self.conn.rollback()
+            MessagebarAndLog.critical("Export warning: sql failed. See message log.", batch_sql + "\nmsg: " + str(e))
+            raise
+
+        seconds = time.time() - start
+        MessagebarAndLog.info(log_msg=f"Upgrade: {tname}, {rows_this_run} rows copied in {seconds:.1f} s ({rows_this_run / seconds if seconds > 0 else 0:.0f} rows/s)")
 
 
 def find_layer(layer_name):
@@ -279,8 +646,28 @@ def getcurrentlocale():
 
 def pop_up_info(msg='',title='Information',parent=None):#in use
     """Display an info message via Qt box"""
+    if qgis.utils.iface is None or not in_main_thread():
+        MessagebarAndLog.warning(log_msg='%s: %s' % (title, msg))
+        return
     QMessageBox.information(parent, title, '%s' % (msg))
 
+
+def in_main_thread():
+    """ Returns True if called from the main (GUI) thread """
+    app = QCoreApplication.instance()
+    return app is None or QThread.currentThread() == app.thread()
+
+
+class UserInterruptError(Exception):
+    """ Raised when the user cancels a running operation """
+    pass
+
+
+def check_cancelled(feedback):
+    """ Raises UserInterruptError if feedback (a QgsFeedback or None) has been cancelled """
+    if feedback is not None and feedback.isCanceled():
+        raise UserInterruptError()
+
 def returnunicode(anything, keep_containers=False): #takes an input and tries to return it as unicode
     r"""
 
@@ -365,12 +752,11 @@ def show_message_log(pop_error=False):
 def sql_load_fr_db(sql='', dbpath=''):#in use
     if os.path.exists(dbpath):
         try:
-            conn = spatialite_connect(dbpath,detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)#dbpath is unicode already #MacOSC fix1
+            conn = ConnectionManager.get(dbpath)
             curs = conn.cursor()
             resultfromsql = curs.execute(sql) #Send SQL-syntax to cursor #MacOSX fix1
             result = resultfromsql.fetchall()
             resultfromsql.close()
-            conn.close()
             ConnectionOK = True
         except:
             textstring = """DB error!!: %s"""%sql
@@ -385,29 +771,421 @@ def sql_load_fr_db(sql='', dbpath=''):#in use
     return ConnectionOK, result
 
 def sql_alter_db(dbpath,sql=''):#in use
-    conn = spatialite_connect(dbpath,detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+    conn = ConnectionManager.get(dbpath)
     curs = conn.cursor()
     sql2 = sql 
-    curs.execute("PRAGMA foreign_keys = ON")    #Foreign key constraints are disabled by default (for backwards compatibility), so must be enabled separately for each database connection separately.
 
-    if isinstance(sql2, str):
-        try:
-            resultfromsql = curs.execute(sql2) #Send SQL-syntax to cursor
-        except sqlite3.IntegrityError as e:
-            raise sqlite3.IntegrityError("The sql failed:\n" + sql2 + "\nmsg:\n" + str(e))
+    try:
+        if isinstance(sql2, str):
+            try:
+                resultfromsql = curs.execute(sql2) #Send SQL-syntax to cursor
+            except sqlite3.IntegrityError as e:
+                raise sqlite3.IntegrityError("The sql failed:\n" + sql2 + "\nmsg:\n" + str(e))
+        else:
+            try:
+                resultfromsql = curs.executemany(sql2[0], sql2[1])
+            except sqlite3.IntegrityError as e:
+                raise sqlite3.IntegrityError(str(e))
+
+        result = resultfromsql.fetchall()
+        conn.commit()   # This one is absolutely needed when altering a db, python will not really write into db until given the commit command
+    except:
+        # The connection is reused, so a failed statement must not leave an open transaction behind.
+        conn.rollback()
+        raise
+    resultfromsql.close()
+
+    return result
+
+def freelist_info(conn):
+    """ Returns (page_count, freelist_count, page_size, auto_vacuum) """
+    return tuple([conn.execute(f"""PRAGMA {pragma}""").fetchone()[0] for pragma in ('page_count', 'freelist_count', 'page_size', 'auto_vacuum')])
+
+
+def vacuum_db(dbpath, mode='full', target_path=None, step_pages=1000, feedback=None):
+    """
+    Vacuums the database
+
+    :param mode:
+        'full': VACUUM. Rewrites the whole file and needs free disk space for a copy of it. Databases without
+                auto_vacuum (created before it was added) get auto_vacuum = INCREMENTAL, which takes effect
+                during the vacuum.
+        'incremental': PRAGMA incremental_vacuum in steps of step_pages pages, each step in its own short
+                       transaction, until the freelist is empty. Only works when auto_vacuum is INCREMENTAL.
+        'into': VACUUM INTO target_path. Writes a compacted copy, the database itself is only read.
+    :return: dict with freelist and page counts before and after, and seconds
+    """
+    conn = ConnectionManager.get(dbpath)
+    if conn.in_transaction:
+        conn.commit()
+    page_count, freelist_before, page_size, auto_vacuum = freelist_info(conn)
+    start = time.time()
+    if mode == 'full':
+        if auto_vacuum == 0:
+            conn.execute("""PRAGMA auto_vacuum = INCREMENTAL""")
+        conn.execute("""VACUUM""")
+    elif mode == 'incremental':
+        if auto_vacuum != 2:
+            MessagebarAndLog.warning(log_msg="auto_vacuum is not INCREMENTAL in %s, incremental vacuum does nothing until a full vacuum has been done" % dbpath)
+        freelist_count = freelist_before
+        while auto_vacuum == 2 and freelist_count:
+            # incremental_vacuum frees one page per step, so the rows must be fetched
+            conn.execute(f"""PRAGMA incremental_vacuum({int(step_pages)})""").fetchall()
+            freelist_count = conn.execute("""PRAGMA freelist_count""").fetchone()[0]
+            check_cancelled(feedback)
+            if feedback is not None and freelist_before:
+                feedback.setProgress(100.0 * (freelist_before - freelist_count) / freelist_before)
+    elif mode == 'into':
+        if os.path.exists(target_path):
+            raise ValueError("VACUUM INTO needs a new file, %s exists" % target_path)
+        conn.execute("""VACUUM INTO ?""", (target_path, ))
     else:
+        raise ValueError("Unknown vacuum mode " + str(mode))
+    seconds = time.time() - start
+
+    if mode == 'into':
+        target_conn = sqlite3.connect(target_path)
         try:
-            resultfromsql = curs.executemany(sql2[0], sql2[1])
-        except sqlite3.IntegrityError as e:
-            raise sqlite3.IntegrityError(str(e))
+            page_count_after, freelist_after = freelist_info(target_conn)[:2]
+        finally:
+            target_conn.close()
+    else:
+        page_count_after, freelist_after = freelist_info(conn)[:2]
+    result = {'mode': mode, 'page_size': page_size, 'page_count_before': page_count, 'freelist_before': freelist_before,
+              'page_count_after': page_count_after, 'freelist_after': freelist_after, 'seconds': seconds}
+    MessagebarAndLog.info(log_msg="Vacuum (%s) of %s: freelist %s -> %s pages, file %s -> %s pages of %s bytes in %.1f s" % (
+        mode, dbpath, freelist_before, freelist_after, page_count, page_count_after, page_size, seconds))
+    return result
 
-    result = resultfromsql.fetchall()
-    conn.commit()   # This one is absolutely needed when altering a db, python will not really write into db until given the commit command
-    resultfromsql.close()
-    conn.close()
 
+class SchemaSnapshot(object):
+    """
+    The schema of a database, read in one pass and cached until the database file changes
+
+    tables: list of table names
+    views: list of view names
+    columns: {tablename: [column names]}
+    primary_keys: {tablename: primary key column (or None)}
+    geometry_columns: {lower tablename: {lower geometry column: (srid, geometry_type, spatial_index_enabled)}}
+    spatial_indexes: {lower tablename: True if the R-tree of the geometry column exists and is enabled}
+    row_counts: {tablename: max(rowid)}, an estimate (deleted rows are counted) read from the end of the table b-tree
+    db_version: The plugin version that created the database, parsed from about_db, or None
+    """
+    _cache = {}
+
+    def __init__(self, dbpath):
+        self.dbpath = dbpath
+        conn = ConnectionManager.get(dbpath)
+        self.tables = []
+        self.views = []
+        self.columns = OrderedDict()
+        self.primary_keys = {}
+        virtual_tables = set()
+        for name, type, sql in conn.execute("""SELECT name, type, sql FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name""").fetchall():
+            # table_info of a view fails if the view uses a table that doesn't exist, the view is then skipped
+            try:
+                table_info = conn.execute(f"""PRAGMA table_info("{name}")""").fetchall()
+            except sqlite3.Error as e:
+                MessagebarAndLog.warning(log_msg="Skipped %s %s in %s: %s" % (type, name, dbpath, str(e)))
+                continue
+            (self.tables if type == 'table' else self.views).append(name)
+            self.columns[name] = [row[1] for row in table_info]
+            self.primary_keys[name] = None
+            for row in table_info:
+                if row[5] == 1:
+                    self.primary_keys[name] = row[1]
+            if (sql or '').upper().startswith('CREATE VIRTUAL'):
+                virtual_tables.add(name)
+
+        lower_tables = set([tname.lower() for tname in self.tables])
+        self.geometry_columns = {}
+        self.spatial_indexes = {}
+        if 'geometry_columns' in lower_tables:
+            for tname, column, srid, geometry_type, index_enabled in conn.execute(
+                    """SELECT f_table_name, f_geometry_column, srid, geometry_type, spatial_index_enabled FROM geometry_columns"""):
+                self.geometry_columns.setdefault(tname.lower(), {})[column.lower()] = (srid, geometry_type, index_enabled)
+                self.spatial_indexes[tname.lower()] = bool(index_enabled == 1 and f'idx_{tname}_{column}'.lower() in lower_tables)
+
+        self.row_counts = {}
+        counted = [tname for tname in self.tables if tname not in virtual_tables and not tname.startswith('sqlite_')]
+        if counted:
+            sql = ' UNION ALL '.join([f"""SELECT '{tname}', max(rowid) FROM "{tname}" """ for tname in counted])
+            self.row_counts = {tname: rows or 0 for tname, rows in conn.execute(sql)}
+
+        self.db_version = None
+        if 'about_db' in lower_tables:
+            row = conn.execute('select description FROM about_db LIMIT 1').fetchone()
+            m = re.search('midv_tolkn plugin[Version\ ]*([0-9\.]+),', row[0] or '', flags=re.IGNORECASE) if row else None
+            if m:
+                self.db_version = m.groups()[0]
+
+    @classmethod
+    def get(cls, dbpath):
+        """ Returns the snapshot of dbpath, read again only if the modification time or size of the file changed """
+        key = os.path.normcase(os.path.realpath(dbpath))
+        stat = os.stat(dbpath)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = cls._cache.get(key)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, cls(dbpath))
+            cls._cache[key] = cached
+        return cached[1]
+
+    def exists(self, name):
+        return name in self.columns
+
+    def domain_tables(self):
+        return [tname for tname in self.tables if tname.startswith('zz_')]
+
+    def geometry(self, tname, column='geometry'):
+        """ Returns (srid, geometry_type, spatial_index_enabled) for the geometry column, or None """
+        return self.geometry_columns.get(tname.lower(), {}).get(column.lower())
+
+    def missing_spatial_indexes(self, tablenames):
+        """ Returns the geometry tables in tablenames that doesn't have an enabled spatial index """
+        return [tname for tname in tablenames if tname.lower() in self.spatial_indexes and not self.spatial_indexes[tname.lower()]]
+
+
+UpgradeTable = namedtuple('UpgradeTable', 'strategy columns source_columns estimated_rows')
+
+
+class UpgradePlan(object):
+    """
+    Decides how each table is moved from an old database into a new one
+
+    copy: All columns are copied as they are, the geometries have the same SRID in both databases.
+    transform: At least one geometry column has another SRID and is reprojected using ST_Transform.
+    skip: The table doesn't exist or is empty in the old database.
+
+    Copying the geometry blobs is a lot cheaper than decoding and encoding them again in ST_Transform.
+    """
+    COPY = 'copy'
+    TRANSFORM = 'transform'
+    SKIP = 'skip'
+
+    def __init__(self, source, target):
+        """
+        :param source: SchemaSnapshot of the old database
+        :param target: SchemaSnapshot of the new database
+        """
+        self.tables = OrderedDict()
+        tablenames = target.domain_tables()
+        tablenames.extend(defs.default_layers().keys())
+        for tname in tablenames:
+            self.tables[tname] = self.plan_table(source, target, tname)
+
+    @classmethod
+    def for_databases(cls, source_db, target_db):
+        return cls(SchemaSnapshot.get(source_db), SchemaSnapshot.get(target_db))
+
+    def plan_table(self, source, target, tname):
+        columns_list = list(target.columns.get(tname, []))
+
+        if tname.startswith('zz_'):
+            columns_list = [col for col in columns_list if col != 'pkuid']
+
+        if not columns_list or tname not in source.tables:
+            return UpgradeTable(self.SKIP, [], [], 0)
+
+        old_columns_list = source.columns[tname]
+        columns_to_use = [c for c in columns_list if c in old_columns_list]
+
+        estimated_rows = source.row_counts.get(tname, 0)
+        if not estimated_rows:
+            return UpgradeTable(self.SKIP, [], [], 0)
+
+        dest_geom_cols_epsg = {col: geom[0] for col, geom in target.geometry_columns.get(tname.lower(), {}).items()}
+        source_geom_cols_epsg = {col: geom[0] for col, geom in source.geometry_columns.get(tname.lower(), {}).items()}
+
+        geom_cols = [c for c in columns_to_use if c.lower() in dest_geom_cols_epsg]
+        other = [c for c in columns_to_use if c not in geom_cols]
+
+        all_cols = list(other)
+        all_cols.extend(geom_cols)
+
+        source_cols = [f'''"{c}"''' for c in other]
+        strategy = self.COPY
+        for c in geom_cols:
+            dest_srid = dest_geom_cols_epsg[c.lower()]
+            if source_geom_cols_epsg.get(c.lower()) == dest_srid:
+                source_cols.append(f'''"{c}"''')
+            else:
+                source_cols.append(f'''ST_Transform("{c}", {dest_srid})''')
+                strategy = self.TRANSFORM
+        return UpgradeTable(strategy, all_cols, source_cols, estimated_rows)
+
+    def domain_tables(self):
+        return [tname for tname in self.tables if tname.startswith('zz_')]
+
+    def layer_tables(self):
+        return [tname for tname in self.tables if not tname.startswith('zz_')]
+
+    def summary(self):
+        lines = []
+        for strategy in (self.TRANSFORM, self.COPY, self.SKIP):
+            tables = [(tname, table_plan) for tname, table_plan in self.tables.items() if table_plan.strategy == strategy]
+            if not tables:
+                continue
+            rows = sum([table_plan.estimated_rows for tname, table_plan in tables])
+            lines.append(f"{strategy}: {len(tables)} tables, ca {rows} rows")
+            lines.extend([f"    {tname} (ca {table_plan.estimated_rows} rows)" for tname, table_plan in tables
+                          if strategy != self.SKIP and not tname.startswith('zz_')])
+        return '\n'.join(lines)
+
+
+def audit_spatial_indexes(dbpath, thorough=True, fix=True):
+    """
+    Checks the spatial index (R-tree) of every geometry table in defs.default_layers() and defs.comment_layers()
+
+    Without a spatial index, spatial queries like the dagvatten_lPs calculation must test every geometry in the table.
+
+    :param dbpath: The database
+    :param thorough: If True, the index is validated using CheckSpatialIndex (reads the whole table and index).
+                     If False, only the geometry_columns flag and the existence of the index table are checked.
+    :param fix: If True, missing indexes are created (CreateSpatialIndex) and invalid indexes are recovered (RecoverSpatialIndex).
+    :return: list of (tablename, status, number of rows) where status is one of 'ok', 'missing', 'invalid',
+             'created', 'recovered' or 'failed'. The number of rows is None for 'ok'.
+    """
+    conn = ConnectionManager.get(dbpath)
+    existing_tables = [row[0].lower() for row in conn.execute("""SELECT name FROM sqlite_master WHERE type = 'table'""")]
+    result = []
+    try:
+        for tablename in list(defs.default_layers().keys()) + defs.comment_layers():
+            row = conn.execute("""SELECT spatial_index_enabled FROM geometry_columns WHERE Lower(f_table_name) = Lower(?) AND Lower(f_geometry_column) = 'geometry'""",
+                               (tablename, )).fetchone()
+            if row is None:
+                continue
+            if row[0] != 1:
+                status = 'missing'
+            elif f'idx_{tablename}_geometry'.lower() not in existing_tables:
+                status = 'invalid'
+            elif thorough and conn.execute("""SELECT CheckSpatialIndex(?, 'geometry')""", (tablename, )).fetchone()[0] != 1:
+                status = 'invalid'
+            else:
+                status = 'ok'
+
+            if fix and status == 'missing':
+                ok = conn.execute("""SELECT CreateSpatialIndex(?, 'geometry')""", (tablename, )).fetchone()[0]
+                status = 'created' if ok == 1 else 'failed'
+            elif fix and status == 'invalid':
+                ok = conn.execute("""SELECT RecoverSpatialIndex(?, 'geometry')""", (tablename, )).fetchone()[0]
+                status = 'recovered' if ok == 1 else 'failed'
+            rowcount = conn.execute(f"""SELECT count(*) FROM "{tablename}" """).fetchone()[0] if status != 'ok' else None
+            result.append((tablename, status, rowcount))
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+
+    fixed = [r for r in result if r[1] != 'ok']
+    if fixed:
+        msgs = []
+        for tablename, status, rowcount in fixed:
+            msg = f"{tablename}: spatial index {status}, {rowcount} rows."
+            if status in ('created', 'recovered') and rowcount > 1:
+                # Without index every geometry is tested, with the R-tree only about log2(n) nodes are searched.
+                msg += f" Expected speedup for spatial queries: about {rowcount / math.log2(rowcount):.0f} times."
+            msgs.append(msg)
+        MessagebarAndLog.info(bar_msg="Spatial index audit: " + ', '.join([f"{r[0]} {r[1]}" for r in fixed]),
+                              log_msg='\n'.join(msgs))
     return result
 
+def update_layer_statistics(conn, tablenames=None):
+    """
+    Updates row count and extent in geometry_columns_statistics (and the vector_layers_statistics view)
+
+    The statistics are used by layer_statistics, so the extent of a layer can be read without reading its geometries.
+    The caller commits.
+
+    :param conn: A connection with spatialite loaded
+    :param tablenames: The geometry tables to update, None updates all of them
+    """
+    if tablenames is None:
+        conn.execute("""SELECT UpdateLayerStatistics()""")
+    else:
+        for tablename in tablenames:
+            conn.execute("""SELECT UpdateLayerStatistics(?, 'geometry')""", (tablename, ))
+
+
+def layer_statistics(dbpath, tablename, column='geometry'):
+    """
+    Returns (row_count, (extent_min_x, extent_min_y, extent_max_x, extent_max_y)) from geometry_columns_statistics
+
+    The statistics are stale if geometry_columns_time (kept by the spatialite triggers) has an insert, update or
+    delete after last_verified. Then, or if there are no statistics, None is returned and the extent must be
+    calculated from the geometries.
+    """
+    schema = SchemaSnapshot.get(dbpath)
+    if not schema.exists('geometry_columns_statistics') or not schema.exists('geometry_columns_time'):
+        return None
+    row = ConnectionManager.get(dbpath).execute("""
+        SELECT s.row_count, s.extent_min_x, s.extent_min_y, s.extent_max_x, s.extent_max_y
+        FROM geometry_columns_statistics AS s
+        LEFT JOIN geometry_columns_time AS t ON Lower(t.f_table_name) = Lower(s.f_table_name)
+                                             AND Lower(t.f_geometry_column) = Lower(s.f_geometry_column)
+        WHERE Lower(s.f_table_name) = Lower(?) AND Lower(s.f_geometry_column) = Lower(?)
+          AND s.last_verified IS NOT NULL
+          AND s.last_verified >= max(coalesce(t.last_insert, ''), coalesce(t.last_update, ''), coalesce(t.last_delete, ''))""",
+                                                (tablename, column)).fetchone()
+    if row is None or row[0] is None or None in row[1:]:
+        return None
+    return row[0], tuple(row[1:])
+
+
+def unfinished_upgrade(source_db, target_db):
+    """ Returns True if target_db has an upgrade checkpoint from source_db, i.e. an interrupted upgrade that can be resumed """
+    if not os.path.isfile(target_db):
+        return False
+    conn = ConnectionManager.get(target_db)
+    if not conn.execute("""SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'upgrade_checkpoint'""").fetchone()[0]:
+        return False
+    return conn.execute("""SELECT count(*) FROM upgrade_checkpoint WHERE source_db = ?""", (source_db, )).fetchone()[0] > 0
+
+def sqlfile_statements(sqlfilename):
+    """
+    Returns the sql statements in one of the files in sql_strings, one statement per line.
+    The first line (encoding info) and lines beginning with # or -- are skipped.
+    """
+    if not os.path.isabs(sqlfilename):
+        sqlfilename = os.path.join(os.path.dirname(__file__), "sql_strings", sqlfilename)
+    with open(sqlfilename, 'r', encoding='utf-8') as f:
+        f.readline()  # first line is encoding info....
+        return [line.strip() for line in f if line.strip() and not line.startswith('#') and not line.startswith('--')]
+
+def replace_triggers(dbpath):
+    """
+    Replaces the triggers in an existing database with the trigger set in insert_triggers.sql
+
+    All plugin triggers (tai_*, tau_* and tad_*) are dropped and recreated in one transaction. Triggers for
+    tables that don't exist in the database (created by an old plugin version) are skipped.
+    :param dbpath: The database to update
+    :return: A list of the names of the created triggers
+    """
+    conn = ConnectionManager.get(dbpath)
+    existing_tables = [row[0] for row in conn.execute("""SELECT name FROM sqlite_master WHERE type = 'table'""")]
+    old_triggers = [row[0] for row in conn.execute(r"""SELECT name FROM sqlite_master WHERE type = 'trigger' AND (name LIKE 'tai\_%' ESCAPE '\' OR name LIKE 'tau\_%' ESCAPE '\' OR name LIKE 'tad\_%' ESCAPE '\')""")]
+
+    created = []
+    conn.execute("BEGIN")
+    try:
+        for trigger_name in old_triggers:
+            conn.execute(f"""DROP TRIGGER IF EXISTS "{trigger_name}" """)
+        for sql in sqlfile_statements("insert_triggers.sql"):
+            m = re.match(r'CREATE TRIGGER "([^"]+)" .+? ON "([^"]+)"', sql, flags=re.IGNORECASE)
+            if m is None:
+                conn.execute(sql)
+                continue
+            trigger_name, tablename = m.groups()
+            if tablename not in existing_tables:
+                continue
+            conn.execute(sql)
+            created.append(trigger_name)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    return created
+
 def get_date_time():
     """returns date and time as a string in a pre-formatted format"""
     return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ This is the part of the midv_tolkn plugin that runs database work in worker processes.
+ NOTE - this module is imported by the worker processes and must not import qgis.
+                              -------------------
+        begin                : 2026-10-18
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.request import pathname2url
+
+
+def spatialite_worker_connect(dbpath, readonly=True):
+    """
+    Returns a sqlite3 connection with mod_spatialite loaded, without using qgis.utils.spatialite_connect
+
+    :param dbpath: The database file
+    :param readonly: If True, the database is opened read-only
+    """
+    uri = 'file:{}?mode={}'.format(pathname2url(os.path.abspath(dbpath)), 'ro' if readonly else 'rwc')
+    conn = sqlite3.connect(uri, uri=True)
+    conn.enable_load_extension(True)
+    # Same libraries and entry points as qgis.utils.spatialite_connect
+    for lib, entry_point in [("mod_spatialite", "sqlite3_modspatialite_init"),
+                             ("mod_spatialite.so", "sqlite3_modspatialite_init"),
+                             ("libspatialite.so", "sqlite3_extension_init")]:
+        try:
+            conn.execute("select load_extension('{}', '{}')".format(lib, entry_point))
+        except sqlite3.OperationalError:
+            continue
+        else:
+            break
+    else:
+        conn.close()
+        raise RuntimeError("Cannot find any suitable spatialite module")
+    conn.enable_load_extension(False)
+    return conn
+
+
+def python_executable():
+    """
+    Returns the python interpreter to start worker processes with.
+    Inside QGIS, sys.executable is the QGIS binary and not python.
+    """
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    candidates = [os.path.join(sys.exec_prefix, name) for name in ('pythonw.exe', 'python.exe')]
+    candidates.extend([os.path.join(sys.exec_prefix, 'bin', name) for name in ('python3', 'python')])
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return sys.executable
+
+
+def process_pool(workers):
+    """ Returns a ProcessPoolExecutor using spawned python processes (fork is not safe inside QGIS) """
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(python_executable())
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def run_in_processes(function, arguments_list, workers):
+    """
+    Runs function(*arguments) for every arguments in arguments_list in worker processes
+
+    :param function: A module level function (it must be importable by the worker processes)
+    :param arguments_list: list of argument tuples
+    :param workers: Number of worker processes
+    :return: Yields the results in the order they complete
+    """
+    with process_pool(workers) as pool:
+        futures = [pool.submit(function, *arguments) for arguments in arguments_list]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # If the caller stops early (an error or a cancelled task), the waiting work is dropped
+            for future in futures:
+                future.cancel()
+
+
+def pkuid_ranges(pkuids, number_of_ranges):
+    """
+    Splits a sorted list of pkuids into ranges with about the same number of rows
+
+    >>> pkuid_ranges([1, 2, 3, 5, 8, 13, 21], 3)
+    [(1, 3), (5, 13), (21, 21)]
+    >>> pkuid_ranges([], 3)
+    []
+
+    :return: list of (first_pkuid, last_pkuid)
+    """
+    if not pkuids:
+        return []
+    size = -(-len(pkuids) // max(1, number_of_ranges))
+    return [(pkuids[i], pkuids[min(i + size, len(pkuids)) - 1]) for i in range(0, len(pkuids), size)]
+
+
+def select_pkuid_range(dbpath, sql, first_pkuid, last_pkuid):
+    """
+    Worker function: runs sql with first_pkuid and last_pkuid as parameters on a read-only connection
+
+    :return: The fetched rows
+    """
+    conn = spatialite_worker_connect(dbpath, readonly=True)
+    try:
+        return conn.execute(sql, (first_pkuid, last_pkuid)).fetchall()
+    finally:
+        conn.close()
+
+
+def create_shard(source_db, shard_path, tablename, select, srids):
+    """
+    Worker function: writes the rows of a table in source_db, converted to the design of the new database, into a shard database
+
+    :param source_db: The database to upgrade
+    :param shard_path: The shard database to create
+    :param tablename: The table to read from source_db, the shard table gets the same name
+    :param select: The select expressions (including ST_Transform and the new column names as aliases)
+    :param srids: EPSG-ids needed by ST_Transform. They are inserted into spatial_ref_sys in the shard.
+    :return: (tablename, shard_path, number of rows, seconds)
+    """
+    start = time.time()
+    conn = spatialite_worker_connect(shard_path, readonly=False)
+    try:
+        conn.execute("SELECT InitSpatialMetadata(1, 'NONE')")
+        for srid in srids:
+            conn.execute("SELECT InsertEpsgSrid(?)", (srid, ))
+        conn.commit()
+        conn.execute("ATTACH DATABASE ? AS a", ('file:{}?mode=ro'.format(pathname2url(os.path.abspath(source_db))), ))
+        conn.execute(f'''CREATE TABLE "{tablename}" AS SELECT {select} FROM a."{tablename}" ORDER BY rowid''')
+        conn.commit()
+        rows = conn.execute(f'''SELECT count(*) FROM "{tablename}"''').fetchone()[0]
+        conn.execute("DETACH DATABASE a")
+    finally:
+        conn.close()
+    return tablename, shard_path, rows, time.time() - start
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+ The tests import the plugin folder as the package midv_tolkn, so they can be run from a git checkout
+ (whatever the folder is named) using the python environment of QGIS:
+    python -m pytest tests
+ The tests use plain sqlite3 databases, spatialite is not needed (tests that need spatial functions replace them
+ with python functions). Most plugin modules import qgis, so without qgis only the tests of the modules that
+ don't (midv_tolkn_backup and midv_tolkn_workers) are run, the others are skipped.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'midv_tolkn' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('midv_tolkn', os.path.join(PLUGIN_DIR, '__init__.py'),
+                                                  submodule_search_locations=[PLUGIN_DIR])
+    sys.modules['midv_tolkn'] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules['midv_tolkn'])
+
+
+@pytest.fixture(scope='session', autouse=True)
+def qgis_app():
+    if importlib.util.find_spec('qgis') is None:
+        yield None
+        return
+    from midv_tolkn import midv_tolkn_cli
+    midv_tolkn_cli.start_qgis()
+    yield
+    from midv_tolkn import midv_tolkn_utils
+    midv_tolkn_utils.ConnectionManager.close_all()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import os
+import sqlite3
+
+import pytest
+
+from midv_tolkn import midv_tolkn_backup as backup
+
+
+def make_db(path, rows=2000):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE t (pkuid integer primary key, txt text)""")
+    conn.executemany("""INSERT INTO t (txt) VALUES (?)""", [('row %s ' % i * 20, ) for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+
+def table_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("""SELECT pkuid, txt FROM t ORDER BY pkuid""").fetchall()
+    finally:
+        conn.close()
+
+
+def test_backup_store_restore(tmp_path):
+    dbpath = str(tmp_path / 'db.sqlite')
+    make_db(dbpath)
+    store = backup.BackupStore(dbpath, chunk_size=4096)
+    first, stats = store.backup()
+    assert stats['new_chunks'] == stats['chunks']
+
+    conn = sqlite3.connect(dbpath)
+    conn.execute("""UPDATE t SET txt = 'changed' WHERE pkuid = 1""")
+    conn.commit()
+    conn.close()
+    second, stats = store.backup()
+    assert 0 < stats['new_chunks'] < stats['chunks']
+    assert store.manifests() == [first, second]
+
+    restored = str(tmp_path / 'restored.sqlite')
+    backup.BackupStore.restore(first, restored)
+    assert table_rows(restored)[0][1] != 'changed'
+    backup.BackupStore.restore(second, restored)
+    assert table_rows(restored) == table_rows(dbpath)
+
+
+def test_backup_store_restore_checks_sha256(tmp_path):
+    dbpath = str(tmp_path / 'db.sqlite')
+    make_db(dbpath)
+    store = backup.BackupStore(dbpath, chunk_size=4096)
+    manifest_path = store.backup()[0]
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['chunks'] = manifest['chunks'][:-1]
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    restored = str(tmp_path / 'restored.sqlite')
+    with pytest.raises(ValueError):
+        backup.BackupStore.restore(manifest_path, restored)
+    assert not os.path.exists(restored)
+    assert sorted(os.listdir(str(tmp_path))) == ['db.sqlite', 'db.sqlite_backups']
+
+
+def test_backup_store_manifests_in_the_same_second(tmp_path):
+    dbpath = str(tmp_path / 'db.sqlite')
+    make_db(dbpath, rows=10)
+    store = backup.BackupStore(dbpath)
+    os.makedirs(store.manifest_dir)
+    created = datetime.datetime(2026, 10, 18, 8, 0, 0, 0)
+    paths = [store.new_manifest_path(created) for _ in range(3)]
+    assert len(set(paths)) == 3
+    assert sorted(paths) == paths
+
+    manifests = [store.backup()[0] for _ in range(3)]
+    assert len(set(manifests)) == 3
+    assert all(os.path.getsize(path) > 0 for path in manifests)
+
+
+class CancelDuringCompression(object):
+    """ A feedback that cancels when the compression has started (progress above 50) """
+    def __init__(self):
+        self.progress = 0.0
+
+    def isCanceled(self):
+        return self.progress > 50.0
+
+    def setProgress(self, progress):
+        self.progress = progress
+
+
+@pytest.mark.parametrize('codec', list(backup.CODECS.keys()))
+def test_compressed_backup_round_trip(tmp_path, codec):
+    dbpath = str(tmp_path / 'db.sqlite')
+    make_db(dbpath)
+    bkupname, stats = backup.compressed_backup(dbpath, codec=codec, workers=2, chunk_size=16384)
+    assert stats['size'] == os.path.getsize(dbpath)
+    restored = str(tmp_path / 'restored.sqlite')
+    backup.decompress_backup(bkupname, restored)
+    assert table_rows(restored) == table_rows(dbpath)
+
+
+def test_cancelled_compressed_backup_leaves_no_file(tmp_path):
+    dbpath = str(tmp_path / 'db.sqlite')
+    make_db(dbpath)
+    bkupname = str(tmp_path / 'db.sqlite.gz')
+    with pytest.raises(backup.BackupCancelled):
+        backup.compressed_backup(dbpath, workers=1, chunk_size=4096, bkupname=bkupname, feedback=CancelDuringCompression())
+    assert sorted(os.listdir(str(tmp_path))) == ['db.sqlite']
+
+
+def test_zip_backup(tmp_path):
+    import zipfile
+    dbpath = str(tmp_path / 'db.sqlite')
+    make_db(dbpath)
+    bkupname = backup.zip_backup(dbpath, bkupname=str(tmp_path / 'db.zip'))[0]
+    with zipfile.ZipFile(bkupname) as zf:
+        zf.extractall(str(tmp_path / 'restored'))
+    assert table_rows(str(tmp_path / 'restored' / 'db.sqlite')) == table_rows(dbpath)
+
+    # A failed backup leaves the earlier backup as it was
+    with open(bkupname, 'rb') as f:
+        earlier = f.read()
+    with pytest.raises(sqlite3.Error):
+        backup.zip_backup(str(tmp_path / 'missing' / 'db.sqlite'), bkupname=bkupname)
+    with open(bkupname, 'rb') as f:
+        assert f.read() == earlier
+    assert sorted(os.listdir(str(tmp_path))) == ['db.sqlite', 'db.zip', 'restored']
+
+
+class WritingFeedback(object):
+    """ A feedback that changes the database between the first writes steps of the backup """
+    def __init__(self, dbpath, writes):
+        self.conn = sqlite3.connect(dbpath)
+        self.writes = writes
+
+    def isCanceled(self):
+        return False
+
+    def setProgress(self, progress):
+        if self.writes > 0:
+            self.writes -= 1
+            self.conn.execute("""UPDATE t SET txt = ? WHERE pkuid = 1""", ('changed %s' % self.writes, ))
+            self.conn.commit()
+
+
+def test_snapshot(tmp_path):
+    dbpath = str(tmp_path / 'db.sqlite')
+    make_db(dbpath)
+    timings = backup.snapshot(dbpath, str(tmp_path / 'snapshot.sqlite'), pages=4)
+    assert timings['restarts'] == 0
+    assert 0.0 < timings['max_lock_seconds'] <= timings['lock_seconds'] <= timings['seconds']
+    assert table_rows(str(tmp_path / 'snapshot.sqlite')) == table_rows(dbpath)
+
+
+def test_snapshot_restarts_when_the_database_is_written_to(tmp_path):
+    dbpath = str(tmp_path / 'db.sqlite')
+    make_db(dbpath)
+    feedback = WritingFeedback(dbpath, writes=2)
+    timings = backup.snapshot(dbpath, str(tmp_path / 'snapshot.sqlite'), pages=4, feedback=feedback)
+    assert timings['restarts'] == 2
+    assert table_rows(str(tmp_path / 'snapshot.sqlite')) == table_rows(dbpath)
+
+    feedback = WritingFeedback(dbpath, writes=100)
+    with pytest.raises(backup.BackupRestartLimit):
+        backup.snapshot(dbpath, str(tmp_path / 'snapshot.sqlite'), pages=4, feedback=feedback, max_restarts=3)
+    assert feedback.writes == 100 - 4
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_batch
+
+
+def test_collect_databases(tmp_path):
+    for name in ('b.sqlite', 'a.sqlite', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'c.sqlite').write_bytes(b'')
+    a = str(tmp_path / 'a.sqlite')
+    assert midv_tolkn_batch.collect_databases([str(tmp_path), a]) == [a, str(tmp_path / 'b.sqlite')]
+    assert len(midv_tolkn_batch.collect_databases([str(tmp_path)], recursive=True)) == 3
+
+
+def test_report_is_written_when_a_worker_crashes(tmp_path, monkeypatch):
+    for name in ('a.sqlite', 'b.sqlite', 'c.sqlite'):
+        (tmp_path / name).write_bytes(b'')
+
+    def crash_after_first(function, arguments_list, workers):
+        database, pipeline, options = arguments_list[0]
+        yield {'database': database, 'ok': True, 'seconds': 1.0, 'steps': []}
+        raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+
+    monkeypatch.setattr(midv_tolkn_batch.midv_tolkn_workers, 'run_in_processes', crash_after_first)
+    report = str(tmp_path / 'report.json')
+    summary = midv_tolkn_batch.run_batch([str(tmp_path)], ['vacuum'], jobs=2, report=report)
+    assert summary['succeeded'] == 1
+    assert summary['failed'] == 2
+    assert 'BrokenProcessPool' in summary['error']
+    with open(report, encoding='utf-8') as f:
+        written = json.load(f)
+    assert [(os.path.basename(d['database']), d['ok']) for d in written['databases']] == [('a.sqlite', True), ('b.sqlite', False), ('c.sqlite', False)]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_utils as utils
+
+
+@pytest.fixture
+def dbpath(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE t (a integer)""")
+    conn.commit()
+    conn.close()
+    yield path
+    utils.ConnectionManager.close(path)
+
+
+def test_same_connection_per_database_and_thread(dbpath):
+    conn = utils.ConnectionManager.get(dbpath)
+    assert utils.ConnectionManager.get(os.path.join(os.path.dirname(dbpath), '.', 'db.sqlite')) is conn
+    assert conn.execute("""PRAGMA foreign_keys""").fetchone()[0] == 1
+
+    other = []
+    thread = threading.Thread(target=lambda: (other.append(utils.ConnectionManager.get(dbpath)), utils.ConnectionManager.release_thread()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+
+def test_replaced_file_gets_a_new_connection(dbpath, tmp_path):
+    conn = utils.ConnectionManager.get(dbpath)
+    replacement = str(tmp_path / 'replacement.sqlite')
+    new = sqlite3.connect(replacement)
+    new.execute("""CREATE TABLE replaced (a integer)""")
+    new.commit()
+    new.close()
+    os.replace(replacement, dbpath)
+
+    new_conn = utils.ConnectionManager.get(dbpath)
+    assert new_conn is not conn
+    assert new_conn.execute("""SELECT name FROM sqlite_master WHERE type = 'table'""").fetchall() == [('replaced', )]
+
+
+def test_close(dbpath):
+    conn = utils.ConnectionManager.get(dbpath)
+    utils.ConnectionManager.close(dbpath)
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("""SELECT 1""")
+    assert utils.ConnectionManager.get(dbpath) is not conn
+
+
+def test_cancel_check_interrupts_statements(dbpath):
+    utils.ConnectionManager.set_cancel_check(lambda: True)
+    try:
+        conn = utils.ConnectionManager.get(dbpath)
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("""WITH RECURSIVE s(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM s WHERE i < 1000000) SELECT count(*) FROM s""").fetchone()
+    finally:
+        utils.ConnectionManager.set_cancel_check(None)
+    assert utils.ConnectionManager.get(dbpath).execute("""SELECT count(*) FROM t""").fetchone()[0] == 0
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn.create_tolkn_db import NewDb, TemplateDbCache
+
+
+def test_template_path(tmp_path):
+    cache = TemplateDbCache(cache_dir=str(tmp_path))
+    path = cache.template_path('Version 1.2.3', ['3006', '4326'], '5.0.1')
+    assert os.path.dirname(path) == str(tmp_path)
+    assert os.path.basename(path).startswith('template_Version_1.2.3_epsg_3006_4326_')
+    assert cache.template_path('Version 1.2.3', ['3006', '4326'], '5.0.1') == path
+    # Another spatialite version or other EPSG-ids give another template
+    assert cache.template_path('Version 1.2.3', ['3006', '4326'], '5.1.0') != path
+    assert cache.template_path('Version 1.2.3', ['3010', '4326'], '5.0.1') != path
+
+
+def test_template_path_changes_with_the_sql_files(tmp_path, monkeypatch):
+    cache = TemplateDbCache(cache_dir=str(tmp_path))
+    path = cache.template_path('1.2.3', ['3006', '4326'], '5.0.1')
+    sql_file = tmp_path / 'extra.sql'
+    sql_file.write_text('# -*- coding: utf-8 -*-\nCREATE TABLE x (a);\n')
+    monkeypatch.setattr(TemplateDbCache, 'sqlfiles', TemplateDbCache.sqlfiles + [str(sql_file)])
+    assert cache.template_path('1.2.3', ['3006', '4326'], '5.0.1') != path
+
+
+def test_store_replaces_templates_built_from_older_sql_files(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    cache = TemplateDbCache(cache_dir=str(cache_dir))
+    template = cache.template_path('1.2.3', ['3006', '4326'], '5.0.1')
+    cache_dir.mkdir()
+    old_template = cache_dir / 'template_1.2.3_epsg_3006_4326_0123456789ab.sqlite'
+    other_epsg = cache_dir / 'template_1.2.3_epsg_3010_4326_0123456789ab.sqlite'
+    old_template.write_bytes(b'old')
+    other_epsg.write_bytes(b'other')
+
+    dbpath = tmp_path / 'new.sqlite'
+    dbpath.write_bytes(b'new database')
+    cache.store(str(dbpath), template)
+    with open(template, 'rb') as f:
+        assert f.read() == b'new database'
+    assert sorted(os.listdir(str(cache_dir))) == sorted([os.path.basename(template), other_epsg.name])
+
+
+def test_without_dialogs_doesnt_register_a_connection(tmp_path):
+    newdb = NewDb.without_dialogs(str(tmp_path / 'new.sqlite'), 3006)
+    assert newdb.dbpath == str(tmp_path / 'new.sqlite')
+    assert newdb.epsg_ids_to_keep == ['3006', '4326']
+    assert newdb.register_connection is False
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_utils as utils
+from midv_tolkn.load_tolkn_layers import domain_links, get_domains
+
+
+@pytest.fixture
+def dbpath(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path)
+    for tname in ('zz_gvmag', 'zz_gvflode'):
+        conn.execute(f"""CREATE TABLE "{tname}" (pkuid integer primary key autoincrement, "typ" text unique not null, "beskrivning" text)""")
+    conn.executemany("""INSERT INTO zz_gvmag (typ, beskrivning) VALUES (?, ?)""", [('b', 'berg'), ('a', 'grus'), ('c', None)])
+    conn.executemany("""INSERT INTO zz_gvflode (typ, beskrivning) VALUES (?, ?)""", [('x', 'flöde'), ('y', 'vattendelare')])
+    conn.commit()
+    conn.close()
+    yield path
+    utils.ConnectionManager.close(path)
+
+
+def test_domain_links():
+    links = domain_links('1.1.0', ['gvmag', 'gvflode', 'sprickzon', 'profillinje'])
+    assert links == [('gvmag', 'typ', 'zz_gvmag', 'typ', 'beskrivning'),
+                     ('gvflode', 'typ', 'zz_gvflode', 'typ', 'beskrivning'),
+                     ('gvflode', 'intermag', 'zz_gvflode', 'typ', 'beskrivning')]
+    old_links = domain_links('0.9.0', ['gvmag', 'profillinje'])
+    assert ('gvflode', 'intermag', 'zz_gvmag', 'typ', 'beskrivning') in old_links
+    assert ('profillinje', 'projekt', 'zz_projekt', 'pkuid', 'namn') in old_links
+
+
+def test_get_domains(dbpath):
+    schema = utils.SchemaSnapshot.get(dbpath)
+    links = domain_links('1.1.0', ['gvmag', 'gvflode', 'tillromr'])
+    domains = get_domains(dbpath, schema, links)
+    # zz_tillromr doesn't exist and both gvflode links use the same domain
+    assert list(domains.items()) == [(('zz_gvmag', 'typ', 'beskrivning'), [('b', 'berg'), ('a', 'grus'), ('c', None)]),
+                                     (('zz_gvflode', 'typ', 'beskrivning'), [('x', 'flöde'), ('y', 'vattendelare')])]
+
+
+def test_get_domains_with_other_key_and_value_fields(dbpath):
+    schema = utils.SchemaSnapshot.get(dbpath)
+    links = [('gvmag', 'typ', 'zz_gvmag', 'typ', 'beskrivning'), ('gvmag', 'nr', 'zz_gvmag', 'pkuid', 'typ')]
+    domains = get_domains(dbpath, schema, links)
+    assert domains[('zz_gvmag', 'pkuid', 'typ')] == [(1, 'b'), (2, 'a'), (3, 'c')]
+    assert len(domains[('zz_gvmag', 'typ', 'beskrivning')]) == 3
+
+
+def test_get_domains_without_domain_tables(dbpath):
+    schema = utils.SchemaSnapshot.get(dbpath)
+    assert get_domains(dbpath, schema, []) == {}
+    assert get_domains(dbpath, schema, [('tillromr', 'typ', 'zz_tillromr', 'typ', 'beskrivning')]) == {}
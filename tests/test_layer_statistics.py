@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_utils as utils
+
+
+@pytest.fixture
+def dbpath(tmp_path):
+    """ A database with the spatialite statistics tables (without spatialite, the triggers are replaced by updates) """
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE geometry_columns_statistics (f_table_name text, f_geometry_column text, last_verified timestamp, row_count integer,
+                                                              extent_min_x double, extent_min_y double, extent_max_x double, extent_max_y double)""")
+    conn.execute("""CREATE TABLE geometry_columns_time (f_table_name text, f_geometry_column text, last_insert timestamp, last_update timestamp, last_delete timestamp)""")
+    conn.execute("""INSERT INTO geometry_columns_statistics VALUES ('gvmag', 'geometry', '2026-10-18T10:00:00.000Z', 12, 1.0, 2.0, 3.0, 4.0)""")
+    conn.execute("""INSERT INTO geometry_columns_statistics VALUES ('gvflode', 'geometry', NULL, NULL, NULL, NULL, NULL, NULL)""")
+    conn.execute("""INSERT INTO geometry_columns_time VALUES ('gvmag', 'geometry', '2026-10-18T09:00:00.000Z', '0000-01-01T00:00:00.000Z', '0000-01-01T00:00:00.000Z')""")
+    conn.commit()
+    conn.close()
+    yield path
+    utils.ConnectionManager.close(path)
+
+
+def edit(dbpath, column, timestamp):
+    conn = utils.ConnectionManager.get(dbpath)
+    conn.execute(f"""UPDATE geometry_columns_time SET {column} = ? WHERE f_table_name = 'gvmag'""", (timestamp, ))
+    conn.commit()
+
+
+def test_up_to_date_statistics(dbpath):
+    assert utils.layer_statistics(dbpath, 'gvmag') == (12, (1.0, 2.0, 3.0, 4.0))
+    assert utils.layer_statistics(dbpath, 'GVMAG') == (12, (1.0, 2.0, 3.0, 4.0))
+
+
+def test_missing_statistics(dbpath):
+    assert utils.layer_statistics(dbpath, 'gvflode') is None
+    assert utils.layer_statistics(dbpath, 'gvdel') is None
+    assert utils.layer_statistics(dbpath, 'gvmag', column='other') is None
+
+
+@pytest.mark.parametrize('column', ['last_insert', 'last_update', 'last_delete'])
+def test_statistics_are_stale_after_edits(dbpath, column):
+    edit(dbpath, column, '2026-10-18T10:00:01.000Z')
+    assert utils.layer_statistics(dbpath, 'gvmag') is None
+
+    conn = utils.ConnectionManager.get(dbpath)
+    conn.execute("""UPDATE geometry_columns_statistics SET last_verified = '2026-10-18T10:00:02.000Z' WHERE f_table_name = 'gvmag'""")
+    conn.commit()
+    assert utils.layer_statistics(dbpath, 'gvmag') == (12, (1.0, 2.0, 3.0, 4.0))
+
+
+def test_without_the_statistics_tables(tmp_path):
+    path = str(tmp_path / 'plain.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE gvmag (pkuid integer primary key)""")
+    conn.commit()
+    conn.close()
+    try:
+        assert utils.layer_statistics(path, 'gvmag') is None
+    finally:
+        utils.ConnectionManager.close(path)
+
+
+def test_update_layer_statistics(dbpath):
+    conn = utils.ConnectionManager.get(dbpath)
+    calls = []
+    conn.create_function('UpdateLayerStatistics', -1, lambda *args: calls.append(args) or 1)
+    utils.update_layer_statistics(conn, ['gvmag', 'gvflode'])
+    utils.update_layer_statistics(conn)
+    assert calls == [('gvmag', 'geometry'), ('gvflode', 'geometry'), ()]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from qgis.core import QgsDataSourceUri, QgsWkbTypes
+
+from midv_tolkn import midv_tolkn_utils as utils
+from midv_tolkn.load_tolkn_layers import LoadLayers
+
+
+@pytest.fixture
+def dbpath(tmp_path):
+    """ A database with spatialite 4 style geometry_columns (without spatialite), gvflode has no spatial index """
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE geometry_columns (f_table_name text, f_geometry_column text, geometry_type integer, coord_dimension integer,
+                                                   srid integer, spatial_index_enabled integer)""")
+    for tablename, geometry_type, index_enabled in (('gvmag', 6, 1), ('gvflode', 5, 0)):
+        conn.execute(f"""CREATE TABLE "{tablename}" (pkuid integer primary key autoincrement, typ text, geometry blob)""")
+        conn.execute("""INSERT INTO geometry_columns VALUES (?, 'geometry', ?, 2, 3006, ?)""", (tablename, geometry_type, index_enabled))
+    conn.execute("""CREATE TABLE "idx_gvmag_geometry" (pkid integer primary key, xmin real, xmax real, ymin real, ymax real)""")
+    conn.execute("""CREATE TABLE kommentarer_punkt (id integer primary key, txt text)""")
+    conn.commit()
+    conn.close()
+    yield path
+    utils.ConnectionManager.close(path)
+
+
+def test_schema_geometries(dbpath):
+    schema = utils.SchemaSnapshot.get(dbpath)
+    assert schema.geometry('GVMAG') == (3006, 6, 1)
+    assert schema.geometry('kommentarer_punkt') is None
+    # Only geometry tables are checked, tables that don't exist are ignored
+    assert schema.missing_spatial_indexes(['gvmag', 'gvflode', 'kommentarer_punkt', 'gvdel']) == ['gvflode']
+
+
+def test_layer_uri(dbpath):
+    schema = utils.SchemaSnapshot.get(dbpath)
+    uri = QgsDataSourceUri()
+    uri.setDatabase(dbpath)
+    # layer_uri doesn't use the LoadLayers instance (the constructor shows dialogs and loads the layers)
+    parsed = QgsDataSourceUri(LoadLayers.layer_uri(None, uri, schema, 'gvmag'))
+    assert (parsed.database(), parsed.table(), parsed.geometryColumn()) == (dbpath, 'gvmag', 'geometry')
+    assert parsed.keyColumn() == 'pkuid'
+    assert parsed.srid() == '3006'
+    assert parsed.wkbType() == QgsWkbTypes.MultiPolygon
+
+    # A table without geometry_columns metadata gets no srid or geometry type, the provider looks them up
+    parsed = QgsDataSourceUri(LoadLayers.layer_uri(None, uri, schema, 'kommentarer_punkt'))
+    assert parsed.keyColumn() == 'id'
+    assert parsed.srid() == ''
+    assert parsed.wkbType() == QgsWkbTypes.Unknown
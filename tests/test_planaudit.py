@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_planaudit as planaudit
+from midv_tolkn import midv_tolkn_utils as utils
+
+
+def test_split_statements():
+    sql = """UPDATE t SET a = 'x;y' WHERE pkuid = 1; INSERT INTO log (txt) VALUES ('a;b');  ;"""
+    assert planaudit.split_statements(sql) == ["UPDATE t SET a = 'x;y' WHERE pkuid = 1", "INSERT INTO log (txt) VALUES ('a;b')"]
+
+
+def test_trigger_statements():
+    sql = """CREATE TRIGGER "tau_gvflode_updated" AFTER UPDATE ON "gvflode" WHEN (NEW.namn IS NOT OLD.namn or NEW."typ" IS NOT OLD.typ) BEGIN UPDATE gvflode SET updated = datetime('now','localtime') WHERE pkuid = NEW.pkuid; END;"""
+    name, table, statements = planaudit.trigger_statements(sql)
+    assert (name, table) == ('tau_gvflode_updated', 'gvflode')
+    assert statements == ["SELECT 1 WHERE (:new_namn IS NOT :old_namn or :new_typ IS NOT :old_typ)",
+                          "UPDATE gvflode SET updated = datetime('now','localtime') WHERE pkuid = :new_pkuid"]
+
+
+def test_trigger_statements_update_of_without_when():
+    sql = """CREATE TRIGGER IF NOT EXISTS tau_x AFTER UPDATE OF geometry, typ ON x FOR EACH ROW BEGIN DELETE FROM y WHERE pkuid = OLD.pkuid; INSERT INTO y (pkuid) VALUES (NEW.pkuid); END"""
+    name, table, statements = planaudit.trigger_statements(sql)
+    assert (name, table) == ('tau_x', 'x')
+    assert statements == ["DELETE FROM y WHERE pkuid = :old_pkuid", "INSERT INTO y (pkuid) VALUES (:new_pkuid)"]
+    assert planaudit.trigger_statements("""CREATE TABLE x (a)""") is None
+
+
+def test_shipped_triggers_are_parsed():
+    triggers = [sql for sql in utils.sqlfile_statements('insert_triggers.sql') if sql.upper().startswith('CREATE TRIGGER')]
+    assert triggers
+    for sql in triggers:
+        parsed = planaudit.trigger_statements(sql)
+        assert parsed is not None, sql
+        assert parsed[2], sql
+        for statement in parsed[2]:
+            assert sqlite3.complete_statement(statement + ';'), statement
+            assert 'NEW.' not in statement.upper() and 'OLD.' not in statement.upper(), statement
+
+
+def test_parameters():
+    assert planaudit.parameters("""SELECT * FROM t WHERE a = :a AND b = ':not_a_parameter' AND c = :c""") == {'a': None, 'c': None}
+    assert planaudit.parameters("""SELECT * FROM t WHERE rowid > ? AND rowid <= ? AND txt = '?'""") == (None, None)
+    assert planaudit.parameters("""SELECT 1""") == ()
+
+
+def test_table_aliases():
+    sql = """SELECT t.pkuid FROM tillromr AS t, tillromr_recalc_log l JOIN a."dagvyta" d ON d.pkuid = l.pkuid WHERE t.pkuid = 1"""
+    assert planaudit.table_aliases(sql) == {'t': 'tillromr', 'l': 'tillromr_recalc_log', 'd': 'dagvyta'}
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("""CREATE TABLE big (pkuid integer primary key, x integer)""")
+    conn.execute("""CREATE TABLE other (pkuid integer primary key, x integer)""")
+    yield conn
+    conn.close()
+
+
+def issues(conn, sql, row_counts, **kwargs):
+    return planaudit.plan_issues(planaudit.explain(conn, sql), sql, row_counts, **kwargs)
+
+
+def test_plan_issues_scan(conn):
+    sql = """SELECT * FROM big AS b WHERE x = :x"""
+    assert issues(conn, sql, {'big': 20000}) == ['scan: SCAN b']
+    assert issues(conn, sql, {'big': 100}) == []
+    assert issues(conn, sql, {'big': 20000}, expected_scans=('big', )) == []
+    assert issues(conn, """SELECT * FROM big WHERE pkuid = ?""", {'big': 20000}) == []
+
+
+def test_plan_issues_per_row(conn):
+    sql = """SELECT pkuid, (SELECT count(*) FROM other WHERE other.x = big.x) FROM big"""
+    assert issues(conn, sql, {'big': 50, 'other': 500}) == ['scan per row: SCAN other']
+    # A trigger statement runs once per row, so any scan of a table with rows counts
+    assert issues(conn, """UPDATE other SET x = 1 WHERE x = :new_x""", {'other': 500}, per_row=True) == ['scan per row: SCAN other']
+    # Constant rows and tables without a row count (virtual and temp tables) are never issues
+    assert issues(conn, """SELECT 1 WHERE :new_x IS NOT :old_x""", {}, per_row=True, per_row_rows=0) == []
+
+
+def test_plan_issues_automatic_index(conn):
+    sql = """SELECT * FROM big JOIN other ON big.x = other.x"""
+    assert [issue for issue in issues(conn, sql, {'big': 10, 'other': 10}) if issue.startswith('automatic index')] == \
+           ['automatic index: SEARCH other USING AUTOMATIC COVERING INDEX (x=?)']
+
+
+def test_compare():
+    results = [{'id': 'a', 'issues': ['scan: SCAN t', 'scan: SCAN u']},
+               {'id': 'b', 'issues': []},
+               {'id': 'c', 'issues': ['automatic index: SEARCH l USING AUTOMATIC COVERING INDEX (x=?)']}]
+    baseline = {'a': ['scan: SCAN t'], 'c': ['automatic index: SEARCH l USING AUTOMATIC COVERING INDEX (x=?)']}
+    assert planaudit.compare(baseline, results) == {'a': ['scan: SCAN u']}
+    assert planaudit.compare(planaudit.issues_by_statement(results), results) == {}
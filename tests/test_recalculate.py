@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import struct
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_utils as utils
+
+
+# The geometries are stored as their bounding box (min x, min y, max x, max y), which is enough for the rectangles
+# used here, and the spatial functions used by the recalculation are replaced by python functions.
+def rectangle(*bbox):
+    return struct.pack('4d', *bbox)
+
+
+def bbox(geometry):
+    return struct.unpack('4d', geometry) if geometry else None
+
+
+def area(geometry):
+    box = bbox(geometry)
+    return (box[2] - box[0]) * (box[3] - box[1]) if box else None
+
+
+def intersection(a, b):
+    a, b = bbox(a), bbox(b)
+    if a is None or b is None:
+        return None
+    box = (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+    return rectangle(*box) if box[0] < box[2] and box[1] < box[3] else None
+
+
+def add_spatial_functions(conn):
+    conn.create_function('ST_Area', 1, area)
+    conn.create_function('ST_Intersection', 2, intersection)
+    conn.create_function('ST_Intersects', 2, lambda a, b: intersection(a, b) is not None)
+    conn.create_function('MbrIntersects', 2, lambda a, b: intersection(a, b) is not None)
+    conn.create_function('st_dimension', 1, lambda geometry: 2 if geometry else None)
+    conn.create_function('Envelope', 1, lambda geometry: geometry)
+    conn.create_function('UpdateLayerStatistics', 2, lambda tablename, column: 1)
+
+
+@pytest.fixture
+def dbpath(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE "tillromr"(pkuid integer primary key autoincrement,"namn" text,"typ" text,"gvbildn_mm" double,"andel_t_mag_proc" double,"area_km2" double,"flode_lPs" double, dagvatten_lPs double, "ursprung" text,"kommentar" text, "updated" text, geometry blob)""")
+    conn.execute("""CREATE TABLE "dagvyta"(pkuid integer primary key autoincrement,"typ" text,"markanv" text,"bortledning_proc" double, "ursprung" text, "kommentar" text, geometry blob)""")
+    # An empty SpatialIndex, so the sql uses ST_Intersects and MbrIntersects instead
+    conn.execute("""CREATE TABLE SpatialIndex (f_table_name text, search_frame blob)""")
+    conn.commit()
+    conn.close()
+
+    conn = utils.ConnectionManager.get(path)
+    add_spatial_functions(conn)
+    utils.replace_triggers(path)
+    conn.executemany("""INSERT INTO tillromr (pkuid, gvbildn_mm, andel_t_mag_proc, geometry) VALUES (?, 200.0, 100.0, ?)""",
+                     [(1, rectangle(0, 0, 1000, 1000)), (2, rectangle(2000, 0, 3000, 1000)), (3, rectangle(10000, 10000, 11000, 11000))])
+    conn.executemany("""INSERT INTO dagvyta (pkuid, bortledning_proc, geometry) VALUES (?, 50.0, ?)""",
+                     [(1, rectangle(500, 500, 1500, 1500)), (2, rectangle(20000, 20000, 21000, 21000))])
+    conn.commit()
+    utils.recalculate_tillromr(path)
+    yield path
+    utils.ConnectionManager.close(path)
+
+
+def calculated(conn):
+    return conn.execute("""SELECT pkuid, area_km2, "flode_lPs", "dagvatten_lPs" FROM tillromr ORDER BY pkuid""").fetchall()
+
+
+def log_rows(conn):
+    return conn.execute("""SELECT count(*) FROM tillromr_recalc_log""").fetchone()[0]
+
+
+def edit(conn):
+    """ Changes tillromr 1 and moves dagvyta 1 from tillromr 1 to tillromr 2 """
+    conn.execute("""UPDATE tillromr SET geometry = ? WHERE pkuid = 1""", (rectangle(0, 0, 1000, 2000), ))
+    conn.execute("""UPDATE dagvyta SET geometry = ? WHERE pkuid = 1""", (rectangle(2500, 500, 3500, 1500), ))
+    conn.commit()
+
+
+def test_full_recalculation(dbpath):
+    conn = utils.ConnectionManager.get(dbpath)
+    rows = calculated(conn)
+    assert [row[1] for row in rows] == [1.0, 1.0, 1.0]
+    assert rows[0][3] > 0 and rows[1][3] is None and rows[2][3] is None
+    assert log_rows(conn) == 0
+
+
+def test_tillromr_changed_sql(dbpath):
+    conn = utils.ConnectionManager.get(dbpath)
+    edit(conn)
+    # One row for tillromr 1 and the old and new extent of dagvyta 1
+    assert log_rows(conn) == 3
+    last_log_id = conn.execute("""SELECT max(pkuid) FROM tillromr_recalc_log""").fetchone()[0]
+    assert sorted([row[0] for row in conn.execute(utils.tillromr_changed_sql, {'last_log_id': last_log_id})]) == [1, 2]
+    assert conn.execute(utils.tillromr_changed_sql, {'last_log_id': 0}).fetchall() == []
+
+
+def test_incremental_recalculation_matches_full(dbpath):
+    conn = utils.ConnectionManager.get(dbpath)
+    edit(conn)
+    before = calculated(conn)
+    assert utils.recalculate_tillromr(dbpath, incremental=True) == 2
+    incremental = calculated(conn)
+    assert incremental[1] != before[1]
+    assert incremental[2] == before[2]
+    assert log_rows(conn) == 0
+
+    assert utils.recalculate_tillromr(dbpath) is None
+    assert calculated(conn) == incremental
+
+
+def test_incremental_recalculation_with_an_empty_log(dbpath):
+    conn = utils.ConnectionManager.get(dbpath)
+    before = calculated(conn)
+    assert log_rows(conn) == 0
+    assert utils.recalculate_tillromr(dbpath, incremental=True) == 0
+    assert calculated(conn) == before
+    assert conn.execute("""SELECT count(*) FROM sqlite_temp_master WHERE name = 'tillromr_recalc'""").fetchone()[0] == 0
+
+
+def test_incremental_recalculation_without_the_log(dbpath):
+    conn = utils.ConnectionManager.get(dbpath)
+    conn.execute("""UPDATE tillromr SET area_km2 = NULL""")
+    for (trigger_name, ) in conn.execute("""SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%recalc_log'""").fetchall():
+        conn.execute(f"""DROP TRIGGER "{trigger_name}" """)
+    conn.execute("""DROP TABLE tillromr_recalc_log""")
+    conn.commit()
+    # Everything is recalculated
+    assert utils.recalculate_tillromr(dbpath, incremental=True) is None
+    assert [row[1] for row in calculated(conn)] == [1.0, 1.0, 1.0]
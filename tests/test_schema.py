@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_utils as utils
+
+
+@pytest.fixture
+def dbpath(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE gvflode (pkuid integer primary key, namn text)""")
+    conn.execute("""CREATE TABLE dropped (pkuid integer primary key, namn text)""")
+    conn.execute("""CREATE VIEW gvflode_view AS SELECT pkuid, namn FROM gvflode""")
+    conn.execute("""CREATE VIEW broken_view AS SELECT pkuid FROM dropped""")
+    conn.execute("""INSERT INTO gvflode (pkuid, namn) VALUES (3, 'a')""")
+    # sqlite doesn't check the views when a table is dropped
+    conn.execute("""DROP TABLE dropped""")
+    conn.commit()
+    conn.close()
+    yield path
+    utils.ConnectionManager.close(path)
+
+
+def test_schema_snapshot(dbpath):
+    schema = utils.SchemaSnapshot.get(dbpath)
+    assert schema.tables == ['gvflode']
+    assert schema.columns['gvflode'] == ['pkuid', 'namn']
+    assert schema.primary_keys == {'gvflode': 'pkuid', 'gvflode_view': None}
+    assert schema.row_counts == {'gvflode': 3}
+    assert utils.SchemaSnapshot.get(dbpath) is schema
+
+
+def test_view_over_a_dropped_table_is_skipped(dbpath):
+    schema = utils.SchemaSnapshot.get(dbpath)
+    assert schema.views == ['gvflode_view']
+    assert schema.exists('gvflode_view')
+    assert not schema.exists('broken_view')
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_sqltrace
+from midv_tolkn import midv_tolkn_utils as utils
+from midv_tolkn.midv_tolkn_sqltrace import SqlTrace
+
+
+@pytest.fixture
+def slow_messages(monkeypatch):
+    messages = []
+    monkeypatch.setattr(utils.MessagebarAndLog, 'warning', staticmethod(lambda bar_msg=None, log_msg=None, **kwargs: messages.append(log_msg)))
+    monkeypatch.setenv('MIDV_TOLKN_SQL_TRACE_SLOW_MS', '0')
+    SqlTrace.reset()
+    yield messages
+    SqlTrace.reset()
+
+
+def test_traced_connection(slow_messages):
+    conn = sqlite3.connect(':memory:', factory=midv_tolkn_sqltrace.TracedConnection)
+    conn.execute("""CREATE TABLE t (a integer)""")
+    with SqlTrace.operation('test'):
+        for i in range(3):
+            conn.execute("""INSERT INTO t (a) VALUES (?)""", (i, ))
+    conn.close()
+    inserts = [s for s in SqlTrace.summary() if s['sql'].startswith('INSERT')]
+    assert len(inserts) == 1
+    assert inserts[0]['count'] == 3
+    assert inserts[0]['operation'].startswith('test')
+    assert len([msg for msg in slow_messages if msg.startswith('Slow sql')]) == 4
+
+
+def test_slow_threshold_is_read_once(slow_messages, monkeypatch):
+    assert SqlTrace.slow_seconds() == 0.0
+    monkeypatch.setenv('MIDV_TOLKN_SQL_TRACE_SLOW_MS', '2500')
+    assert SqlTrace.slow_seconds() == 0.0
+    SqlTrace.reset()
+    assert SqlTrace.slow_seconds() == 2.5
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_utils as utils
+from midv_tolkn.load_tolkn_layers import StyleCache, get_db_styles, get_styles_folder
+
+QML = """<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'><qgis version="3.22"><renderer-v2 type="%s"/></qgis>"""
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(StyleCache, '_documents', {})
+    monkeypatch.setattr(StyleCache, '_folders', {})
+
+
+def write(path, text, mtime):
+    with open(str(path), 'w') as f:
+        f.write(text)
+    os.utime(str(path), (mtime, mtime))
+
+
+def test_document_is_parsed_once(tmp_path):
+    stylefile = tmp_path / 'gvmag.qml'
+    write(stylefile, QML % 'singleSymbol', 1000000)
+    document = StyleCache.document(str(stylefile))
+    assert document is not None
+    assert StyleCache.document(str(stylefile)) is document
+
+
+def test_document_is_parsed_again_when_the_file_changes(tmp_path):
+    stylefile = tmp_path / 'gvmag.qml'
+    write(stylefile, QML % 'singleSymbol', 1000000)
+    document = StyleCache.document(str(stylefile))
+    write(stylefile, QML % 'categorizedSymbol', 1000010)
+    changed = StyleCache.document(str(stylefile))
+    assert changed is not document
+    assert 'categorizedSymbol' in changed.toString()
+
+
+def test_missing_and_invalid_files(tmp_path):
+    assert StyleCache.document(str(tmp_path / 'missing.qml')) is None
+    stylefile = tmp_path / 'invalid.qml'
+    write(stylefile, '<qgis><renderer-v2>', 1000000)
+    assert StyleCache.document(str(stylefile)) is None
+    # The failed parse is cached as well, until the file changes
+    assert list(StyleCache._documents.values()) == [(1000000, None)]
+    write(stylefile, QML % 'singleSymbol', 1000010)
+    assert StyleCache.document(str(stylefile)) is not None
+
+
+def test_version_folders(tmp_path):
+    for version in ('1_0_0', '2_1_0'):
+        (tmp_path / version).mkdir()
+    (tmp_path / 'readme.txt').write_text('not a folder')
+    os.utime(str(tmp_path), (1000000, 1000000))
+    folders = StyleCache.version_folders(str(tmp_path))
+    assert list(folders.items()) == [('2.1.0', str(tmp_path / '2_1_0')), ('1.0.0', str(tmp_path / '1_0_0'))]
+    assert StyleCache.version_folders(str(tmp_path)) is folders
+
+    (tmp_path / '3_0_0').mkdir()
+    os.utime(str(tmp_path), (1000010, 1000010))
+    assert list(StyleCache.version_folders(str(tmp_path)).keys()) == ['3.0.0', '2.1.0', '1.0.0']
+
+
+def test_get_styles_folder():
+    folder = get_styles_folder(None)
+    assert os.path.isdir(folder)
+    assert os.path.dirname(folder) == os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'layer_styles')
+
+
+def test_get_db_styles(tmp_path):
+    dbpath = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(dbpath)
+    conn.commit()
+    conn.close()
+    try:
+        assert get_db_styles(dbpath) == {}
+        conn = utils.ConnectionManager.get(dbpath)
+        conn.execute("""CREATE TABLE layer_styles (id integer primary key, f_table_name text, styleQML text, useAsDefault boolean, update_time timestamp)""")
+        conn.executemany("""INSERT INTO layer_styles (f_table_name, styleQML, useAsDefault, update_time) VALUES (?, ?, ?, ?)""",
+                         [('gvmag', 'new', 1, '2026-10-18 10:00:00'), ('gvmag', 'old', 1, '2026-10-17 10:00:00'),
+                          ('gvmag', 'not default', 0, '2026-10-19 10:00:00'), ('gvflode', None, 1, '2026-10-18 10:00:00')])
+        conn.commit()
+        # The newest default style of each table
+        assert get_db_styles(dbpath) == {'gvmag': 'new'}
+    finally:
+        utils.ConnectionManager.close(dbpath)
+
+
+class Layer(object):
+    """ Records the documents imported by StyleCache """
+    def __init__(self):
+        self.documents = []
+
+    def importNamedStyle(self, document):
+        self.documents.append(document)
+        return True, ''
+
+
+def test_apply_qml_parses_each_qml_once():
+    first, second = Layer(), Layer()
+    assert StyleCache.apply_qml(first, QML % 'singleSymbol')
+    assert StyleCache.apply_qml(second, QML % 'singleSymbol')
+    assert first.documents[0] is second.documents[0]
+    assert StyleCache.apply_qml(second, QML % 'categorizedSymbol')
+    assert second.documents[1] is not second.documents[0]
+    invalid = Layer()
+    assert not StyleCache.apply_qml(invalid, '<qgis><renderer-v2>')
+    assert invalid.documents == []
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_tasks as tasks
+from midv_tolkn import midv_tolkn_utils as utils
+
+
+@pytest.fixture
+def dbpath(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE t (pkuid integer primary key, txt text)""")
+    conn.commit()
+    conn.close()
+    yield path
+    utils.ConnectionManager.close(path)
+
+
+def rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("""SELECT txt FROM t ORDER BY pkuid""").fetchall()
+    finally:
+        conn.close()
+
+
+def insert(dbpath, txt, feedback=None):
+    conn = utils.ConnectionManager.get(dbpath)
+    conn.execute("""INSERT INTO t (txt) VALUES (?)""", (txt, ))
+    feedback.setProgress(50.0)
+    conn.commit()
+    return txt
+
+
+def test_run(dbpath):
+    finished = []
+    task = tasks.DbTask('insert', dbpath, insert, dbpath, 'a', on_finished=finished.append)
+    assert task.run()
+    assert task.result == 'a' and task.error is None
+    task.finished(True)
+    assert finished == ['a']
+    assert rows(dbpath) == [('a', )]
+
+
+def test_failed_function(dbpath, monkeypatch):
+    def fail(feedback=None):
+        raise ValueError('no luck')
+    messages = []
+    monkeypatch.setattr(utils.MessagebarAndLog, 'critical', staticmethod(lambda **kwargs: messages.append(kwargs)))
+    task = tasks.DbTask('fail', dbpath, fail, on_finished=lambda result: pytest.fail("on_finished called"))
+    assert not task.run()
+    assert 'ValueError: no luck' in task.error
+    task.finished(False)
+    assert len(messages) == 1 and 'no luck' in messages[0]['log_msg']
+
+
+def test_cancel_interrupts_the_sql_and_rolls_back(dbpath):
+    def insert_and_cancel(dbpath, feedback=None):
+        conn = utils.ConnectionManager.get(dbpath)
+        conn.execute("""INSERT INTO t (txt) VALUES ('rolled back')""")
+        feedback.cancel()
+        conn.execute("""WITH RECURSIVE s(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM s WHERE i < 10000000) SELECT count(*) FROM s""").fetchone()
+        conn.commit()
+    task = tasks.DbTask('cancel', dbpath, insert_and_cancel, dbpath)
+    assert not task.run()
+    # A cancelled task is not an error
+    assert task.error is None
+    assert rows(dbpath) == []
+
+
+class TaskManager(object):
+    """ Records the tasks instead of running them """
+    def __init__(self):
+        self.tasks = []
+
+    def addTask(self, task):
+        self.tasks.append(task)
+
+
+@pytest.fixture
+def task_manager(monkeypatch):
+    manager = TaskManager()
+    monkeypatch.setattr(tasks, 'QgsApplication', type('QgsApplication', (object, ), {'taskManager': staticmethod(lambda: manager)}))
+    monkeypatch.setattr(tasks.DbTaskQueue, '_queues', {})
+    monkeypatch.setattr(tasks.DbTaskQueue, '_running', {})
+    return manager
+
+
+def test_one_task_at_a_time_per_database(dbpath, tmp_path, task_manager):
+    first = tasks.run_in_task('first', dbpath, insert, dbpath, 'first')
+    second = tasks.run_in_task('second', dbpath, insert, dbpath, 'second')
+    other = tasks.run_in_task('other', str(tmp_path / 'other.sqlite'), insert, dbpath, 'other')
+    assert task_manager.tasks == [first, other]
+    first.taskCompleted.emit()
+    assert task_manager.tasks == [first, other, second]
+    # A cancelled or failed task also starts the next one
+    second.taskTerminated.emit()
+    assert list(tasks.DbTaskQueue._running.values()) == [other]
+    assert list(tasks.DbTaskQueue._queues.keys()) == [os.path.normcase(os.path.realpath(other.dbpath))]
+
+
+def test_cancel_all(dbpath, task_manager, monkeypatch):
+    first = tasks.run_in_task('first', dbpath, insert, dbpath, 'first')
+    tasks.run_in_task('second', dbpath, insert, dbpath, 'second')
+    cancelled = []
+    monkeypatch.setattr(first, 'cancel', lambda: cancelled.append(first))
+    tasks.DbTaskQueue.cancel_all()
+    assert cancelled == [first]
+    first.taskTerminated.emit()
+    assert task_manager.tasks == [first]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_utils as utils
+
+
+@pytest.fixture
+def dbpath(tmp_path):
+    """ A database with only gvflode, an old plugin trigger and a user trigger """
+    path = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE gvflode (pkuid integer primary key, namn text, typ text, ursprung text, kommentar text,
+                                          intermag text, updated text, geometry blob)""")
+    conn.execute("""CREATE TABLE user_log (txt text)""")
+    conn.execute("""CREATE TRIGGER "tau_gvflode_old" AFTER UPDATE ON gvflode BEGIN UPDATE gvflode SET updated = 'old trigger'; END""")
+    conn.execute("""CREATE TRIGGER "my_trigger" AFTER INSERT ON gvflode BEGIN INSERT INTO user_log (txt) VALUES ('user'); END""")
+    conn.commit()
+    conn.close()
+    yield path
+    utils.ConnectionManager.close(path)
+
+
+def trigger_names(conn):
+    return sorted([row[0] for row in conn.execute("""SELECT name FROM sqlite_master WHERE type = 'trigger'""")])
+
+
+def test_replace_triggers(dbpath):
+    created = utils.replace_triggers(dbpath)
+    assert sorted(created) == ['tai_gvflode_updated', 'tau_gvflode_updated']
+    conn = utils.ConnectionManager.get(dbpath)
+    # The old plugin trigger is dropped, the user trigger is kept and triggers for missing tables are skipped
+    assert trigger_names(conn) == ['my_trigger', 'tai_gvflode_updated', 'tau_gvflode_updated']
+    assert utils.replace_triggers(dbpath) == created
+
+
+def test_update_trigger_only_touches_the_updated_row(dbpath):
+    utils.replace_triggers(dbpath)
+    conn = utils.ConnectionManager.get(dbpath)
+    conn.executemany("""INSERT INTO gvflode (pkuid, namn, geometry) VALUES (?, ?, x'00')""", [(1, 'a'), (2, 'b')])
+    assert conn.execute("""SELECT count(*) FROM gvflode WHERE updated IS NULL""").fetchone()[0] == 0
+    conn.execute("""UPDATE gvflode SET updated = 'unchanged'""")
+    conn.execute("""UPDATE gvflode SET namn = 'changed' WHERE pkuid = 1""")
+    conn.commit()
+    assert conn.execute("""SELECT pkuid, updated = 'unchanged' FROM gvflode ORDER BY pkuid""").fetchall() == [(1, 0), (2, 1)]
+    assert conn.execute("""SELECT count(*) FROM user_log""").fetchone()[0] == 2
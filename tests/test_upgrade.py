@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_utils as utils
+
+
+def batch_upgrade(tmp_path, source_values, batch_size=3, resume=False):
+    """ Returns an UpgradeDatabase set up for copy_in_batches from a.t (with source_values) into t """
+    source_db = str(tmp_path / 'source.sqlite')
+    target_db = str(tmp_path / 'target.sqlite')
+    source = sqlite3.connect(source_db)
+    source.execute("""CREATE TABLE IF NOT EXISTS t (pkuid integer primary key, v integer)""")
+    source.execute("""DELETE FROM t""")
+    source.executemany("""INSERT INTO t (pkuid, v) VALUES (?, ?)""", list(enumerate(source_values, start=1)))
+    source.commit()
+    source.close()
+
+    conn = sqlite3.connect(target_db)
+    conn.execute("""CREATE TABLE IF NOT EXISTS t (pkuid integer primary key, v integer CHECK (v < 100))""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS upgrade_checkpoint (tablename text primary key, source_db text, last_rowid integer, rows_copied integer, done integer)""")
+    conn.execute("""ATTACH DATABASE ? AS a""", (source_db, ))
+    upgrade = utils.UpgradeDatabase.__new__(utils.UpgradeDatabase)
+    upgrade.conn = conn
+    upgrade.curs = conn.cursor()
+    upgrade.source_db = source_db
+    upgrade.target_db = target_db
+    upgrade.batch_size = batch_size
+    upgrade.resume = resume
+    return upgrade
+
+
+def checkpoint(upgrade):
+    return upgrade.curs.execute("""SELECT last_rowid, rows_copied, done FROM upgrade_checkpoint WHERE tablename = 't'""").fetchone()
+
+
+def test_copy_in_batches(tmp_path):
+    upgrade = batch_upgrade(tmp_path, range(10))
+    upgrade.copy_in_batches('t', 'INSERT OR IGNORE INTO t (pkuid, v) SELECT pkuid, v FROM a."t"')
+    assert upgrade.curs.execute("""SELECT count(*) FROM t""").fetchone()[0] == 10
+    assert checkpoint(upgrade) == (10, 10, 1)
+
+
+def test_failed_batch_raises_and_keeps_checkpoint(tmp_path):
+    values = list(range(10))
+    values[4] = 1000  # pkuid 5 breaks the CHECK constraint, in the second batch
+    sql = 'INSERT INTO t (pkuid, v) SELECT pkuid, v FROM a."t"'
+    upgrade = batch_upgrade(tmp_path, values)
+    with pytest.raises(sqlite3.IntegrityError):
+        upgrade.copy_in_batches('t', sql)
+    assert [row[0] for row in upgrade.curs.execute("""SELECT pkuid FROM t ORDER BY pkuid""")] == [1, 2, 3]
+    assert checkpoint(upgrade) == (3, 3, 0)
+    upgrade.conn.close()
+
+    # Resumed after the source is fixed, the copy continues after the last checkpoint
+    upgrade = batch_upgrade(tmp_path, range(10), resume=True)
+    upgrade.copy_in_batches('t', sql)
+    assert upgrade.curs.execute("""SELECT count(*) FROM t""").fetchone()[0] == 10
+    assert checkpoint(upgrade) == (10, 10, 1)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from midv_tolkn import midv_tolkn_utils as utils
+
+
+def delete_rows(path):
+    """ Fills t and deletes most of it, so the database has free pages """
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS t (pkuid integer primary key, txt text)""")
+    conn.executemany("""INSERT INTO t (txt) VALUES (?)""", [('row %s ' % i * 50, ) for i in range(2000)])
+    conn.commit()
+    conn.execute("""DELETE FROM t WHERE pkuid > 10""")
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def dbpath(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    delete_rows(path)
+    yield path
+    utils.ConnectionManager.close(path)
+
+
+def auto_vacuum(path):
+    return utils.ConnectionManager.get(path).execute("""PRAGMA auto_vacuum""").fetchone()[0]
+
+
+def test_full_vacuum(dbpath):
+    assert auto_vacuum(dbpath) == 0
+    result = utils.vacuum_db(dbpath, 'full')
+    assert result['freelist_before'] > 0
+    assert result['freelist_after'] == 0
+    assert result['page_count_after'] < result['page_count_before']
+    # The database gets auto_vacuum = INCREMENTAL
+    assert auto_vacuum(dbpath) == 2
+
+
+def test_incremental_vacuum(dbpath):
+    utils.vacuum_db(dbpath, 'full')
+    utils.ConnectionManager.close(dbpath)
+    delete_rows(dbpath)
+    result = utils.vacuum_db(dbpath, 'incremental', step_pages=10)
+    assert result['freelist_before'] > 10
+    assert result['freelist_after'] == 0
+    assert result['page_count_after'] == result['page_count_before'] - result['freelist_before']
+
+
+def test_incremental_vacuum_without_auto_vacuum(dbpath):
+    result = utils.vacuum_db(dbpath, 'incremental')
+    assert result['freelist_before'] > 0
+    assert result['freelist_after'] == result['freelist_before']
+
+
+def test_vacuum_into(dbpath, tmp_path):
+    target = str(tmp_path / 'compacted.sqlite')
+    result = utils.vacuum_db(dbpath, 'into', target_path=target)
+    assert result['freelist_after'] == 0
+    assert result['page_count_after'] < result['page_count_before']
+    # The database itself is not changed
+    assert utils.ConnectionManager.get(dbpath).execute("""PRAGMA freelist_count""").fetchone()[0] == result['freelist_before']
+    conn = sqlite3.connect(target)
+    assert conn.execute("""SELECT count(*) FROM t""").fetchone()[0] == 10
+    conn.close()
+
+    with pytest.raises(ValueError):
+        utils.vacuum_db(dbpath, 'into', target_path=target)
+    assert os.path.getsize(target) == result['page_count_after'] * result['page_size']
+
+
+def test_unknown_mode(dbpath):
+    with pytest.raises(ValueError):
+        utils.vacuum_db(dbpath, 'quick')
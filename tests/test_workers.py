@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import operator
+import os
+import sqlite3
+
+import pytest
+
+from midv_tolkn import midv_tolkn_workers as workers
+
+
+def test_pkuid_ranges():
+    assert workers.pkuid_ranges([1, 2, 3, 5, 8, 13, 21], 3) == [(1, 3), (5, 13), (21, 21)]
+    assert workers.pkuid_ranges([], 3) == []
+    assert workers.pkuid_ranges([4, 7], 5) == [(4, 4), (7, 7)]
+    assert workers.pkuid_ranges([4, 7], 0) == [(4, 7)]
+
+
+@pytest.mark.parametrize('number_of_ranges', [1, 4, 7, 100])
+def test_pkuid_ranges_cover_every_pkuid_once(number_of_ranges):
+    pkuids = list(range(3, 300, 7))
+    ranges = workers.pkuid_ranges(pkuids, number_of_ranges)
+    assert len(ranges) <= number_of_ranges
+    assert [pkuid for first, last in ranges for pkuid in pkuids if first <= pkuid <= last] == pkuids
+
+
+def test_python_executable():
+    assert os.path.isfile(workers.python_executable())
+
+
+def test_run_in_processes():
+    assert sorted(workers.run_in_processes(operator.add, [(1, 2), (3, 4), (5, 6)], 2)) == [3, 7, 11]
+    with pytest.raises(ZeroDivisionError):
+        list(workers.run_in_processes(operator.truediv, [(1, 0)], 1))
+
+
+def test_select_pkuid_range(tmp_path):
+    dbpath = str(tmp_path / 'db.sqlite')
+    conn = sqlite3.connect(dbpath)
+    conn.execute("""CREATE TABLE t (pkuid integer primary key, x integer)""")
+    conn.executemany("""INSERT INTO t (pkuid, x) VALUES (?, ?)""", [(pkuid, pkuid * 10) for pkuid in range(1, 51)])
+    conn.commit()
+    conn.close()
+    try:
+        workers.spatialite_worker_connect(dbpath).close()
+    except (RuntimeError, AttributeError):
+        pytest.skip("mod_spatialite can't be loaded")
+    sql = """SELECT pkuid, x * 2 FROM t WHERE pkuid BETWEEN ? AND ?"""
+    rows = []
+    for result in workers.run_in_processes(workers.select_pkuid_range, [(dbpath, sql, first, last) for first, last in
+                                                                        workers.pkuid_ranges(list(range(1, 51)), 4)], 2):
+        rows.extend(result)
+    assert sorted(rows) == [(pkuid, pkuid * 20) for pkuid in range(1, 51)]